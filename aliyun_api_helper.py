@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+阿里云API调用公共模块，供慢查询报告小工具（RDS / PolarDB）共用。
+1. run_concurrently: 使用有界线程池并发执行，按输入顺序返回结果；
+2. fetch_all_pages: 单个地域内的分页接口并发翻页，按页序合并结果；
+3. iter_pages: 分页接口逐页惰性读取，调用方提前结束迭代时不再请求后续页；
+4. AsyncAliyunClient: asyncio 调用层，按 Action 使用令牌桶限速，可同时发起数百个请求；
+5. AliyunApiCaller: 统一调用入口，识别限流与临时错误码后抖动退避重试，并按 AIMD 自适应调整并发，
+   传入 Metrics 时记录每次调用的结果、耗时与返回数据量。
+==========================================================================================
+"""
+# Build-in Modules
+import math
+import time
+import random
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 3rd-part Modules
+from retry.api import retry_call
+
+# 默认并发线程数（地域级并发）
+MAX_WORKERS = 8
+# 单个地域内同时进行的翻页请求数
+REGION_CONCURRENCY = 2
+# 分页接口默认每页条数
+PAGE_SIZE = 100
+# asyncio 调用层同时在途的请求数
+ASYNC_CONCURRENCY = 100
+# 每个 Action 默认每秒请求数，小于等于0表示不限速
+DEFAULT_RATE_LIMIT = 20
+# 限流与临时错误的最大尝试次数、首次退避秒数、最大退避秒数
+RETRY_TRIES = 6
+RETRY_DELAY = 1
+RETRY_MAX_DELAY = 30
+# AIMD 自适应并发的初始值与上限
+AIMD_INITIAL = 8
+MAX_IN_FLIGHT = 64
+# 限流错误码，以 Throttling 开头的错误码均视为限流
+THROTTLING_CODES = ('Throttling', 'Throttling.User', 'Throttling.Api', 'Throttling.Resource', 'Throttling.Concurrent')
+# 可重试的临时错误码
+TRANSIENT_CODES = ('ServiceUnavailable', 'InternalError', 'UnknownError', 'ServiceTimeout', 'SystemBusy',
+                   'RequestTimeout', 'OperationConflict')
+
+
+def run_concurrently(func, items, max_workers=MAX_WORKERS):
+    """
+    使用有界线程池并发执行 func(item)
+    :param func: 单个元素的处理函数
+    :param items: 待处理的元素列表
+    :param max_workers: 最大并发数，小于等于1时退化为顺序执行
+    :return: list 与 items 顺序一致的结果
+    """
+    items = list(items)
+    if not items:
+        return []
+    if max_workers <= 1 or len(items) == 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+def get_items(api_res, items_path):
+    """
+    按路径从接口返回值中取出列表，例如 ("Items", "DBInstance")
+    """
+    data = api_res or {}
+    for key in items_path:
+        data = data.get(key, {}) if isinstance(data, dict) else {}
+    return data if isinstance(data, list) else []
+
+
+def fetch_all_pages(fetch_page, items_path, page_size=PAGE_SIZE, concurrency=REGION_CONCURRENCY):
+    """
+    分页接口并发翻页
+    1. 先请求第一页，根据 TotalRecordCount 计算总页数；
+    2. 剩余页按 concurrency 并发请求，结果按页序合并；
+    3. 接口未返回 TotalRecordCount 时退化为逐页请求直到空页。
+    :param fetch_page: fetch_page(page_number) -> api_res
+    :param items_path: 列表在返回值中的路径
+    :return: list
+    """
+    first_page = fetch_page(1)
+    items = get_items(first_page, items_path)
+    if not items:
+        return []
+
+    total = (first_page or {}).get("TotalRecordCount")
+    if total is None:
+        page_num = 2
+        while True:
+            page_items = get_items(fetch_page(page_num), items_path)
+            if not page_items:
+                break
+            items = items + page_items
+            page_num = page_num + 1
+        return items
+
+    page_count = int(math.ceil(int(total) / float(page_size)))
+    for page_items in run_concurrently(lambda x: get_items(fetch_page(x), items_path),
+                                       range(2, page_count + 1), concurrency):
+        items = items + page_items
+    return items
+
+
+def iter_pages(fetch_page, items_path, page_size=PAGE_SIZE, progress=None):
+    """
+    分页接口逐页惰性读取，逐条产出记录
+    :param fetch_page: fetch_page(page_number) -> api_res
+    :param items_path: 列表在返回值中的路径
+    :param progress: dict，翻页结束时写入 complete（多次翻页时全部读完才为 True）
+    :return: generator
+    """
+    page_num = 1
+    fetched = 0
+    while True:
+        api_res = fetch_page(page_num)
+        page_items = get_items(api_res, items_path)
+        total = (api_res or {}).get("TotalRecordCount")
+        if not page_items:
+            # 接口调用失败返回 {} 或错误码，或已读取的条数少于 TotalRecordCount，均为未读完
+            set_complete(progress, is_valid_page(api_res, items_path) and fetched >= int(total))
+            return
+        for item in page_items:
+            yield item
+        fetched = fetched + len(page_items)
+        if (total is not None and fetched >= int(total)) or len(page_items) < page_size:
+            set_complete(progress, is_valid_page(api_res, items_path) and fetched >= int(total))
+            return
+        page_num = page_num + 1
+
+
+def is_valid_page(api_res, items_path):
+    """
+    正常的分页返回：没有错误码，且包含 TotalRecordCount 与列表字段，
+    例如 {'Code': 'Forbidden.RAM', 'Message': ...} 不是空结果
+    """
+    return isinstance(api_res, dict) and not api_res.get("Code") and api_res.get("TotalRecordCount") is not None \
+        and items_path[0] in api_res
+
+
+def set_complete(progress, complete):
+    if progress is not None:
+        progress["complete"] = progress.get("complete", True) and complete
+
+
+def parse_rate_limits(rate_limits):
+    """
+    解析命令行传入的限速配置
+    :param rate_limits: "DescribeSlowLogs=20,DescribeSlowLogRecords=10"
+    :return: dict {Action: 每秒请求数}
+    """
+    result = {}
+    for item in filter(None, (rate_limits or '').split(',')):
+        action, _, rate = item.partition('=')
+        result[action.strip()] = float(rate)
+    return result
+
+
+class TokenBucket:
+    """
+    asyncio 令牌桶：每秒补充 rate 个令牌，最多积攒 capacity 个，
+    需在事件循环内创建（兼容 Python 3.7 的 asyncio.Lock 绑定规则）
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens = self.tokens - 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncAliyunClient:
+    """
+    阿里云API的 asyncio 调用层
+    aliyun_sdk 只提供阻塞的 requests 调用，因此每个请求在线程池中执行，
+    由事件循环负责调度：Semaphore 控制在途请求数，TokenBucket 按 Action 限速。
+    aliyun 为 AliyunApiCaller 时由本层重试：每次尝试都重新获取令牌，退避等待在事件循环中进行，
+    不占用线程池和在途请求数。
+    需在事件循环内创建。
+    """
+
+    def __init__(self, aliyun, concurrency=ASYNC_CONCURRENCY, rate_limits=None, default_rate=DEFAULT_RATE_LIMIT):
+        self.aliyun = aliyun
+        self.rate_limits = rate_limits or {}
+        self.default_rate = default_rate
+        self.buckets = {}
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def get_bucket(self, action):
+        if action not in self.buckets:
+            self.buckets[action] = TokenBucket(self.rate_limits.get(action, self.default_rate))
+        return self.buckets[action]
+
+    async def call_once(self, func, product, **params):
+        await self.get_bucket(params.get("Action")).acquire()
+        async with self.semaphore:
+            return await asyncio.get_event_loop().run_in_executor(
+                self.executor, functools.partial(func, product, **params))
+
+    async def call(self, product, **params):
+        """
+        调用单个API，异常（包括重试耗尽的 RetryableApiError）与错误码（ApiError）直接抛出，
+        由调用方把实例标记为获取失败，不把失败的页当作没有数据
+        """
+        action = params.get("Action")
+        if not isinstance(self.aliyun, AliyunApiCaller):
+            status_code, api_res = await self.call_once(self.aliyun.common, product, **params)
+            return check_api_res(action, api_res)
+        # 与 AliyunApiCaller.common 相同的重试次数与退避，重试在令牌桶之前，限速对每次尝试生效
+        tries, delay = self.aliyun.tries, self.aliyun.delay
+        while True:
+            try:
+                status_code, api_res = await self.call_once(self.aliyun.call_once, product, **params)
+                return check_api_res(action, api_res)
+            except RetryableApiError:
+                tries = tries - 1
+                if not tries:
+                    self.aliyun.observe_exhausted(action)
+                    raise
+            await asyncio.sleep(delay)
+            delay = self.aliyun.next_delay(delay)
+
+    async def iter_pages(self, product, items_path, page_size=PAGE_SIZE, **params):
+        """
+        逐页读取分页接口，每次产出一页的列表，调用方提前结束时不再请求后续页
+        """
+        page_num = 1
+        fetched = 0
+        while True:
+            api_res = await self.call(product, PageSize=page_size, PageNumber=page_num, **params)
+            page_items = get_items(api_res, items_path)
+            if not page_items:
+                return
+            yield page_items
+            fetched = fetched + len(page_items)
+            total = (api_res or {}).get("TotalRecordCount")
+            if (total is not None and fetched >= int(total)) or len(page_items) < page_size:
+                return
+            page_num = page_num + 1
+
+    async def for_each_page(self, product, items_path, callback, page_size=PAGE_SIZE, **params):
+        """
+        并发读取分页接口：先取第一页得到 TotalRecordCount，其余页同时请求，
+        每页返回后立即调用 callback(page_num, page_items)，不在内存中合并所有页
+        """
+        api_res = await self.call(product, PageSize=page_size, PageNumber=1, **params)
+        page_items = get_items(api_res, items_path)
+        if not page_items:
+            return
+        callback(1, page_items)
+        total = (api_res or {}).get("TotalRecordCount")
+        if total is None:
+            page_num = 2
+            while len(page_items) >= page_size:
+                api_res = await self.call(product, PageSize=page_size, PageNumber=page_num, **params)
+                page_items = get_items(api_res, items_path)
+                if not page_items:
+                    break
+                callback(page_num, page_items)
+                page_num = page_num + 1
+            return
+
+        async def fetch_page(page_num):
+            res = await self.call(product, PageSize=page_size, PageNumber=page_num, **params)
+            callback(page_num, get_items(res, items_path))
+
+        page_count = int(math.ceil(int(total) / float(page_size)))
+        await asyncio.gather(*map(fetch_page, range(2, page_count + 1)))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class ApiError(Exception):
+    """
+    接口返回了错误码
+    """
+
+    def __init__(self, action, code, message=''):
+        super(ApiError, self).__init__('{} {} {}'.format(action, code, message).strip())
+        self.action = action
+        self.code = code
+
+
+class RetryableApiError(ApiError):
+    """
+    限流或临时错误，由 AliyunApiCaller 退避重试
+    """
+
+    def __init__(self, action, code, message='', throttled=False):
+        super(RetryableApiError, self).__init__(action, code, message)
+        self.throttled = throttled
+
+
+def check_api_res(action, api_res):
+    """
+    返回值包含错误码时抛出 ApiError，避免把没有权限、参数错误等当作没有数据
+    """
+    if isinstance(api_res, dict) and api_res.get('Code'):
+        raise ApiError(action, api_res['Code'], api_res.get('Message', ''))
+    return api_res
+
+
+def is_throttling(code):
+    return bool(code) and (code in THROTTLING_CODES or str(code).startswith('Throttling'))
+
+
+def is_transient(code):
+    return bool(code) and code in TRANSIENT_CODES
+
+
+class AIMDLimiter:
+    """
+    AIMD 自适应并发：请求成功时并发上限加性增加（每完成约 limit 个请求 +1），
+    被限流时乘性减少（乘以 decrease），上限在 [min_limit, max_limit] 之间
+    """
+
+    def __init__(self, initial=AIMD_INITIAL, min_limit=1, max_limit=MAX_IN_FLIGHT, decrease=0.5):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.decrease = decrease
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight = self.in_flight + 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight = self.in_flight - 1
+            if throttled:
+                self.limit = max(float(self.min_limit), self.limit * self.decrease)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+
+class AliyunApiCaller:
+    """
+    阿里云API统一调用入口，与 AliyunClient.common 用法一致：
+    1. 返回限流或临时错误码时抖动退避重试，重试耗尽后抛出 RetryableApiError，
+       慢查询相关的 get_describe_* 不捕获该异常（返回错误码时抛出 ApiError），实例被标记为获取失败，
+       不再当作空结果静默丢弃；
+    2. 在途请求数由 AIMDLimiter 控制，被限流时自动降低并发，恢复后逐步提高；
+    3. 传入 metrics（aliyun_metrics.Metrics）时记录每次尝试，耗时不包含等待并发额度的时间。
+    """
+
+    def __init__(self, aliyun, tries=RETRY_TRIES, delay=RETRY_DELAY, max_delay=RETRY_MAX_DELAY, limiter=None,
+                 metrics=None):
+        self.aliyun = aliyun
+        self.tries = tries
+        self.delay = delay
+        self.max_delay = max_delay
+        self.limiter = limiter or AIMDLimiter()
+        self.metrics = metrics
+
+    def call_once(self, product, **params):
+        throttled = False
+        outcome, api_res = 'error', None
+        self.limiter.acquire()
+        started = time.monotonic()
+        try:
+            status_code, api_res = self.aliyun.common(product, **params)
+            code = api_res.get('Code') if isinstance(api_res, dict) else None
+            outcome = 'throttled' if is_throttling(code) else 'transient' if is_transient(code) else \
+                'api_error' if code else 'ok'
+            if is_throttling(code) or is_transient(code):
+                throttled = is_throttling(code)
+                raise RetryableApiError(params.get('Action'), code, api_res.get('Message', ''), throttled)
+        finally:
+            self.limiter.release(throttled)
+            if self.metrics is not None:
+                self.metrics.observe_call(params.get('Action'), time.monotonic() - started, outcome, api_res)
+        return status_code, api_res
+
+    def next_delay(self, delay):
+        """
+        下一次重试前的等待时间，与 common 的退避方式（backoff=2，jitter=(0, delay)）相同
+        """
+        return min(delay * 2 + random.uniform(0, self.delay), self.max_delay)
+
+    def observe_exhausted(self, action):
+        if self.metrics is not None:
+            self.metrics.observe_exhausted(action)
+
+    def common(self, product, **params):
+        try:
+            return retry_call(self.call_once, fargs=[product], fkwargs=params, exceptions=RetryableApiError,
+                              tries=self.tries, delay=self.delay, max_delay=self.max_delay, backoff=2,
+                              jitter=(0, self.delay), logger=None)
+        except RetryableApiError:
+            self.observe_exhausted(params.get('Action'))
+            raise
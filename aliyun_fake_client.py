@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+离线的阿里云API替身，用于在没有访问凭证的环境下运行、测量慢查询报告小工具（RDS / PolarDB）。
+1. FakeAliyunClient: 与 AliyunClient.common 用法一致，按实例规模生成确定性的模拟数据，
+   支持配置每次调用的延迟和限流比例；指定 replay_file 时优先回放录制的返回值；
+2. RecordingAliyunClient: 包装真实的 AliyunClient，把每次调用的参数和返回值追加写入 jsonl 文件，
+   供 FakeAliyunClient 回放。
+模拟的接口：DescribeRegions / DescribeDBInstances / DescribeDBInstanceAttribute /
+DescribeDBClusters / DescribeDBClusterAttribute / DescribeSlowLogs / DescribeSlowLogRecords
+==========================================================================================
+"""
+# Build-in Modules
+import json
+import time
+import random
+import hashlib
+import datetime
+import threading
+from collections import Counter
+
+# 默认模拟的地域
+REGIONS = ['cn-hangzhou', 'cn-shanghai', 'cn-beijing', 'cn-shenzhen']
+# 每个实例默认的慢SQL条数与慢日志明细条数
+SQL_PER_INSTANCE = 30
+RECORDS_PER_INSTANCE = 200
+# 回放时忽略的参数：时间窗口随运行日期变化
+REPLAY_IGNORE_PARAMS = ('StartTime', 'EndTime')
+# DescribeSlowLogRecords 的时间参数与 ExecutionStartTime 格式
+RECORDS_TIME_FORMAT = "%Y-%m-%dT%H:%MZ"
+EXECUTION_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def make_replay_key(product, params):
+    return json.dumps([product, {k: v for k, v in params.items() if k not in REPLAY_IGNORE_PARAMS}],
+                      sort_keys=True, default=str)
+
+
+def get_page(items, params, total_key="TotalRecordCount"):
+    """
+    按 PageSize / PageNumber 截取一页，返回值包含 TotalRecordCount
+    """
+    page_size = int(params.get("PageSize") or 30)
+    page_num = int(params.get("PageNumber") or 1)
+    return items[(page_num - 1) * page_size:page_num * page_size], {total_key: len(items),
+                                                                      "PageNumber": page_num}
+
+
+class FakeAliyunClient:
+    """
+    模拟的 AliyunClient
+    :param instances: 模拟的实例（集群）数量，按顺序轮流分配到各地域
+    :param latency: 每次调用的延迟（秒），模拟网络往返
+    :param throttle_rate: 调用返回 Throttling.User 错误码的比例，0 ~ 1
+    :param replay_file: RecordingAliyunClient 录制的 jsonl 文件
+    """
+
+    def __init__(self, instances=10, regions=None, sql_per_instance=SQL_PER_INSTANCE,
+                 records_per_instance=RECORDS_PER_INSTANCE, latency=0.0, throttle_rate=0.0, seed=0,
+                 replay_file=None):
+        self.regions = regions or REGIONS
+        self.sql_per_instance = sql_per_instance
+        self.records_per_instance = records_per_instance
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.instances = list(map(
+            lambda x: {"Id": "fake-{:05d}".format(x), "RegionId": self.regions[x % len(self.regions)]},
+            range(instances)))
+        self.instance_index = dict(map(lambda x: (x["Id"], x), self.instances))
+        # 慢日志明细均匀分布在报告小工具请求的窗口内：两天前 00:00 至今天 08:00
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        self.records_start = today - datetime.timedelta(days=2)
+        self.records_span = datetime.timedelta(days=2, hours=8)
+        self.records_cache = {}
+        self.replay = {}
+        if replay_file:
+            with open(replay_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.replay[make_replay_key(record["product"], record["params"])] = \
+                            (record["status_code"], record["response"])
+
+    def common(self, product, timeout=10, **params):
+        action = params.get("Action")
+        with self.lock:
+            self.calls[action] = self.calls[action] + 1
+            throttled = self.throttle_rate > 0 and self.random.random() < self.throttle_rate
+            if throttled:
+                self.throttled[action] = self.throttled[action] + 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if throttled:
+            return 400, {"Code": "Throttling.User", "Message": "Request was denied due to user flow control.",
+                         "RequestId": "fake"}
+
+        key = make_replay_key(product, params)
+        if key in self.replay:
+            return self.replay[key]
+        handler = getattr(self, 'fake_{}'.format(action), None)
+        if handler is None:
+            return 404, {"Code": "InvalidAction.NotFound", "Message": "Specified api is not found.",
+                         "RequestId": "fake"}
+        return 200, handler(product, **params)
+
+    def get_instance_id(self, product, instance):
+        return '{}-{}'.format('pc' if product == 'polardb' else 'rm', instance["Id"])
+
+    def get_instance(self, instance_id):
+        return self.instance_index.get(instance_id.split('-', 1)[-1])
+
+    def get_sql_list(self, product, instance_id):
+        """
+        实例的模拟慢SQL，同一实例每次生成的数据相同
+        """
+        rng = random.Random('{}|{}'.format(self.seed, instance_id))
+        sql_list = []
+        for index in range(self.sql_per_instance):
+            counts = rng.randint(1, 100000)
+            times = rng.randint(counts, counts * 10)
+            sql = {
+                "SQLHASH": hashlib.md5('{}|{}'.format(instance_id, index).encode('utf-8')).hexdigest(),
+                "SQLText": "select * from t_{} where id = ? and status = ?".format(index),
+                "DBName": "db_{}".format(index % 3),
+                "MaxExecutionTime": rng.randint(1, 60),
+                "ParseMaxRowCount": rng.randint(1, 1000000),
+                "ReturnMaxRowCount": rng.randint(1, 1000),
+            }
+            if product == 'polardb':
+                sql.update({"DBNodeId": "pi-{}-{}".format(instance_id, index % 2),
+                            "TotalExecutionCounts": counts, "TotalExecutionTimes": times})
+            else:
+                sql.update({"MySQLTotalExecutionCounts": counts, "MySQLTotalExecutionTimes": times})
+            sql_list.append(sql)
+        return sql_list
+
+    def fake_DescribeRegions(self, product, **params):
+        regions = list(map(lambda x: {"RegionId": x}, self.regions))
+        if product == 'polardb':
+            return {"Regions": {"Region": regions}}
+        return {"Regions": {"RDSRegion": regions}}
+
+    def fake_DescribeDBInstances(self, product, **params):
+        items = list(map(
+            lambda x: {"DBInstanceId": self.get_instance_id(product, x), "Engine": "MySQL",
+                       "RegionId": x["RegionId"]},
+            filter(lambda x: x["RegionId"] == params.get("RegionId"), self.instances)))
+        if params.get("Engine") and params["Engine"] != "MySQL":
+            items = []
+        page, result = get_page(items, params)
+        result["Items"] = {"DBInstance": page}
+        return result
+
+    def fake_DescribeDBInstanceAttribute(self, product, **params):
+        instance = self.get_instance(params.get("DBInstanceId", ''))
+        if instance is None:
+            return {"Items": {"DBInstanceAttribute": []}}
+        return {"Items": {"DBInstanceAttribute": [{"DBInstanceId": params["DBInstanceId"], "Engine": "MySQL",
+                                                   "RegionId": instance["RegionId"]}]}}
+
+    def fake_DescribeDBClusters(self, product, **params):
+        items = list(map(
+            lambda x: {"DBClusterId": self.get_instance_id(product, x), "DBType": "MySQL",
+                       "RegionId": x["RegionId"]},
+            filter(lambda x: x["RegionId"] == params.get("RegionId"), self.instances)))
+        if params.get("DBType") and params["DBType"] != "MySQL":
+            items = []
+        page, result = get_page(items, params)
+        result["Items"] = {"DBCluster": page}
+        return result
+
+    def fake_DescribeDBClusterAttribute(self, product, **params):
+        instance = self.get_instance(params.get("DBClusterId", ''))
+        if instance is None:
+            return {}
+        return {"DBClusterId": params["DBClusterId"], "DBType": "MySQL", "RegionId": instance["RegionId"],
+                "DBNodes": [{"DBNodeId": "pi-{}-0".format(params["DBClusterId"]), "DBNodeRole": "Writer"},
+                            {"DBNodeId": "pi-{}-1".format(params["DBClusterId"]), "DBNodeRole": "Reader"}]}
+
+    def fake_DescribeSlowLogs(self, product, **params):
+        instance_id = params.get("DBInstanceId") or params.get("DBClusterId") or ''
+        items = self.get_sql_list(product, instance_id) if self.get_instance(instance_id) else []
+        if params.get("DBName"):
+            items = list(filter(lambda x: x["DBName"] == params["DBName"], items))
+        create_time = (params.get("EndTime") or '')[:10] + 'Z'
+        items = list(map(lambda x: dict(x, CreateTime=create_time), items))
+        page, result = get_page(items, params)
+        result["Items"] = {"SQLSlowLog": page}
+        return result
+
+    def get_records(self, product, instance_id):
+        """
+        实例的模拟慢日志明细 [(执行时间, 明细), ...]，按实例缓存，翻页时不重复生成
+        """
+        key = (product, instance_id)
+        with self.lock:
+            if key in self.records_cache:
+                return self.records_cache[key]
+        sql_list = self.get_sql_list(product, instance_id) if self.get_instance(instance_id) else []
+        records = []
+        for index in range(self.records_per_instance if sql_list else 0):
+            sql = sql_list[index % len(sql_list)]
+            execution_time = self.records_start + self.records_span * index / self.records_per_instance
+            records.append((execution_time, {
+                "SQLHASH": sql["SQLHASH"], "DBName": sql["DBName"], "SQLText": sql["SQLText"],
+                "HostAddress": "app_{0}[app_{0}] @  [10.0.{1}.{2}]".format(index % 5, index % 7, index % 250),
+                "ExecutionStartTime": execution_time.strftime(EXECUTION_TIME_FORMAT),
+                "QueryTimes": index % 60, "LockTimes": index % 3, "ParseRowCounts": index * 37 % 10000}))
+            if product == 'polardb':
+                records[-1][1]["DBNodeId"] = sql["DBNodeId"]
+        with self.lock:
+            self.records_cache[key] = records
+        return records
+
+    def fake_DescribeSlowLogRecords(self, product, **params):
+        instance_id = params.get("DBInstanceId") or params.get("DBClusterId") or ''
+        records = self.get_records(product, instance_id)
+        if params.get("StartTime") and params.get("EndTime"):
+            # 按 [StartTime, EndTime) 过滤，相邻的子窗口不会重复返回
+            start_time = datetime.datetime.strptime(params["StartTime"], RECORDS_TIME_FORMAT)
+            end_time = datetime.datetime.strptime(params["EndTime"], RECORDS_TIME_FORMAT)
+            records = list(filter(lambda x: start_time <= x[0] < end_time, records))
+        items = list(map(lambda x: x[1], records))
+        if params.get("NodeId"):
+            items = list(filter(lambda x: x.get("DBNodeId") == params["NodeId"], items))
+        if params.get("SQLHASH"):
+            items = list(filter(lambda x: x["SQLHASH"] == params["SQLHASH"], items))
+        page, result = get_page(items, params)
+        result["Items"] = {"SQLSlowRecord": page}
+        return result
+
+
+class RecordingAliyunClient:
+    """
+    包装真实的 AliyunClient，录制每次调用的参数和返回值（jsonl），不保存访问凭证
+    """
+
+    def __init__(self, aliyun, path):
+        self.aliyun = aliyun
+        self.path = path
+        self.lock = threading.Lock()
+
+    def common(self, product, timeout=10, **params):
+        status_code, api_res = self.aliyun.common(product, timeout=timeout, **params)
+        line = json.dumps({"product": product, "params": params, "status_code": status_code, "response": api_res},
+                          ensure_ascii=False, default=str)
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        return status_code, api_res
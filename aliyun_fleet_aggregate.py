@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+全局慢SQL汇总，供慢查询报告小工具（RDS / PolarDB）共用。
+获取每个实例的慢查询统计时，逐行记录 SQL 指纹、实例、执行次数、执行时长、最大执行时长，
+以紧凑的数组（array）按列保存；全部实例获取完成后用 NumPy 按指纹分组计算：
+总执行次数、总执行时长、最大执行时长、涉及实例数，输出全局 TOP N。
+==========================================================================================
+"""
+# Build-in Modules
+import json
+import time
+import threading
+from array import array
+
+# 3rd-part Modules
+import numpy as np
+
+# Project Modules
+from aliyun_sql_fingerprint import DEFAULT_CACHE
+
+# 默认输出的全局TOP SQL条数
+FLEET_TOP_N = 50
+
+
+def get_number(row, keys):
+    """
+    按顺序取第一个可转为数值的字段，缺失时为0
+    """
+    for key in keys:
+        value = row.get(key)
+        if value not in (None, ''):
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                continue
+    return 0.0
+
+
+class FleetAggregator:
+    """
+    :param count_keys: 执行次数字段，例如 ('MySQLTotalExecutionCounts', 'SQLServerTotalExecutionCounts')
+    :param time_keys: 执行时长字段，例如 ('MySQLTotalExecutionTimes', 'SQLServerTotalExecutionTimes')
+    :param cache: FingerprintCache
+    """
+
+    def __init__(self, count_keys, time_keys, cache=DEFAULT_CACHE):
+        self.count_keys = count_keys
+        self.time_keys = time_keys
+        self.cache = cache
+        self.lock = threading.Lock()
+        # 指纹、实例的编号
+        self.fingerprint_index = {}
+        self.sql_texts = []
+        self.instance_index = {}
+        self.instance_ids = []
+        # 按列保存的每行数据
+        self.fingerprint_column = array('q')
+        self.instance_column = array('q')
+        self.count_column = array('d')
+        self.time_column = array('d')
+        self.max_time_column = array('d')
+
+    def get_id(self, index, values, key, value):
+        if key not in index:
+            index[key] = len(values)
+            values.append(value)
+        return index[key]
+
+    def tap(self, instance_id, rows):
+        """
+        透传慢查询统计（生成器），同时记录每一行；读取完成后一次性写入汇总列
+        :return: generator
+        """
+        fingerprints, counts, times, max_times = [], [], [], []
+        for row in rows:
+            fingerprints.append(self.cache.get(row.get("SQLText")))
+            counts.append(get_number(row, self.count_keys))
+            times.append(get_number(row, self.time_keys))
+            max_times.append(get_number(row, ("MaxExecutionTime",)))
+            yield row
+        with self.lock:
+            instance = self.get_id(self.instance_index, self.instance_ids, instance_id, instance_id)
+            for fingerprint, normalized in fingerprints:
+                self.fingerprint_column.append(
+                    self.get_id(self.fingerprint_index, self.sql_texts, fingerprint, normalized))
+            self.instance_column.extend([instance] * len(fingerprints))
+            self.count_column.extend(counts)
+            self.time_column.extend(times)
+            self.max_time_column.extend(max_times)
+
+    def get_columns(self):
+        """
+        汇总列的副本（复制一份数据，不长期占用 array 的缓冲区，占用期间 array 不能追加）
+        :return: dict 指纹、实例列为编号，fingerprints / sql_texts / instance_ids 为编号对应的值
+        """
+        with self.lock:
+            return {
+                "fingerprint": np.frombuffer(self.fingerprint_column, dtype=np.int64).copy(),
+                "instance": np.frombuffer(self.instance_column, dtype=np.int64).copy(),
+                "counts": np.frombuffer(self.count_column, dtype=np.float64).copy(),
+                "times": np.frombuffer(self.time_column, dtype=np.float64).copy(),
+                "max_times": np.frombuffer(self.max_time_column, dtype=np.float64).copy(),
+                "fingerprints": list(self.fingerprint_index),
+                "sql_texts": list(self.sql_texts),
+                "instance_ids": list(self.instance_ids),
+            }
+
+    def top_n(self, n=FLEET_TOP_N):
+        """
+        按指纹分组，按总执行次数、总执行时长倒序取前N条
+        :return: list
+        """
+        columns = self.get_columns()
+        fingerprint, instance = columns["fingerprint"], columns["instance"]
+        counts, times, max_times = columns["counts"], columns["times"], columns["max_times"]
+        sql_texts = columns["sql_texts"]
+        groups = len(sql_texts)
+        instance_total = max(len(columns["instance_ids"]), 1)
+        if not groups:
+            return []
+
+        total_counts = np.bincount(fingerprint, weights=counts, minlength=groups)
+        total_times = np.bincount(fingerprint, weights=times, minlength=groups)
+        # 按指纹排序后分段取最大值
+        order = np.argsort(fingerprint, kind='stable')
+        sorted_fingerprint = fingerprint[order]
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_fingerprint)) + 1))
+        group_max_times = np.zeros(groups)
+        group_max_times[sorted_fingerprint[starts]] = np.maximum.reduceat(max_times[order], starts)
+        # 同一指纹出现在多少个实例中
+        pairs = np.unique(fingerprint * instance_total + instance)
+        instance_counts = np.bincount(pairs // instance_total, minlength=groups)
+
+        top = np.lexsort((-total_times, -total_counts))[:n]
+        return list(map(lambda x: {
+            "SQLText": sql_texts[x],
+            "TotalExecutionCounts": int(total_counts[x]),
+            "TotalExecutionTimes": float(total_times[x]),
+            "MaxExecutionTime": float(group_max_times[x]),
+            "InstanceCount": int(instance_counts[x]),
+        }, top.tolist()))
+
+    def maker(self, out_dir, n=FLEET_TOP_N):
+        """
+        输出全局TOP SQL到 fleet-top-sql-*.json
+        """
+        file_name = 'fleet-top-sql-{}.json'.format(time.strftime('%Y%m%d%H%M%S', time.localtime(time.time())))
+        data = {
+            "instances": len(self.instance_ids),
+            "rows": len(self.fingerprint_column),
+            "fingerprints": len(self.sql_texts),
+            "top_sql": self.top_n(n),
+        }
+        with open('{}/{}'.format(out_dir, file_name), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        return file_name
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+慢查询汇总报告，供慢查询报告小工具（RDS / PolarDB）共用。
+所有实例写入一个HTML文件：页面只包含一张实例索引表，每个实例的TOP SQL以紧凑的JSON（按列的数组）
+嵌入页面，点击实例时再生成明细表，不再为每个实例重复输出页头、样式和图标。
+单次遍历 start_up 的 result 列表，逐行写入索引表。
+来源地址分布（HostHistogram）、节点分布（NodeBreakdown）每项一行，本次运行所有实例都没有的列
+（例如未使用 --RecordsMode stats 时的分位数）不写入页面。
+==========================================================================================
+"""
+# Build-in Modules
+import html
+import json
+import time
+
+HTML_HEAD = """<!doctype html>
+<html lang="en">
+<head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1, shrink-to-fit=no">
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap@4.4.1/dist/css/bootstrap.min.css"
+          integrity="sha384-Vkoo8x4CGsO3+Hhxv8T/Q5PaXtkKtu6ug5TOeNV6gBiFeWPGFN9MuhOf23Q9Ifjh" crossorigin="anonymous">
+    <style type="text/css">
+        body { background: #f1f4f6; font-size: .88rem; }
+        .fleet-row { cursor: pointer; }
+        .fleet-detail td { background: #fff; white-space: pre-line; }
+        .sql-text { word-break: break-all; min-width: 400px; }
+    </style>
+    <title>{title}</title>
+</head>
+<body>
+<div class="container-fluid">
+    <h4 class="mt-4">{title}</h4>
+    <div class="text-muted mb-3">报告时间：{report_time} 实例数：<span id="fleet-count"></span> 点击实例查看TOP SQL明细</div>
+    <table class="table table-sm table-hover bg-white">
+        <thead>
+        <tr>
+            <th>序号</th>
+            <th>实例ID</th>
+            <th>TOP SQL条数</th>
+            <th>最多执行次数</th>
+            <th>最大执行时长 秒</th>
+        </tr>
+        </thead>
+        <tbody>
+"""
+
+HTML_SCRIPT = """
+<script>
+(function () {
+    var payload = JSON.parse(document.getElementById('fleet-data').textContent);
+    document.getElementById('fleet-count').textContent = payload.rows.length;
+    function buildDetail(index) {
+        var table = document.createElement('table');
+        table.className = 'table table-sm table-striped mb-0';
+        var head = table.createTHead().insertRow();
+        ['序号'].concat(payload.columns).forEach(function (name) {
+            var th = document.createElement('th');
+            th.textContent = name;
+            head.appendChild(th);
+        });
+        var body = table.createTBody();
+        payload.rows[index].forEach(function (row, n) {
+            var tr = body.insertRow();
+            [n + 1].concat(row).forEach(function (value, i) {
+                var td = tr.insertCell();
+                td.textContent = value === null ? '' : value;
+                if (i === payload.columns.length) td.className = 'sql-text';
+            });
+        });
+        return table;
+    }
+    document.querySelectorAll('.fleet-row').forEach(function (tr) {
+        tr.addEventListener('click', function () {
+            var next = tr.nextElementSibling;
+            if (next && next.classList.contains('fleet-detail')) {
+                next.hidden = !next.hidden;
+                return;
+            }
+            var detail = document.createElement('tr');
+            detail.className = 'fleet-detail';
+            var td = detail.insertCell();
+            td.colSpan = tr.cells.length;
+            td.appendChild(buildDetail(parseInt(tr.getAttribute('data-index'), 10)));
+            tr.parentNode.insertBefore(detail, next);
+        });
+    });
+})();
+</script>
+</body>
+</html>
+"""
+
+
+def get_value(sql, keys):
+    """
+    按顺序取第一个非空字段，例如 ('MySQLTotalExecutionCounts', 'SQLServerTotalExecutionCounts')
+    """
+    for key in keys:
+        if sql.get(key) not in (None, '', []):
+            return sql[key]
+    return None
+
+
+def format_value(value):
+    """
+    明细表的单元格：来源地址、节点的分布每项一行，新增慢SQL的标记转为文字
+    """
+    if isinstance(value, bool):
+        return '新增' if value else ''
+    if isinstance(value, list):
+        return '\n'.join(map(lambda x: '{} {}次 {}秒'.format(get_value(x, ('HostAddress', 'DBNodeId')),
+                                                              x.get('Count'), x.get('QueryTimes')), value))
+    return value
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class FleetReport:
+    """
+    :param title: 报告标题
+    :param id_key: 实例ID字段，DBInstanceId / DBClusterId
+    :param columns: 明细列 [(列名, (字段, ...)), ...]，最后一列为SQL文本；
+                    HostHistogram / NodeBreakdown 放在 HostAddress / DBNodeId 之前，有分布时显示分布
+    :param count_keys: 执行次数字段，用于索引表的最多执行次数
+    """
+
+    def __init__(self, title, id_key, columns, count_keys):
+        self.title = title
+        self.id_key = id_key
+        self.columns = columns
+        self.count_keys = count_keys
+
+    def maker(self, result, out_dir):
+        report_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+        file_name = 'report-fleet-{}.html'.format(time.strftime('%Y%m%d%H%M%S', time.localtime(time.time())))
+        rows = []
+        with open('{}/{}'.format(out_dir, file_name), 'w', encoding='utf-8') as f:
+            f.write(HTML_HEAD.replace('{title}', html.escape(self.title)).replace('{report_time}', report_time))
+            for instance_slow_logs in result:
+                # 获取失败的实例返回 {}，不写入报告
+                if not instance_slow_logs:
+                    continue
+                sql_list = instance_slow_logs.get('sql_list', [])
+                counts = list(map(lambda x: to_float(get_value(x, self.count_keys)), sql_list))
+                max_time = max(map(lambda x: to_float(x.get('MaxExecutionTime')), sql_list), default=0)
+                f.write('<tr class="fleet-row" data-index="{}"><td>{}</td><td>{}</td><td>{}</td>'
+                        '<td>{:g}</td><td>{:g}</td></tr>\n'.format(len(rows), len(rows) + 1,
+                                                                   html.escape(str(instance_slow_logs[self.id_key])),
+                                                                   len(sql_list), max(counts, default=0), max_time))
+                rows.append(list(map(lambda x: [format_value(get_value(x, keys)) for _, keys in self.columns],
+                                     sql_list)))
+            # 所有实例都没有值的列不输出，SQL文本列始终保留在最后
+            keep = list(filter(lambda i: i == len(self.columns) - 1 or any(
+                row[i] is not None for instance_rows in rows for row in instance_rows), range(len(self.columns))))
+            rows = list(map(lambda x: list(map(lambda row: [row[i] for i in keep], x)), rows))
+            payload = json.dumps({'columns': [self.columns[i][0] for i in keep], 'rows': rows},
+                                 ensure_ascii=False, separators=(',', ':'), default=str)
+            f.write('        </tbody>\n    </table>\n</div>\n')
+            # 避免SQL文本中的 </script> 提前结束脚本块
+            f.write('<script type="application/json" id="fleet-data">{}</script>'.format(
+                payload.replace('</', '<\\/')))
+            f.write(HTML_SCRIPT)
+        return file_name
@@ -8,10 +8,18 @@ import datetime
 import decimal
 import time
 import os
+import sys
 # 3rd-part Modules
 import pymysql
 import argparse
-from jinja2 import Template
+
+# 报告模板公共模块在仓库根目录，单独运行本目录的小工具时加入 sys.path
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# Project Modules
+from aliyun_report_template import get_template
 
 
 class GetReport:
@@ -22,7 +30,7 @@ class GetReport:
     def __init__(self, **kwargs):
         self.render_data = kwargs
 
-    def render_template(self):
+    def load_template(self):
         template_data = """
        <div class="row">
         {% for _data in data %}
@@ -102,8 +110,10 @@ class GetReport:
 </html>
 """
 
-        template = Template(template_data)
-        return template.render(**self.render_data)
+        return get_template('mysql_healthcheck', template_data)
+
+    def render_template(self):
+        return self.load_template().render(**self.render_data)
 
     def maker(self, host, out_dir):
         # 因为CSS中存在{{因此不能放在template_data中渲染
@@ -152,7 +162,6 @@ class GetReport:
 <svg t="1597730333148" class="icon" viewBox="0 0 1024 1024" version="1.1" xmlns="http://www.w3.org/2000/svg" p-id="10565" width="64" height="64"><path d="M528 67.5l-16-16.7-15.9 16.7c-7.3 7.7-179.9 190.6-179.9 420.8 0 112 40 210.1 73.5 272.7l6.2 11.6H627l5.9-13c3.1-6.8 75-167.8 75-271.3 0-230.2-172.6-413.1-179.9-420.8z m-16 48.8c19 22.9 51.9 66.1 82.3 122.5H429.8c30.3-56.4 63.3-99.6 82.2-122.5z m86.3 612.2H422.5c-25.7-50.6-62.2-140.1-62.2-240.2 0-75 20.8-145.5 47.7-205.4h208.2c26.8 59.9 47.6 130.3 47.6 205.4-0.1 78.3-48.7 200.4-65.5 240.2z" fill="#1E59E4" p-id="10566"></path><path d="M834.7 623.9H643.3l6.7-27.3c9.1-37 13.7-73.4 13.7-108.2 0-44.8-7.7-92-22.9-140.3l-17-54 49.1 28.3c99.8 57.6 161.8 164.7 161.8 279.5v22z m-135.9-44.2h90.9c-5.7-71-38.8-137.2-91.3-184.6 6.3 31.7 9.4 62.9 9.4 93.2 0.1 29.7-3 60.3-9 91.4zM380.1 623.9H189.3v-22.1c0-114.8 62-221.9 161.8-279.5l49.1-28.3-17 54c-15.2 48.3-22.9 95.5-22.9 140.3 0 34.5 4.5 71 13.4 108.4l6.4 27.2z m-145.8-44.2H325c-5.9-31.3-8.8-61.9-8.8-91.4 0-30.3 3.2-61.5 9.4-93.2-52.5 47.5-85.6 113.6-91.3 184.6zM512 529.5c-45 0-81.6-36.6-81.6-81.6s36.6-81.6 81.6-81.6 81.6 36.6 81.6 81.6-36.6 81.6-81.6 81.6z m0-119c-20.7 0-37.5 16.8-37.5 37.5s16.8 37.5 37.5 37.5 37.5-16.8 37.5-37.5-16.8-37.5-37.5-37.5z" fill="#1E59E4" p-id="10567"></path><path d="M512 999.7l-20.3-20.3c-28.8-28.6-68.3-67.9-68.3-111.6 0-48.9 39.8-88.6 88.6-88.6 48.9 0 88.6 39.8 88.6 88.6 0 43.6-24.4 67.9-64.8 108.2L512 999.7z m0-176.4c-24.5 0-44.5 20-44.5 44.5 0 21.5 23.8 48.4 44.5 69.5 33.6-33.7 44.4-47 44.4-69.5 0.1-24.6-19.9-44.5-44.4-44.5z" fill="#FF5A06" p-id="10568"></path></svg></a>
         """.format(time.strftime('%Y年%m月%d日 %H:%M:%S'.encode('unicode_escape').decode('utf8'),
                                  time.localtime(time.time())).encode('utf-8').decode('unicode_escape'))
-        html_string_2 = self.render_template()
         # print('\n'.join([html_string_0, html_string_1]))
         file_name = 'report-{host}-{time_string}.html'.format(host=host,
                                                               time_string=time.strftime('%Y%m%d%H%M%S',
@@ -160,6 +169,8 @@ class GetReport:
         path = '{}/{}'.format(out_dir, time.strftime('%Y%m%d', time.localtime(time.time())))
         if not os.path.exists(path):
             os.makedirs(path)
+        # 模板渲染结果逐段写入文件，不在内存中拼接整个页面
         with open('{}/{}/{}'.format(out_dir, time.strftime('%Y%m%d', time.localtime(time.time())), file_name), 'w',
                   encoding='utf-8') as f:
-            f.write('\n'.join([html_string_head, html_string_1, html_string_2]))
+            f.write('\n'.join([html_string_head, html_string_1, '']))
+            self.load_template().stream(**self.render_data).dump(f)
@@ -12,7 +12,9 @@ import time
 import psycopg2
 import argparse
 from jinja2 import Template
+# 导入报告模块时已把仓库根目录加入 sys.path
 from aliyun_get_pg_healthcheck_outhtml import GetReport
+from aliyun_report_template import set_bytecode_cache
 # 渲染的json文件名
 JSON_FILENAME='data.json'
 
@@ -453,11 +455,15 @@ def starup(**kwargs):
     #jsonfile.maker(kwargs['out_dir'])
 
     # 4. 渲染报告
+    set_bytecode_cache(kwargs.get('template_cache_dir'))
     report = GetReport(**temp_data)
     report.maker(kwargs['host'],kwargs['out_dir'])
 
 
-if __name__ == "__main__":
+def main(argv=None):
+    """
+    命令行入口，常驻调度（aliyun_report_scheduler）传入 argv
+    """
     parser = argparse.ArgumentParser(description='''PostgreSQL 库表统计报告小工具
 关于数据库的整体库表空间使用情况	
 1. 库空间统计
@@ -476,8 +482,9 @@ Example：
     parser.add_argument("--Info", default='all',
                         help='''Info 非必要参数，默认all，也可单独指定例如 db_size 或 db_size,table_size; 多个使用逗号分割 db_size:获取mssql表空间统计 table_size:获取mssql表空间统计''')
     parser.add_argument("--OutDir", help="输出目录 必要参数 需要提前创建该目录")
+    parser.add_argument("--TemplateCacheDir", help="报告模板字节码缓存目录 非必要参数，指定后再次运行时不再编译模板")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     if args.Info == 'all':
         info = ['connnections','data_age','data_size','surface_expansion','index_inflation','unused_index','unused_query_table','hot_table','cold_table','hot_index','cold_index','table_full_count','table_full_rows']
     elif len(args.Info.split(',')):
@@ -493,9 +500,14 @@ Example：
         'password': args.Password,
         'dbname': args.DBName,
         'out_dir': args.OutDir,
+        'template_cache_dir': args.TemplateCacheDir,
     }
 
     if args.Engine.lower() == 'postgresql'.lower():
         starup(**params)
     else:
         print('请选择 PostgreSQL 类型的数据库。')
+
+
+if __name__ == "__main__":
+    main()
@@ -20,60 +20,147 @@
 # Build-in Modules
 import json
 import time
+import asyncio
 import datetime
 
 # 3rd-part Modules
 import argparse
 from aliyun_sdk import client
-from jinja2 import Template
+
+# Project Modules
+from aliyun_api_helper import run_concurrently, fetch_all_pages, iter_pages, parse_rate_limits, AsyncAliyunClient, \
+    AliyunApiCaller, AIMDLimiter, MAX_WORKERS, REGION_CONCURRENCY, PAGE_SIZE, ASYNC_CONCURRENCY, DEFAULT_RATE_LIMIT, \
+    RETRY_TRIES, MAX_IN_FLIGHT, RetryableApiError, ApiError, check_api_res
+from aliyun_metrics import Metrics
+from aliyun_run_plan import build_plan, print_plan, get_sample, get_latency, get_default_profile, get_profiles, \
+    PLAN_SAMPLE, PLAN_PAGE_SIZE
+from aliyun_inventory_cache import InventoryCache, CACHE_DIR, CACHE_TTL
+from aliyun_fleet_aggregate import FleetAggregator, FLEET_TOP_N
+from aliyun_fleet_report import FleetReport
+from aliyun_sql_fingerprint import get_fingerprint
+from aliyun_report_template import get_template, set_bytecode_cache
+from aliyun_slowlog_archive import SlowLogArchive, get_day
+from aliyun_slowlog_store import SlowLogStore, get_sql_key
+from aliyun_slowlog_helper import split_window, scan_records, RecordStats, top_k, async_get_top_sql, TOP_K
+
+# 支持的全部数据库类型
+DB_ENGINES = ['MySQL', 'SQLServer', 'PostgreSQL', 'PPAS', 'MariaDB']
+# TOP SQL 默认排序字段，按执行次数、最大执行时长倒序
+SORT_KEYS = ('MySQLTotalExecutionCounts', 'MaxExecutionTime')
+# 汇总报告的明细列 (列名, 字段)，最后一列为SQL文本
+REPORT_COLUMNS = [
+    ('数据库', ('DBName',)),
+    ('执行用户和地址', ('HostHistogram', 'HostAddress')),
+    ('总执行次数', ('MySQLTotalExecutionCounts', 'SQLServerTotalExecutionCounts')),
+    ('总执行时长 秒', ('MySQLTotalExecutionTimes', 'SQLServerTotalExecutionTimes')),
+    ('最大执行时长 秒', ('MaxExecutionTime',)),
+    ('解析SQL最大行数', ('ParseMaxRowCount',)),
+    ('返回SQL最大行数', ('ReturnMaxRowCount',)),
+    ('执行时长 p50/p95/p99', ('QueryTimesQuantiles',)),
+    ('锁等待时长 p50/p95/p99', ('LockTimesQuantiles',)),
+    ('扫描行数 p50/p95/p99', ('ParseRowCountsQuantiles',)),
+    ('新增', ('NewSlowSQL',)),
+    ('慢查询', ('SQLText',)),
+]
 
 
 class Custom:
     def __init__(self):
-        pass
+        # API调用与各阶段耗时的运行指标
+        self.metrics = Metrics('rds_slowlog')
 
     def get_config(self, **kwargs):
         self.out = kwargs
-        self.aliyun = client.AliyunClient(config=kwargs)
+        # 所有API调用经过统一入口：限流/临时错误退避重试，AIMD 自适应并发
+        self.aliyun = AliyunApiCaller(client.AliyunClient(config=kwargs), kwargs.get('RetryTries', RETRY_TRIES),
+                                      limiter=AIMDLimiter(max_limit=kwargs.get('MaxInFlight', MAX_IN_FLIGHT)),
+                                      metrics=self.metrics)
 
     def get_describe_regions(self):
         try:
             status_code, api_res = self.aliyun.common("rds", Action="DescribeRegions")
             region_ids = list(set(map(lambda x: x['RegionId'], api_res['Regions']['RDSRegion']
                                       )))
+        except RetryableApiError:
+            # 重试耗尽时抛出，运行失败，不当作没有地域
+            raise
         except Exception as e:
             print(str(e))
             region_ids = []
         # print(region_ids)
         return region_ids
 
-    def get_instance(self, common_region_ids, db_engines):
+    def get_instance(self, common_region_ids, db_engines, max_workers=MAX_WORKERS,
+                     region_concurrency=REGION_CONCURRENCY):
         """
-        1. 循环所有地域获取所有RDS实例；
-        2. 再过滤出指定的数据库类型。
+        1. 并发获取所有地域的RDS实例（max_workers 个地域同时进行，单地域内 region_concurrency 个翻页请求）；
+        2. 指定了部分数据库类型时通过 Engine 参数在接口侧过滤，本地再按数据库类型校验。
+        :return: tuple (实例列表, 获取失败的地域列表)
         """
-        instance_list = []
 
-        for region_id in common_region_ids:
-            page_num = 1
-            while True:
-                # 循环获取实例
-                try:
-                    status_code, api_res = self.aliyun.common("rds", Action="DescribeDBInstances", RegionId=region_id,
-                                                              PageSize=100,
-                                                              PageNumber=page_num)
-                except Exception as e:
-                    print(str(e))
-
-                if not api_res.get("Items", {}).get("DBInstance", []):
-                    break
-
-                # 过滤出指定数据库Engines
-                instance_list = instance_list + list(map(
-                    lambda x: {"DBInstanceId": x.get("DBInstanceId")},
-                    list(filter(lambda x: x["Engine"] in db_engines,
-                                api_res.get("Items", {}).get("DBInstance", [])))))
-                page_num = page_num + 1
+        # 只需要部分数据库类型时，按类型分别请求（Engine 参数只支持单个值），不再获取全部实例后在本地丢弃
+        engine_params = [{}] if set(DB_ENGINES) <= set(db_engines) else list(map(lambda x: {"Engine": x}, db_engines))
+
+        def describe_region(region_id):
+            """
+            :return: list 获取失败时返回 None
+            """
+            try:
+                region_instance_list = []
+                for engine_param in engine_params:
+                    def describe_page(page_num):
+                        # 循环获取实例，重试耗尽或返回错误码时抛出，整个地域标记为获取失败，不当作没有实例
+                        status_code, api_res = self.aliyun.common("rds", Action="DescribeDBInstances",
+                                                                  RegionId=region_id,
+                                                                  PageSize=PAGE_SIZE,
+                                                                  PageNumber=page_num,
+                                                                  **engine_param)
+                        return check_api_res("DescribeDBInstances", api_res)
+
+                    # 过滤出指定数据库Engines
+                    region_instance_list = region_instance_list + list(map(
+                        lambda x: {"DBInstanceId": x.get("DBInstanceId")},
+                        list(filter(lambda x: x["Engine"] in db_engines,
+                                    fetch_all_pages(describe_page, ("Items", "DBInstance"), PAGE_SIZE,
+                                                    region_concurrency)))))
+            except Exception as e:
+                print('地域 {} 获取实例失败: {}'.format(region_id, e))
+                return None
+            return region_instance_list
+
+        instance_list = []
+        failed_regions = []
+        for region_id, region_instance_list in zip(common_region_ids, run_concurrently(describe_region,
+                                                                                       common_region_ids,
+                                                                                       max_workers)):
+            if region_instance_list is None:
+                failed_regions.append(region_id)
+                continue
+            instance_list = instance_list + region_instance_list
+        return instance_list, failed_regions
+
+    def get_inventory(self, **kwargs):
+        """
+        获取实例清单：本地缓存未过期且未指定 --RefreshCache 时直接使用缓存，
+        否则获取地域（common_region_ids 为 None 时调用 DescribeRegions）和实例，所有地域都获取成功时写入缓存
+        :return: list
+        """
+        cache = InventoryCache(kwargs.get('cache_dir', CACHE_DIR), kwargs.get('cache_ttl', CACHE_TTL))
+        cache_key = cache.make_key("rds", self.out, kwargs.get('region', kwargs['common_region_ids']),
+                                   kwargs['db_engines'])
+        instance_list = None if kwargs.get('refresh_cache') else cache.get(cache_key)
+        if instance_list is None:
+            common_region_ids = kwargs['common_region_ids']
+            if common_region_ids is None:
+                common_region_ids = self.get_describe_regions()
+            instance_list, failed_regions = self.get_instance(common_region_ids, kwargs['db_engines'],
+                                              kwargs.get('max_workers', MAX_WORKERS),
+                                              kwargs.get('region_concurrency', REGION_CONCURRENCY))
+            if failed_regions:
+                # 实例清单不完整，不写入缓存，下次运行重新获取
+                print('获取实例失败的地域，本次运行不包含这些地域的实例: {}'.format(', '.join(failed_regions)))
+            else:
+                cache.set(cache_key, instance_list)
         return instance_list
 
     def get_instance_attribute(self, **instance_kwargs):
@@ -81,6 +168,9 @@ class Custom:
             status_code, api_res = self.aliyun.common("rds", Action="DescribeDBInstanceAttribute", **instance_kwargs)
             # print(json.dumps(api_res, indent=2))
             api_res = api_res.get("Items", {}).get("DBInstanceAttribute", [])[0]
+        except RetryableApiError:
+            # 重试耗尽时抛出，不当作实例不存在
+            raise
         except Exception as e:
             print(str(e))
             print("获取RDS实例明细信息")
@@ -89,6 +179,29 @@ class Custom:
         # print(json.dumps(api_res, indent=2))
         return api_res
 
+    def get_instance_by_ids(self, instance_ids, db_engines, common_region_ids=None, max_workers=MAX_WORKERS):
+        """
+        指定实例ID时，并发调用 DescribeDBInstanceAttribute 直接获取实例，
+        同样按数据库类型过滤，指定了地域（common_region_ids 不为 None）时也按地域过滤
+        :return: list 与 instance_ids 顺序一致，不存在的实例被忽略，重试耗尽的实例打印后跳过
+        """
+        instance_list = []
+
+        def describe(instance_id):
+            try:
+                return self.get_instance_attribute(DBInstanceId=instance_id)
+            except RetryableApiError as e:
+                print('{} 获取实例信息失败: {}'.format(instance_id, e))
+                return []
+
+        for attribute in run_concurrently(describe, instance_ids, max_workers):
+            if not attribute or attribute.get("Engine") not in db_engines:
+                continue
+            if common_region_ids is not None and attribute.get("RegionId") not in common_region_ids:
+                continue
+            instance_list.append({"DBInstanceId": attribute.get("DBInstanceId")})
+        return instance_list
+
     def get_describe_slow_logs(self, **kwargs):
         """
         调用该接口时，实例必须为如下版本：
@@ -109,6 +222,10 @@ class Custom:
         """
         try:
             status_code, api_res = self.aliyun.common("rds", Action="DescribeSlowLogs", **kwargs)
+            check_api_res("DescribeSlowLogs", api_res)
+        except ApiError:
+            # 重试耗尽或返回错误码时抛出，由 get_slow_log 把实例标记为获取失败，不当作没有数据
+            raise
         except Exception as e:
             print(str(e))
             print("获取RDS慢查询")
@@ -131,59 +248,123 @@ class Custom:
         """
         try:
             status_code, api_res = self.aliyun.common("rds", Action="DescribeSlowLogRecords", **kwargs)
+            check_api_res("DescribeSlowLogRecords", api_res)
+        except ApiError:
+            # 重试耗尽或返回错误码时抛出，由 get_slow_log 把实例标记为获取失败，不当作没有数据
+            raise
         except Exception as e:
             print(str(e))
             print("获取RDS慢查询")
             api_res = {}
         return api_res
 
-    def get_top_10(self, slow_query):
+    def get_slow_log_host_index(self, sql_list, record_stats=None, shard_hours=0, max_workers=MAX_WORKERS, **kwargs):
+        """
+        单次分页拉取时间窗口内的慢日志明细，建立 SQLHASH -> HostAddress 索引，
+        代替每条SQL调用一次 DescribeSlowLogRecords；传入 record_stats 时读取全部明细并统计分位数；
+        shard_hours 大于0时时间窗口按小时切分，max_workers 个子窗口并发分页
+        kwargs = {
+        "DBInstanceId": "",
+        "EndTime":"",
+        "StartTime":"",
+        }
+        :return: dict {SQLHASH: HostAddress}
+        """
+        return scan_records(
+            lambda page_num, **params: self.get_describe_slow_log_records(PageSize=PAGE_SIZE, PageNumber=page_num,
+                                                                          **params),
+            kwargs, sql_list, record_stats, shard_hours, max_workers)
+
+    def iter_describe_slow_logs(self, db_names=None, progress=None, **kwargs):
+        """
+        逐页读取 DescribeSlowLogs 的全部慢查询统计，参数同 get_describe_slow_logs
+        指定 db_names 时按库分别请求（DBName 参数只支持单个库），只获取这些库的慢查询
+        :param progress: 见 iter_pages，所有库都读完时 complete 为 True
+        :return: generator
+        """
+        for db_name in (db_names or [None]):
+            params = dict(kwargs, DBName=db_name) if db_name else kwargs
+            for item in iter_pages(
+                    lambda page_num: self.get_describe_slow_logs(PageSize=PAGE_SIZE, PageNumber=page_num, **params),
+                    ("Items", "SQLSlowLog"), progress=progress):
+                yield item
+
+    def iter_incremental_slow_logs(self, store, db_names=None, from_store=False, **kwargs):
+        """
+        增量获取慢查询统计，参数同 iter_describe_slow_logs
+        1. 只请求本地状态库水位之后的日期并写入状态库，from_store 为 True 时不请求接口；
+        2. 从状态库读取整个报告窗口（StartTime ~ EndTime）的数据。
+        :return: generator
+        """
+        instance_id = kwargs["DBInstanceId"]
+        if not from_store:
+            start_day = store.get_fetch_start(instance_id, kwargs["StartTime"], db_names)
+            if start_day <= kwargs["EndTime"]:
+                progress = {}
+                if not store.save_slow_logs(
+                        instance_id, self.iter_describe_slow_logs(db_names, progress, **dict(kwargs, StartTime=start_day)),
+                        start_day, kwargs["EndTime"], db_names, progress):
+                    print('{} 慢查询统计未读取完整，不更新状态库，下次运行重新获取'.format(instance_id))
+        return store.iter_slow_logs(instance_id, kwargs["StartTime"], kwargs["EndTime"], db_names)
+
+    def get_top_10(self, slow_query, k=TOP_K, sort_keys=SORT_KEYS):
         """
         获取按照执行次数最多，执行时间最长排序的前10条SQL
         order_by_MySQLTotalExecutionCounts_MaxExecutionTime
+        slow_query 可以是列表或逐页读取的生成器，使用有界堆保留前K条，不会截断第一页之外的数据
         :return: list
         """
-        if isinstance(slow_query, list) and slow_query:
-            items = slow_query[:10]
-            """
-            list中根据字典的某个key或多个key进行排序，倒
-            """
-            items.sort(key=lambda x: (x['MySQLTotalExecutionCounts'], x['MaxExecutionTime']), reverse=True)
-            return items
-        else:
-            return []
-
-    def start_up(self, **kwargs):
-        # 1.获取实例
-        # 1.1 按照地域和数据库引擎过滤实例ID
-        instance_list = self.get_instance(kwargs['common_region_ids'], kwargs['db_engines'])
-        # 过滤实例ID
-        if kwargs['filter_instance']:
-            filter_instance_list = list(filter(lambda x: x['DBInstanceId'] in kwargs['DBInstanceIds'], instance_list))
-        else:
-            filter_instance_list = instance_list
-        # print(filter_instance_list)
+        return top_k(slow_query or [], k, sort_keys)
 
-        # 2 获取慢查询信息
-        # 2.1 获取已过滤的实例的慢查询
-        params = list(map(
-            lambda x:
-            {
-                "DBInstanceId": x["DBInstanceId"],
-                "StartTime": (datetime.datetime.now() - datetime.timedelta(hours=24)).strftime("%Y-%m-%dZ"),
-                "EndTime": (datetime.datetime.now() - datetime.timedelta(hours=0)).strftime("%Y-%m-%dZ"),
-                "SortKey": "TotalExecutionCounts"
-            }, filter_instance_list
+    def get_slow_logs(self, params, **kwargs):
+        """
+        逐个实例获取慢查询
+        :param params: 每个实例的 DescribeSlowLogs 参数
+        :return: list
+        """
+        return list(map(lambda x: self.get_slow_log(x, **kwargs), params))
 
-        ))
-        result = []
-        for ins_params in params:
-            try:
-                response = self.get_describe_slow_logs(**ins_params)["Items"]["SQLSlowLog"]
-                sql_list = self.get_top_10(response)
-                # print(sql_list)
-                # 通过 SQLHASH 获取SQL的执行账号和客户端
-                # 'SQLHASH': '18122c83b8203a7028a0e3c92b88bc3a'
+    def get_slow_log(self, ins_params, **kwargs):
+        """
+        获取单个实例的慢查询
+        :param ins_params: 实例的 DescribeSlowLogs 参数
+        :return: dict 获取失败时返回 {}
+        """
+        try:
+            if kwargs.get('store'):
+                # 增量采集：只请求水位之后的日期，报告窗口的数据从本地状态库读取
+                response = self.iter_incremental_slow_logs(kwargs['store'], kwargs['DBNames'],
+                                                           kwargs.get('from_store'), **ins_params)
+            else:
+                response = self.iter_describe_slow_logs(kwargs['DBNames'], **ins_params)
+            if kwargs.get('aggregator'):
+                # 全局汇总：逐行记录指纹，不影响本实例的TOP SQL
+                response = kwargs['aggregator'].tap(ins_params['DBInstanceId'], response)
+            sql_list = self.get_top_10(response, kwargs.get('top_k', TOP_K),
+                                       kwargs.get('sort_keys', SORT_KEYS))
+            # print(sql_list)
+            # 通过 SQLHASH 获取SQL的执行账号和客户端
+            # 'SQLHASH': '18122c83b8203a7028a0e3c92b88bc3a'
+            if kwargs.get('from_store'):
+                # 只使用本地状态库中已解析的执行地址，不请求 DescribeSlowLogRecords
+                host_index = kwargs['store'].get_hosts(ins_params['DBInstanceId'])
+                for _sql in sql_list:
+                    _sql['HostAddress'] = host_index.get(get_sql_key(_sql), '')
+            elif kwargs.get('records_mode') in ('batch', 'stats'):
+                # 单次分页拉取实例的慢日志明细，按 SQLHASH 回填执行地址；stats 时同时计算每条SQL的分位数
+                record_stats = RecordStats() if kwargs.get('records_mode') == 'stats' else None
+                host_index = self.get_slow_log_host_index(sql_list, record_stats, kwargs.get('shard_hours', 0),
+                                                          kwargs.get('max_workers', MAX_WORKERS), **{
+                    "DBInstanceId": ins_params['DBInstanceId'],
+                    "EndTime": (datetime.datetime.now() - datetime.timedelta(hours=0)).strftime("%Y-%m-%dT08:00Z"),
+                    "StartTime": (datetime.datetime.now() - datetime.timedelta(hours=48)).strftime(
+                        "%Y-%m-%dT00:00Z"),
+                })
+                for _sql in sql_list:
+                    _sql['HostAddress'] = host_index.get(_sql["SQLHASH"], '')
+                if record_stats is not None:
+                    record_stats.apply(sql_list)
+            else:
                 for _sql in sql_list:
                     sql_hash = {
                         "DBInstanceId": ins_params['DBInstanceId'],
@@ -199,35 +380,203 @@ class Custom:
                     else:
                         _sql['HostAddress'] = ''
                         # print(json.dumps(hash_response))
-                # 2.2 过滤DBNames
-                if kwargs['DBNames']:
-                    slow_logs_filter = list(filter(lambda x: x["DBName"] in kwargs['DBNames'], sql_list
-                                                   ))
-                else:
-                    slow_logs_filter = sql_list
+            if kwargs.get('store') and not kwargs.get('from_store'):
+                kwargs['store'].save_hosts(ins_params['DBInstanceId'], sql_list)
+            # 2.2 过滤DBNames
+            if kwargs['DBNames']:
+                slow_logs_filter = list(filter(lambda x: x["DBName"] in kwargs['DBNames'], sql_list
+                                               ))
+            else:
+                slow_logs_filter = sql_list
+
+            # print(slow_logs_filter)
+            slow_log = {
+                "DBInstanceId": ins_params['DBInstanceId'],
+                "sql_list": slow_logs_filter
+            }
+        except Exception as e:
+            print('{} 获取慢查询失败: {}'.format(ins_params['DBInstanceId'], e))
+            slow_log = {}
+        return slow_log
 
-                # print(slow_logs_filter)
+    async def async_get_slow_logs(self, params, **kwargs):
+        """
+        asyncio 并发获取所有实例的慢查询，每个 Action 按令牌桶限速
+        :param params: 每个实例的 DescribeSlowLogs 参数
+        :return: list 与 params 顺序一致
+        """
+        engine = AsyncAliyunClient(self.aliyun, kwargs.get('async_concurrency', ASYNC_CONCURRENCY),
+                                   kwargs.get('rate_limits'), kwargs.get('default_rate', DEFAULT_RATE_LIMIT))
+
+        async def get_slow_log(ins_params):
+            try:
+                # DescribeSlowLogRecords 的实例ID与时间窗口
+                records_params = {
+                    "DBInstanceId": ins_params['DBInstanceId'],
+                    "EndTime": (datetime.datetime.now() - datetime.timedelta(hours=0)).strftime("%Y-%m-%dT08:00Z"),
+                    "StartTime": (datetime.datetime.now() - datetime.timedelta(hours=48)).strftime(
+                        "%Y-%m-%dT00:00Z"),
+                }
+                sql_list = await async_get_top_sql(engine, "rds", ins_params, records_params,
+                                                   kwargs.get('top_k', TOP_K), kwargs.get('sort_keys', SORT_KEYS),
+                                                   kwargs.get('records_mode'), kwargs['DBNames'],
+                                                   shard_hours=kwargs.get('shard_hours', 0))
+                # 过滤DBNames
+                if kwargs['DBNames']:
+                    sql_list = list(filter(lambda x: x["DBName"] in kwargs['DBNames'], sql_list))
                 slow_log = {
                     "DBInstanceId": ins_params['DBInstanceId'],
-                    "sql_list": slow_logs_filter
+                    "sql_list": sql_list
                 }
             except Exception as e:
-                print(str(e))
+                print('{} 获取慢查询失败: {}'.format(ins_params['DBInstanceId'], e))
                 slow_log = {}
-            result.append(slow_log)
+            return slow_log
+
+        try:
+            return await asyncio.gather(*map(get_slow_log, params))
+        finally:
+            engine.close()
+
+    def archive_slow_logs(self, result, aggregator, archive_dir):
+        """
+        本次运行的慢查询统计写入当天的归档，并标记近期（LOOKBACK_DAYS天内）没有出现过的慢SQL
+        """
+        archive = SlowLogArchive(archive_dir)
+        day = get_day()
+        seen, has_history = archive.get_seen(day)
+        # 第一次归档时没有历史数据，不标记
+        if has_history:
+            for instance_slow_logs in result:
+                for _sql in instance_slow_logs.get('sql_list', []):
+                    _sql['NewSlowSQL'] = (instance_slow_logs['DBInstanceId'],
+                                          get_fingerprint(_sql.get('SQLText'))) not in seen
+        archive.save_day(day, aggregator.get_columns())
+
+    def get_plan_profile(self, ins_params, **kwargs):
+        """
+        --Plan 抽样：每个请求只取一页，读取 TotalRecordCount
+        :param ins_params: 实例的 DescribeSlowLogs 参数
+        :return: dict 见 aliyun_run_plan.estimate_instance
+        """
+        slow_logs = list(map(
+            lambda x: int(self.get_describe_slow_logs(PageSize=PLAN_PAGE_SIZE, PageNumber=1, **(
+                dict(ins_params, DBName=x) if x else ins_params)).get("TotalRecordCount") or 0),
+            kwargs['DBNames'] or [None]))
+        records = 0
+        if kwargs.get('records_mode') in ('batch', 'stats'):
+            records_params = {
+                "DBInstanceId": ins_params['DBInstanceId'],
+                "EndTime": (datetime.datetime.now() - datetime.timedelta(hours=0)).strftime("%Y-%m-%dT08:00Z"),
+                "StartTime": (datetime.datetime.now() - datetime.timedelta(hours=48)).strftime("%Y-%m-%dT00:00Z"),
+            }
+            records = int(self.get_describe_slow_log_records(PageSize=PLAN_PAGE_SIZE, PageNumber=1,
+                                                             **records_params).get("TotalRecordCount") or 0)
+        return {"slow_logs": slow_logs, "records": records, "nodes": 0}
+
+    def plan(self, params, **kwargs):
+        """
+        --Plan：不获取慢查询，抽样估算完整运行的请求数与耗时
+        :param params: 每个实例的 DescribeSlowLogs 参数
+        :return: dict 见 aliyun_run_plan.build_plan
+        """
+        discovery = self.metrics.to_dict()
+        discovery = {
+            "seconds": discovery["stages"].get('discovery', 0),
+            "calls": dict(map(lambda x: (x[0], x[1]["calls"]), discovery["actions"].items())),
+        }
+        if kwargs.get('from_store'):
+            # 只读取本地状态库，不请求慢查询接口
+            profiles, records_mode, default_profile = [], None, get_default_profile(0)
+        else:
+            records_mode = kwargs.get('records_mode')
+            default_profile = get_default_profile(len(kwargs['DBNames'] or [None]), kwargs.get('top_k', TOP_K))
+            profiles = get_profiles(lambda x: self.get_plan_profile(x, **kwargs),
+                                    get_sample(params, kwargs.get('plan_sample', PLAN_SAMPLE)),
+                                    kwargs.get('max_workers', MAX_WORKERS))
+        windows = len(split_window(
+            (datetime.datetime.now() - datetime.timedelta(hours=48)).strftime("%Y-%m-%dT00:00Z"),
+            (datetime.datetime.now() - datetime.timedelta(hours=0)).strftime("%Y-%m-%dT08:00Z"),
+            kwargs.get('shard_hours', 0)))
+        # 与 start_up 选择的运行方式一致
+        engine = 'async' if kwargs.get('async_engine') and not kwargs.get('store_path') \
+            and not (kwargs.get('fleet_top_n') or kwargs.get('archive_dir')) else 'sync'
+        parallel = 1
+        return build_plan(len(params), profiles, records_mode, engine, get_latency(self.metrics.to_dict()["actions"]),
+                          kwargs.get('top_k', TOP_K), windows, kwargs.get('max_workers', MAX_WORKERS), parallel,
+                          kwargs.get('async_concurrency', ASYNC_CONCURRENCY), kwargs.get('rate_limits'),
+                          kwargs.get('default_rate', DEFAULT_RATE_LIMIT), default_profile, discovery)
+
+    def start_up(self, **kwargs):
+        # 报告模板只编译一次，所有实例共用；指定目录时编译结果缓存到磁盘
+        set_bytecode_cache(kwargs.get('template_cache_dir'))
+        # 1.获取实例
+        with self.metrics.stage('discovery'):
+            # 1.1 指定了实例ID时直接并发查询实例详情，不再遍历所有地域
+            if kwargs['filter_instance']:
+                filter_instance_list = self.get_instance_by_ids(kwargs['DBInstanceIds'], kwargs['db_engines'],
+                                                                kwargs['common_region_ids'],
+                                                                kwargs.get('max_workers', MAX_WORKERS))
+            # 1.2 按照地域和数据库引擎过滤实例ID
+            else:
+                filter_instance_list = self.get_inventory(**kwargs)
+        # print(filter_instance_list)
+
+        # 2 获取慢查询信息
+        # 2.1 获取已过滤的实例的慢查询
+        params = list(map(
+            lambda x:
+            {
+                "DBInstanceId": x["DBInstanceId"],
+                "StartTime": (datetime.datetime.now() - datetime.timedelta(hours=24)).strftime("%Y-%m-%dZ"),
+                "EndTime": (datetime.datetime.now() - datetime.timedelta(hours=0)).strftime("%Y-%m-%dZ"),
+                "SortKey": "TotalExecutionCounts"
+            }, filter_instance_list
+
+        ))
+        # 只估算请求数与耗时，不获取慢查询
+        if kwargs.get('plan'):
+            print_plan(self.plan(params, **kwargs))
+            return
+        if kwargs.get('store_path'):
+            kwargs['store'] = SlowLogStore(kwargs['store_path'])
+        if kwargs.get('fleet_top_n') or kwargs.get('archive_dir'):
+            kwargs['aggregator'] = FleetAggregator(('MySQLTotalExecutionCounts', 'SQLServerTotalExecutionCounts'),
+                                                   ('MySQLTotalExecutionTimes', 'SQLServerTotalExecutionTimes'))
+        # 增量采集依赖逐实例写入状态库、全局汇总需要逐行读取统计，使用顺序获取方式
+        with self.metrics.stage('fetch'):
+            if kwargs.get('async_engine') and not kwargs.get('store') and not kwargs.get('aggregator'):
+                result = asyncio.run(self.async_get_slow_logs(params, **kwargs))
+            else:
+                result = self.get_slow_logs(params, **kwargs)
         # print(result)
 
-        # 循环所有的实例，打印报告
-        for instance_slow_logs in result:
-            report = GetReport(**instance_slow_logs)
-            report.maker(kwargs["out_dir"])
+        with self.metrics.stage('render'):
+            # 按SQL指纹汇总所有实例，输出全局TOP SQL
+            if kwargs.get('fleet_top_n'):
+                kwargs['aggregator'].maker(kwargs["out_dir"], kwargs['fleet_top_n'])
+            # 写入历史归档
+            if kwargs.get('archive_dir'):
+                self.archive_slow_logs(result, kwargs['aggregator'], kwargs['archive_dir'])
+
+            # 所有实例写入一个汇总报告
+            if kwargs.get('consolidated'):
+                report = FleetReport('RDS实例每日慢SQL汇总报告', 'DBInstanceId', REPORT_COLUMNS,
+                                     ('MySQLTotalExecutionCounts', 'SQLServerTotalExecutionCounts'))
+                report.maker(result, kwargs["out_dir"])
+                return
+
+            # 循环所有的实例，打印报告；获取失败的实例返回 {}，不生成报告
+            for instance_slow_logs in filter(None, result):
+                report = GetReport(**instance_slow_logs)
+                report.maker(kwargs["out_dir"])
 
 
 class GetReport:
     def __init__(self, **kwargs):
         self.render_data = kwargs
 
-    def render_template(self):
+    def load_template(self):
         template_data = """    <div class="app-page-title">
         <div class="row col-12">
             <div class="col-md-12">
@@ -247,6 +596,11 @@ class GetReport:
                                 <th class="text-center table-title-heading">最大执行时长 秒</th>
                                 <th class="text-center table-title-heading">解析SQL最大行数</th>
                                 <th class="text-center table-title-heading">返回SQL最大行数</th>
+                                {% if sql_list and sql_list[0].QueryTimesQuantiles is defined %}
+                                <th class="text-center table-title-heading">执行时长 p50/p95/p99</th>
+                                <th class="text-center table-title-heading">锁等待时长 p50/p95/p99</th>
+                                <th class="text-center table-title-heading">扫描行数 p50/p95/p99</th>
+                                {% endif %}
                                 <th class="text-center table-title-heading" width="1000">慢查询</th>
                             </tr>
                             </thead>
@@ -255,13 +609,18 @@ class GetReport:
                                             <td class="text-center table-title-subheading">{{ loop.index }}</td>
                                             <td class="text-center table-title-subheading">{{ DBInstanceId }}</td>
                                             <td class="text-center table-title-subheading">{{ sql.DBName }}</td>
-                                            <td class="text-center table-title-subheading">{{ sql.HostAddress }}</td>
+                                            <td class="text-center table-title-subheading">{% if sql.HostHistogram %}{% for host in sql.HostHistogram %}<div>{{ host.HostAddress }} {{ host.Count }}次 {{ host.QueryTimes }}秒</div>{% endfor %}{% else %}{{ sql.HostAddress }}{% endif %}</td>
                                             <td class="text-center table-title-subheading">{{ sql.MySQLTotalExecutionCounts or sql.SQLServerTotalExecutionCounts }}</td>
                                             <td class="text-center table-title-subheading">{{ sql.MySQLTotalExecutionTimes or sql.SQLServerTotalExecutionTimes }}</td>
                                             <td class="text-center table-title-subheading">{{ sql.MaxExecutionTime }}</td>
                                             <td class="text-center table-title-subheading">{{ sql.ParseMaxRowCount }}</td>
                                             <td class="text-center table-title-subheading">{{ sql.ReturnMaxRowCount }}</td>
-                                            <td class="text-center table-title-subheading">{{ sql.SQLText }}</td>
+                                            {% if sql.QueryTimesQuantiles is defined %}
+                                            <td class="text-center table-title-subheading">{{ sql.QueryTimesQuantiles }}</td>
+                                            <td class="text-center table-title-subheading">{{ sql.LockTimesQuantiles }}</td>
+                                            <td class="text-center table-title-subheading">{{ sql.ParseRowCountsQuantiles }}</td>
+                                            {% endif %}
+                                            <td class="text-center table-title-subheading">{{ sql.SQLText }}{% if sql.NewSlowSQL %} <span class="badge badge-danger">新增</span>{% endif %}</td>
                                         </tr>
                                     {% endfor %}
 
@@ -287,8 +646,10 @@ class GetReport:
 </html>
 """
 
-        template = Template(template_data)
-        return template.render(**self.render_data)
+        return get_template('rds_slowlog', template_data)
+
+    def render_template(self):
+        return self.load_template().render(**self.render_data)
 
     def maker(self, out_dir):
         # 因为CSS中存在{{因此不能放在template_data中渲染
@@ -385,17 +746,22 @@ class GetReport:
         </div>
     </div>
         """
-        html_string_1 = self.render_template()
         # print('\n'.join([html_string_0, html_string_1]))
         file_name = 'report-{instance}-{time_string}.html'.format(instance=self.render_data['DBInstanceId'],
                                                                   time_string=time.strftime('%Y%m%d%H%M%S',
                                                                                             time.localtime(
                                                                                                 time.time())))
+        # 模板渲染结果逐段写入文件，不在内存中拼接整个页面
         with open('{}/{}'.format(out_dir, file_name), 'w') as f:
-            f.write('\n'.join([html_string_0, html_string_1]))
+            f.write('\n'.join([html_string_0, '']))
+            self.load_template().stream(**self.render_data).dump(f)
 
 
-if __name__ == "__main__":
+def main(argv=None, api=None):
+    """
+    命令行入口，常驻调度（aliyun_report_scheduler）传入 argv 和上次运行返回的 api，复用已初始化的客户端
+    :return: Custom 没有运行时返回 None
+    """
     parser = argparse.ArgumentParser(description='''阿里云RDS实例每日慢查询报告小工具
 Example：
 获取所有地域RDS实例的每日慢查询报告
@@ -422,49 +788,139 @@ us-east-1 : 单个地域
     MySQL,SQLServer : 多个类型用逗号分割
     PostgreSQL : 单个类型
     支持的所有类型：MySQL, SQLServer, PostgreSQL, PPAS, MariaDB''')
-parser.add_argument("--DBInstanceId", default='all', help='''数据库实例ID 默认为all
+    parser.add_argument("--DBInstanceId", default='all', help='''数据库实例ID 默认为all
     rr-bp1d96998y68h5439,rm-bp1l20jmw5p587zl2 : 多个实例用逗号分割
     rr-bp1d96998y68h5439 : 单个实例''')
-parser.add_argument("--DBName", help='''数据库名 非必要参数，如果指定必须与 --DBInstanceId 单实例 同时使用
+    parser.add_argument("--DBName", help='''数据库名 非必要参数，如果指定必须与 --DBInstanceId 单实例 同时使用
     db1,db2 : 多个库
     db1 : 单个库''')
+    parser.add_argument("--MaxWorkers", type=int, default=MAX_WORKERS,
+                        help='并发获取实例的地域数 默认为{}'.format(MAX_WORKERS))
+    parser.add_argument("--RegionConcurrency", type=int, default=REGION_CONCURRENCY,
+                        help='单个地域内同时进行的翻页请求数 默认为{}'.format(REGION_CONCURRENCY))
+    parser.add_argument("--TopK", type=int, default=TOP_K, help='每个实例保留的TOP SQL条数 默认为{}'.format(TOP_K))
+    parser.add_argument("--SortKeys", default=','.join(SORT_KEYS),
+                        help='TOP SQL排序字段 多个用逗号分割 默认为{}'.format(','.join(SORT_KEYS)))
+    parser.add_argument("--RetryTries", type=int, default=RETRY_TRIES,
+                        help='API限流或临时错误时的最大尝试次数 默认为{}'.format(RETRY_TRIES))
+    parser.add_argument("--MaxInFlight", type=int, default=MAX_IN_FLIGHT,
+                        help='AIMD 自适应并发的上限 默认为{}'.format(MAX_IN_FLIGHT))
+    parser.add_argument("--CacheDir", default=CACHE_DIR, help='实例清单缓存目录 默认为{}'.format(CACHE_DIR))
+    parser.add_argument("--CacheTTL", type=int, default=CACHE_TTL,
+                        help='实例清单缓存有效期（秒） 默认为{} 即不使用缓存'.format(CACHE_TTL))
+    parser.add_argument("--RefreshCache", action='store_true', help='忽略未过期的实例清单缓存，重新获取并写入缓存')
+    parser.add_argument("--Consolidated", action='store_true',
+                        help='所有实例输出到一个汇总报告 report-fleet-*.html，默认每个实例一个报告文件')
+    parser.add_argument("--FleetTopN", type=int, default=0,
+                        help='按SQL指纹汇总所有实例，输出全局TOP N到 fleet-top-sql-*.json，默认0不输出 建议{}'.format(
+                            FLEET_TOP_N))
+    parser.add_argument("--ArchiveDir",
+                        help='慢查询历史归档目录 非必要参数，指定后每次运行写入当天的归档，并在报告中标记新增的慢SQL')
+    parser.add_argument("--TemplateCacheDir", help='报告模板字节码缓存目录 非必要参数，指定后再次运行时不再编译模板')
+    parser.add_argument("--MetricsDir",
+                        help='运行指标输出目录 非必要参数，运行结束时写入 rds_slowlog.json 与 rds_slowlog.prom（Prometheus 文本格式），'
+                             '可指向 node_exporter textfile collector 的目录')
+    parser.add_argument("--MetricsBytes", action='store_true',
+                        help='运行指标中统计每个API的返回数据量，需要重新序列化每次调用的返回值 默认不统计')
+    parser.add_argument("--Plan", action='store_true',
+                        help='只获取实例（或读取实例清单缓存），抽样估算完整运行的请求数、分页数与耗时，不获取慢查询')
+    parser.add_argument("--PlanSample", type=int, default=PLAN_SAMPLE,
+                        help='--Plan 抽样的实例数，每个实例每个接口只请求一页 默认为{} 0为不抽样'.format(PLAN_SAMPLE))
+    parser.add_argument("--StorePath", help='增量采集的本地 SQLite 状态库文件 非必要参数，指定后只请求水位之后的日期')
+    parser.add_argument("--FromStore", action='store_true', help='只从 --StorePath 状态库生成报告，不请求慢查询接口')
+    parser.add_argument("--AsyncEngine", action='store_true', help='使用 asyncio 并发获取所有实例的慢查询')
+    parser.add_argument("--AsyncConcurrency", type=int, default=ASYNC_CONCURRENCY,
+                        help='AsyncEngine 同时在途的请求数 默认为{}'.format(ASYNC_CONCURRENCY))
+    parser.add_argument("--RateLimit", default='', help='''AsyncEngine 按API限速 每秒请求数
+    DescribeSlowLogs=20,DescribeSlowLogRecords=10 : 多个API用逗号分割''')
+    parser.add_argument("--DefaultRateLimit", type=float, default=DEFAULT_RATE_LIMIT,
+                        help='AsyncEngine 未单独指定的API每秒请求数 默认为{} 小于等于0不限速'.format(DEFAULT_RATE_LIMIT))
+    parser.add_argument("--RecordsMode", default='per_sql', choices=['per_sql', 'batch', 'stats'], help='''获取SQL执行地址的方式 默认为per_sql
+    per_sql : 每条TOP SQL调用一次 DescribeSlowLogRecords
+    batch : 每个实例分页拉取一次慢日志明细，在内存中按 SQLHASH 建立索引
+    stats : 同 batch，读取全部慢日志明细，在报告中增加每条SQL执行时长、锁等待时长、扫描行数的 p50 / p95 / p99，
+            以及按来源账号和地址统计的执行次数与总执行时长''')
+    parser.add_argument("--ShardHours", type=int, default=0,
+                        help='慢日志明细（batch / stats）的时间窗口按小时切分，子窗口并发分页（并发数同 MaxWorkers），默认0不切分')
+
+    args = parser.parse_args(argv)
+    if args.FromStore and not args.StorePath:
+        parser.error('--FromStore 只读取状态库，必须同时指定 --StorePath')
+
+    common_region_ids = []
+    db_engines = []
+
+    if args.OutDir:
+        params = {
+            'AccessKeyId': args.AccessKeyId,
+            'AccessKeySecret': args.AccessKeySecret,
+            'RoleName': args.RoleName,
+            'RetryTries': args.RetryTries,
+            'MaxInFlight': args.MaxInFlight,
+        }
+        if api is None:
+            api = Custom()
+            api.get_config(**params)
+        else:
+            # 指标按每次运行单独统计
+            api.metrics.reset()
+        api.metrics.count_bytes = args.MetricsBytes
+
+        if args.Region == 'all':
+            # 延迟到 get_inventory 中获取，命中实例清单缓存时不调用 DescribeRegions
+            common_region_ids = None
+        elif len(args.Region.split(',')):
+            common_region_ids = args.Region.split(',')
+
+        if args.Engine == 'all':
+            db_engines = DB_ENGINES
+        elif len(args.Engine.split(',')):
+            db_engines = args.Engine.split(',')
+
+        if args.DBName and (len(args.DBInstanceId.split(',')) > 1 or args.DBInstanceId == 'all'):
+            print('数据库名 非必要参数，如果指定必须与 --DBInstanceId 单实例 同时使用')
+            return None
+        else:
+            db_names = args.DBName.split(',') if args.DBName else []
+
+        main_kwargs = {
+            'common_region_ids': common_region_ids,
+            'db_engines': db_engines,
+            'filter_instance': False if args.DBInstanceId == 'all' else True,
+            'DBInstanceIds': args.DBInstanceId.split(','),
+            'DBNames': db_names,
+            'out_dir': args.OutDir,
+            'max_workers': args.MaxWorkers,
+            'region_concurrency': args.RegionConcurrency,
+            'region': args.Region,
+            'cache_dir': args.CacheDir,
+            'cache_ttl': args.CacheTTL,
+            'refresh_cache': args.RefreshCache,
+            'consolidated': args.Consolidated,
+            'fleet_top_n': args.FleetTopN,
+            'archive_dir': args.ArchiveDir,
+            'template_cache_dir': args.TemplateCacheDir,
+            'store_path': args.StorePath,
+            'from_store': args.FromStore,
+            'records_mode': args.RecordsMode,
+            'shard_hours': args.ShardHours,
+            'top_k': args.TopK,
+            'sort_keys': tuple(args.SortKeys.split(',')),
+            'async_engine': args.AsyncEngine,
+            'async_concurrency': args.AsyncConcurrency,
+            'rate_limits': parse_rate_limits(args.RateLimit),
+            'default_rate': args.DefaultRateLimit,
+            'plan': args.Plan,
+            'plan_sample': args.PlanSample,
+        }
+        try:
+            api.start_up(**main_kwargs)
+        finally:
+            # 运行失败时同样写入指标，便于定位耗时和出错的API
+            if args.MetricsDir:
+                api.metrics.write(args.MetricsDir)
+        return api
+
 
-args = parser.parse_args()
-
-common_region_ids = []
-db_engines = []
-
-if args.OutDir:
-    params = {
-        'AccessKeyId': args.AccessKeyId,
-        'AccessKeySecret': args.AccessKeySecret,
-        'RoleName': args.RoleName,
-    }
-    api = Custom()
-    api.get_config(**params)
-
-    if args.Region == 'all':
-        common_region_ids = api.get_describe_regions()
-    elif len(args.Region.split(',')):
-        common_region_ids = args.Region.split(',')
-
-    if args.Engine == 'all':
-        db_engines = ['MySQL', 'SQLServer', 'PostgreSQL', 'PPAS', 'MariaDB']
-    elif len(args.Engine.split(',')):
-        db_engines = args.Engine.split(',')
-
-    if args.DBName and (len(args.DBInstanceId.split(',')) > 1 or args.DBInstanceId == 'all'):
-        print('数据库名 非必要参数，如果指定必须与 --DBInstanceId 单实例 同时使用')
-        exit()
-    else:
-        db_names = args.DBName.split(',') if args.DBName else []
-
-    main_kwargs = {
-        'common_region_ids': common_region_ids,
-        'db_engines': db_engines,
-        'filter_instance': False if args.DBInstanceId == 'all' else True,
-        'DBInstanceIds': args.DBInstanceId.split(','),
-        'DBNames': db_names,
-        'out_dir': args.OutDir,
-    }
-    api.start_up(**main_kwargs)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+实例清单本地缓存，供慢查询报告小工具（RDS / PolarDB）共用。
+缓存按 产品 + 访问凭证（AccessKeyId 或 RoleName，不保存密钥）+ 地域 + 数据库类型 区分，
+在 TTL 内再次运行时跳过 DescribeRegions 与逐地域的实例发现。
+同时保存在进程内，常驻调度（aliyun_report_scheduler）多次运行时不再读取缓存文件。
+==========================================================================================
+"""
+# Build-in Modules
+import os
+import json
+import time
+import hashlib
+
+# 默认缓存目录
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.dbreport', 'inventory')
+# 默认缓存有效期（秒），0 表示不使用缓存
+CACHE_TTL = 0
+# 未指定 RoleName 时 aliyun_sdk 使用的默认角色
+DEFAULT_ROLE_NAME = 'ZhuyunFullReadOnlyAccess'
+# 进程内的缓存 {缓存文件: (写入时间, 实例清单)}
+MEMORY_CACHE = {}
+
+
+class InventoryCache:
+    """
+    实例清单缓存，每个缓存键对应缓存目录下的一个json文件
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(product, config, regions, engines):
+        """
+        :param product: rds / polardb
+        :param config: get_config 的参数，只使用 AccessKeyId 和 RoleName
+        :param regions: 地域参数，例如 'all' 或 ['cn-shanghai', 'cn-hangzhou']
+        :param engines: 数据库类型列表
+        :return: str
+        """
+        if config.get('AccessKeyId'):
+            credential = 'ak:{}'.format(config['AccessKeyId'])
+        else:
+            credential = 'role:{}'.format(config.get('RoleName') or DEFAULT_ROLE_NAME)
+        if isinstance(regions, str):
+            regions = regions.split(',')
+        key = json.dumps([product, credential, sorted(regions or []), sorted(engines or [])])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, '{}.json'.format(key))
+
+    def get(self, key):
+        """
+        :return: list 未过期的实例清单；缓存不存在、已过期或不可读时返回 None
+        """
+        if self.ttl <= 0:
+            return None
+        created, instance_list = MEMORY_CACHE.get(self.get_path(key), (0, None))
+        if instance_list is not None and time.time() - created <= self.ttl:
+            return instance_list
+        try:
+            with open(self.get_path(key), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if time.time() - data.get('created', 0) > self.ttl:
+            return None
+        MEMORY_CACHE[self.get_path(key)] = (data.get('created', 0), data.get('instance_list'))
+        return data.get('instance_list')
+
+    def set(self, key, instance_list):
+        """
+        写入缓存，空清单通常意味着发现失败，不写入
+        """
+        if self.ttl <= 0 or not instance_list:
+            return
+        MEMORY_CACHE[self.get_path(key)] = (time.time(), instance_list)
+        try:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp_path = '{}.{}.tmp'.format(self.get_path(key), os.getpid())
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'created': time.time(), 'instance_list': instance_list}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.get_path(key))
+        except (IOError, OSError) as e:
+            print(str(e))
+            print("写入实例清单缓存失败")
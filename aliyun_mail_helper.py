@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+邮件发送公共模块，供慢查询报告邮件小工具（RDS / PolarDB）共用。
+SmtpSession: 整个运行过程复用一个已登录的 SMTP_SSL 连接，不再每封邮件重新握手和登录。
+==========================================================================================
+"""
+# Build-in Modules
+import smtplib
+
+# 默认 SMTP_SSL 端口
+SMTP_SSL_PORT = 465
+
+
+class SmtpSession:
+    """
+    复用的 SMTP_SSL 会话：首次发送时连接并登录，之后的邮件使用同一连接，
+    连接被服务器断开时重新连接并重发一次
+    """
+
+    def __init__(self, host, user, password, port=SMTP_SSL_PORT, debug_level=0):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.port = port
+        self.debug_level = debug_level
+        self.server = None
+
+    def connect(self):
+        self.server = smtplib.SMTP_SSL(host=self.host, port=self.port)
+        self.server.set_debuglevel(self.debug_level)
+        self.server.login(self.user, self.password)
+
+    def sendmail(self, from_user, to_users, msg):
+        if self.server is None:
+            self.connect()
+        try:
+            return self.server.sendmail(from_user, to_users, msg)
+        except smtplib.SMTPServerDisconnected:
+            self.connect()
+            return self.server.sendmail(from_user, to_users, msg)
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except OSError:
+            pass
+        self.server = None
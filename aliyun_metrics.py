@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+运行指标，供慢查询报告小工具（RDS / PolarDB）共用。
+1. 每次API调用（每次尝试）按 Action 记录：调用次数与结果、耗时直方图、限流与重试次数，可选记录返回数据量；
+2. 各阶段（discovery 获取实例、fetch 获取慢查询、render 生成报告、mail 发送邮件）的累计耗时；
+3. 运行结束时写入 JSON 文件，以及 node_exporter textfile collector 可读取的 Prometheus 文本格式文件。
+==========================================================================================
+"""
+# Build-in Modules
+import os
+import json
+import time
+import threading
+import contextlib
+from collections import Counter, defaultdict
+
+# 耗时直方图的分桶上限（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Prometheus 指标名前缀
+METRIC_PREFIX = 'aliyun_slowlog'
+
+
+def get_response_bytes(api_res):
+    """
+    返回数据量：SDK 只返回解析后的JSON，没有原始响应体，按重新序列化的 UTF-8 字节数估算，
+    每次调用都要序列化整个返回值，默认不统计
+    """
+    if not api_res:
+        return 0
+    return len(json.dumps(api_res, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8'))
+
+
+def format_labels(labels):
+    return ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for key, value in labels)
+
+
+class Metrics:
+    """
+    :param tool: 小工具名称，写入文件名和 Prometheus 的 tool 标签，例如 rds_slowlog
+    :param count_bytes: 是否统计返回数据量，见 get_response_bytes
+    """
+
+    def __init__(self, tool, count_bytes=False):
+        self.tool = tool
+        self.count_bytes = count_bytes
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        清空已记录的指标，常驻调度复用同一个客户端时每次运行单独统计
+        """
+        self.started = time.time()
+        # {(Action, 结果): 次数}，结果为 ok / throttled / transient / api_error / error
+        self.calls = Counter()
+        # {Action: [每个分桶的次数..., +Inf]}
+        self.latency_buckets = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+        self.latency_sum = Counter()
+        self.response_bytes = Counter()
+        # 重试耗尽的次数
+        self.exhausted = Counter()
+        # {阶段: 累计秒数}
+        self.stages = Counter()
+
+    def observe_call(self, action, seconds, outcome, api_res=None):
+        size = get_response_bytes(api_res) if self.count_bytes else 0
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        with self.lock:
+            self.calls[(action, outcome)] = self.calls[(action, outcome)] + 1
+            self.latency_buckets[action][index] = self.latency_buckets[action][index] + 1
+            self.latency_sum[action] = self.latency_sum[action] + seconds
+            self.response_bytes[action] = self.response_bytes[action] + size
+
+    def observe_exhausted(self, action):
+        with self.lock:
+            self.exhausted[action] = self.exhausted[action] + 1
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        累计阶段耗时，可在多个线程中同时使用（流水线中为各线程耗时之和）
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.stages[name] = self.stages[name] + time.monotonic() - started
+
+    def timed(self, name, func):
+        """
+        :return: 记录阶段耗时的 func
+        """
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def to_dict(self):
+        with self.lock:
+            actions = sorted(set(action for action, _ in self.calls))
+            data = {
+                "tool": self.tool,
+                "started": self.started,
+                "duration": time.time() - self.started,
+                "stages": dict(self.stages),
+                "actions": {},
+            }
+            for action in actions:
+                outcomes = {outcome: count for (name, outcome), count in self.calls.items() if name == action}
+                retryable = outcomes.get('throttled', 0) + outcomes.get('transient', 0)
+                data["actions"][action] = {
+                    "calls": sum(outcomes.values()),
+                    "outcomes": outcomes,
+                    "throttled": outcomes.get('throttled', 0),
+                    "retries": retryable - self.exhausted[action],
+                    "exhausted": self.exhausted[action],
+                    "latency_sum": self.latency_sum[action],
+                    "latency_buckets": dict(zip(list(map(str, LATENCY_BUCKETS)) + ['+Inf'],
+                                                self.latency_buckets[action])),
+                }
+                if self.count_bytes:
+                    data["actions"][action]["response_bytes"] = self.response_bytes[action]
+        return data
+
+    def to_prometheus(self):
+        data = self.to_dict()
+        tool = ('tool', self.tool)
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append('# HELP {}_{} {}'.format(METRIC_PREFIX, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(METRIC_PREFIX, name, metric_type))
+            for suffix, labels, value in samples:
+                lines.append('{}_{}{}{{{}}} {}'.format(METRIC_PREFIX, name, suffix, format_labels([tool] + labels),
+                                                       value))
+
+        actions = data["actions"]
+        metric('api_calls_total', 'counter', 'API call attempts by action and outcome.',
+               [('', [('action', action), ('outcome', outcome)], count)
+                for action, item in actions.items() for outcome, count in sorted(item["outcomes"].items())])
+        metric('api_retries_total', 'counter', 'API call attempts that were retried.',
+               [('', [('action', action)], item["retries"]) for action, item in actions.items()])
+        metric('api_throttled_total', 'counter', 'API call attempts rejected by flow control.',
+               [('', [('action', action)], item["throttled"]) for action, item in actions.items()])
+        if self.count_bytes:
+            metric('api_response_bytes_total', 'counter', 'Approximate API response size in bytes.',
+                   [('', [('action', action)], item["response_bytes"]) for action, item in actions.items()])
+        samples = []
+        for action, item in actions.items():
+            cumulative = 0
+            for bound, count in item["latency_buckets"].items():
+                cumulative = cumulative + count
+                samples.append(('_bucket', [('action', action), ('le', bound)], cumulative))
+            samples.append(('_sum', [('action', action)], round(item["latency_sum"], 6)))
+            samples.append(('_count', [('action', action)], item["calls"]))
+        metric('api_call_duration_seconds', 'histogram', 'API call attempt latency.', samples)
+        metric('stage_duration_seconds', 'gauge', 'Cumulative time spent in each stage of the last run.',
+               [('', [('stage', stage)], round(seconds, 6)) for stage, seconds in sorted(data["stages"].items())])
+        metric('run_duration_seconds', 'gauge', 'Wall-clock duration of the last run.',
+               [('', [], round(data["duration"], 6))])
+        metric('last_run_timestamp_seconds', 'gauge', 'Unix time the last run finished.',
+               [('', [], int(time.time()))])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, out_dir):
+        """
+        写入 <tool>.json 与 <tool>.prom，先写临时文件再替换，textfile collector 不会读到写了一半的文件
+        :return: list 写入的文件
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        files = []
+        for file_name, content in (('{}.json'.format(self.tool), json.dumps(self.to_dict(), indent=2)),
+                                   ('{}.prom'.format(self.tool), self.to_prometheus())):
+            path = os.path.join(out_dir, file_name)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(path + '.tmp', path)
+            files.append(path)
+        return files
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+多阶段流水线，供慢查询报告邮件小工具（RDS / PolarDB）共用。
+各阶段（获取慢查询 -> 渲染报告 -> 发送邮件）由有界队列连接、同时运行：
+前面的实例已经在发送邮件时，后面的实例仍在获取；下游较慢时上游在队列满时阻塞，内存占用有上限。
+==========================================================================================
+"""
+# Build-in Modules
+import queue
+import threading
+
+# 相邻阶段之间的队列长度
+QUEUE_SIZE = 16
+# 获取慢查询阶段的默认并发数，1 表示与顺序获取的API请求量一致
+PIPELINE_WORKERS = 1
+
+# 阶段结束标记
+_STOP = object()
+
+
+class Pipeline:
+    """
+    :param stages: [(func, workers), ...] 每个阶段的处理函数与线程数，
+                   func(item) 的返回值进入下一阶段，返回 None 或抛出异常时丢弃该元素
+    :param queue_size: 相邻阶段之间的队列长度
+    """
+
+    def __init__(self, stages, queue_size=QUEUE_SIZE):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.remaining = [workers for _, workers in stages]
+        self.lock = threading.Lock()
+
+    def worker(self, index):
+        func, _ = self.stages[index]
+        in_queue = self.queues[index]
+        while True:
+            item = in_queue.get()
+            if item is _STOP:
+                break
+            try:
+                item = func(item)
+            except Exception as e:
+                print(str(e))
+                item = None
+            if item is not None and index + 1 < len(self.stages):
+                self.queues[index + 1].put(item)
+        # 本阶段最后一个线程结束时，通知下一阶段的所有线程结束
+        with self.lock:
+            self.remaining[index] = self.remaining[index] - 1
+            finished = self.remaining[index] == 0
+        if finished and index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1][1]):
+                self.queues[index + 1].put(_STOP)
+
+    def run(self, items):
+        """
+        :param items: 第一阶段的输入，可迭代对象（可以是生成器，在调用线程中逐个读取）
+        """
+        threads = []
+        for index, (_, workers) in enumerate(self.stages):
+            for _ in range(workers):
+                thread = threading.Thread(target=self.worker, args=(index,), daemon=True)
+                thread.start()
+                threads.append(thread)
+        try:
+            for item in items:
+                self.queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0][1]):
+                self.queues[0].put(_STOP)
+            for thread in threads:
+                thread.join()
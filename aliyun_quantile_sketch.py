@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+流式分位数估计，供慢查询报告小工具（RDS / PolarDB）共用。
+QuantileSketch: 按对数分桶计数（DDSketch），不保存原始值：
+1. 每个值落入 gamma 为底的对数桶，估计值的相对误差不超过 relative_accuracy；
+2. 桶的编号按顺序保存，桶数超过 max_buckets 时一次合并所有多出的最小桶（只影响最低的分位数），
+   之后更小的值直接计入最低的桶，不再反复合并，内存占用有上限；
+3. 可以合并（merge），分页、并发扫描得到的结果可以汇总。
+==========================================================================================
+"""
+# Build-in Modules
+import math
+import bisect
+
+# 默认相对误差 1%
+RELATIVE_ACCURACY = 0.01
+# 每个 sketch 最多保留的桶数
+MAX_BUCKETS = 2048
+
+
+class QuantileSketch:
+    """
+    :param relative_accuracy: 分位数估计的相对误差
+    :param max_buckets: 最多保留的桶数
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY, max_buckets=MAX_BUCKETS):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        # 桶的编号，从小到大
+        self.indexes = []
+        # 合并过的最低桶编号，更小的值计入该桶
+        self.floor = None
+        # 0 与负数（例如锁等待时长为0）单独计数
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count = self.count + 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if value <= 0:
+            self.zero_count = self.zero_count + 1
+            return
+        self.add_bucket(math.ceil(math.log(value) / self.log_gamma), 1)
+        if len(self.buckets) > self.max_buckets:
+            self.collapse()
+
+    def add_bucket(self, index, count):
+        if self.floor is not None and index < self.floor:
+            index = self.floor
+        if index not in self.buckets:
+            bisect.insort(self.indexes, index)
+            self.buckets[index] = 0
+        self.buckets[index] = self.buckets[index] + count
+
+    def collapse(self):
+        """
+        所有多出的最小桶一次合并到保留的最低桶
+        """
+        excess = len(self.indexes) - self.max_buckets
+        if excess <= 0:
+            return
+        lowest, self.indexes = self.indexes[:excess], self.indexes[excess:]
+        self.floor = self.indexes[0]
+        self.buckets[self.floor] = self.buckets[self.floor] + sum(map(self.buckets.pop, lowest))
+
+    def merge(self, other):
+        self.count = self.count + other.count
+        self.zero_count = self.zero_count + other.zero_count
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+        if other.floor is not None:
+            self.floor = other.floor if self.floor is None else max(self.floor, other.floor)
+            # 低于新的最低桶的已有计数并入最低桶
+            lowest = list(filter(lambda x: x < self.floor, self.indexes))
+            if lowest:
+                del self.indexes[:len(lowest)]
+                count = sum(map(self.buckets.pop, lowest))
+                self.add_bucket(self.floor, count)
+        for index, count in other.buckets.items():
+            self.add_bucket(index, count)
+        self.collapse()
+
+    def quantile(self, q):
+        """
+        :param q: 0 ~ 1
+        :return: float 没有数据时返回 None
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return min(self.min, 0)
+        seen = self.zero_count
+        for index in self.indexes:
+            seen = seen + self.buckets[index]
+            if seen > rank:
+                # 桶的中间值，限制在实际最小、最大值之间
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+报告小工具的常驻调度进程，代替 cron 每次冷启动 python3 aliyun_get_*.py：
+1. 进程内保持已初始化的客户端（每个任务一个，超过 ClientTTL 后重建以更新 STS Token）、
+   实例清单缓存与编译后的报告模板，每次运行只获取数据和生成报告；
+   所有任务共用一个模板 Environment，字节码缓存目录在启动时由 --TemplateCacheDir 设置一次，
+   任务参数中的 --TemplateCacheDir 不生效；
+2. 任务按 cron 表达式（分 时 日 月 周）调度，每次触发增加随机延迟（jitter），分散对API的请求；
+3. 不同任务并发运行（MaxJobs 个），同一任务上一次运行未结束时跳过本次触发。
+配置文件（json），args 与命令行运行小工具时的参数相同:
+{
+  "jobs": [
+    {"name": "rds", "tool": "rds_slowlog", "schedule": "0 8 * * *", "jitter": 600,
+     "args": ["--RoleName", "RoleName", "--OutDir", "report"]},
+    {"name": "mysql", "tool": "mysql_healthcheck", "schedule": "30 7 * * 1-5",
+     "args": ["--Engine", "mysql", "--Host", "10.0.0.29", "--Port", "3306", "--User", "user",
+              "--Password", "password", "--DBName", "dbname", "--OutDir", "report"]}
+  ]
+}
+使用方法: python3 aliyun_report_scheduler.py --Config scheduler.json
+==========================================================================================
+"""
+# Build-in Modules
+import os
+import sys
+import json
+import time
+import random
+import signal
+import datetime
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 3rd-part Modules
+import argparse
+
+# Project Modules
+from aliyun_report_template import set_bytecode_cache
+
+# 小工具: (模块, 模块所在目录, 是否复用客户端)
+TOOLS = {
+    'rds_slowlog': ('aliyun_get_rds_slowlog', '', True),
+    'polardb_slowlog': ('aliyun_get_polardb_slowlog', '', True),
+    'rds_slowlog_mail': ('aliyun_get_rds_slowlog_send_mail', '', True),
+    'polardb_slowlog_mail': ('aliyun_get_polardb_slowlog_send_mail', '', True),
+    'mysql_healthcheck': ('aliyun_get_mysql_healthcheck', 'aliyun_get_mysql_healthcheck', False),
+    'pg_healthcheck': ('aliyun_get_pg_healthcheck', 'aliyun_get_pg_healthcheck', False),
+}
+# 默认同时运行的任务数
+MAX_JOBS = 2
+# 默认随机延迟上限（秒）
+JITTER = 300
+# 默认客户端重建间隔（秒）
+CLIENT_TTL = 3600
+# 任务未指定 --CacheTTL 时，慢查询小工具使用的实例清单缓存有效期（秒）
+DAEMON_CACHE_TTL = 3600
+# 主循环最长等待时间（秒）
+POLL_SECONDS = 60
+
+# cron 各字段的取值范围：分 时 日 月 周（0 和 7 均为周日）
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def log(message):
+    print('[{}] {}'.format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), message), flush=True)
+
+
+def parse_cron_field(field, low, high):
+    """
+    解析 cron 的一个字段，支持 *、a-b、a,b、*/n、a-b/n
+    :return: set
+    """
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            start, stop = low, high
+        elif '-' in part:
+            start, stop = map(int, part.split('-', 1))
+        else:
+            start = int(part)
+            # 5/10 表示从5开始每10个
+            stop = high if step > 1 else start
+        if start < low or stop > high or start > stop or step <= 0:
+            raise ValueError('无效的 cron 字段: {}'.format(field))
+        values.update(range(start, stop + 1, step))
+    return values
+
+
+class CronSchedule:
+    """
+    :param expression: cron 表达式 "分 时 日 月 周"，例如 "0 8 * * 1-5"
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ValueError('cron 表达式必须为5个字段: {}'.format(expression))
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = map(
+            lambda x: parse_cron_field(x[0], *x[1]), zip(fields, CRON_FIELDS))
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+        # 与 cron 相同：日和周都有限制时满足其一即可，以 * 开头（包括 */n）的字段不算限制
+        self.days_restricted = not fields[2].startswith('*')
+        self.weekdays_restricted = not fields[4].startswith('*')
+
+    def match_day(self, t):
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day or weekday
+        return day and weekday
+
+    def next_time(self, after):
+        """
+        :return: datetime after 之后的第一个触发时间（精确到分钟）
+        """
+        t = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        # 2月29日最多需要跨越数年
+        limit = t + datetime.timedelta(days=366 * 8)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self.match_day(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t = t + datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError('cron 表达式没有触发时间: {}'.format(self.expression))
+
+
+def load_tool(tool):
+    """
+    导入小工具模块，健康检查小工具不在仓库根目录，先把所在目录加入 sys.path
+    """
+    module_name, module_dir, _ = TOOLS[tool]
+    if module_dir:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), module_dir)
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return importlib.import_module(module_name)
+
+
+class Job:
+    """
+    :param name: 任务名
+    :param tool: TOOLS 中的小工具
+    :param schedule: cron 表达式
+    :param args: 小工具的命令行参数
+    :param jitter: 每次触发的随机延迟上限（秒）
+    :param client_ttl: 复用客户端的最长时间（秒）
+    """
+
+    def __init__(self, name, tool, schedule, args, jitter=JITTER, client_ttl=CLIENT_TTL,
+                 cache_ttl=DAEMON_CACHE_TTL):
+        if tool not in TOOLS:
+            raise ValueError('任务 {} 不支持的小工具: {}，支持: {}'.format(name, tool, ', '.join(TOOLS)))
+        self.name = name
+        self.tool = tool
+        self.schedule = CronSchedule(schedule)
+        self.args = list(args)
+        # 慢查询小工具默认使用实例清单缓存，常驻进程内多次运行不再重复发现实例
+        if TOOLS[tool][2] and '--CacheTTL' not in self.args:
+            self.args = self.args + ['--CacheTTL', str(cache_ttl)]
+        if '--TemplateCacheDir' in self.args:
+            log('任务 {} 的 --TemplateCacheDir 不生效，模板字节码缓存由调度进程的 --TemplateCacheDir 设置'.format(name))
+        self.jitter = jitter
+        self.client_ttl = client_ttl
+        self.api = None
+        self.api_created = 0
+        self.running = False
+        self.due = None
+        self.next_run = None
+
+    def plan(self, after):
+        """
+        计算下一次触发时间，随机延迟不累积到后续的触发时间上
+        """
+        self.due = self.schedule.next_time(after)
+        self.next_run = self.due + datetime.timedelta(seconds=random.uniform(0, self.jitter))
+
+    def run(self):
+        module = load_tool(self.tool)
+        if not TOOLS[self.tool][2]:
+            module.main(self.args)
+            return
+        if self.api is not None and time.time() - self.api_created > self.client_ttl:
+            self.api = None
+        api = module.main(self.args, self.api)
+        if api is not None and api is not self.api:
+            self.api, self.api_created = api, time.time()
+
+
+class Scheduler:
+    """
+    :param jobs: Job 列表
+    :param max_jobs: 同时运行的任务数
+    """
+
+    def __init__(self, jobs, max_jobs=MAX_JOBS):
+        self.jobs = jobs
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs)
+        self.stopped = threading.Event()
+
+    def run_job(self, job):
+        started = time.time()
+        log('任务 {} 开始运行'.format(job.name))
+        try:
+            job.run()
+            log('任务 {} 运行完成，耗时 {:.1f}s'.format(job.name, time.time() - started))
+        except (Exception, SystemExit) as e:
+            # 单个任务失败（包括参数错误）不影响调度进程
+            log('任务 {} 运行失败: {!r}'.format(job.name, e))
+        finally:
+            job.running = False
+
+    def submit(self, job):
+        if job.running:
+            log('任务 {} 上一次运行未结束，跳过本次触发'.format(job.name))
+            return None
+        job.running = True
+        return self.executor.submit(self.run_job, job)
+
+    def run_once(self):
+        """
+        立即运行所有任务一次，等待全部完成
+        """
+        for future in list(filter(None, map(self.submit, self.jobs))):
+            future.result()
+        self.executor.shutdown(wait=True)
+
+    def run(self):
+        now = datetime.datetime.now()
+        for job in self.jobs:
+            job.plan(now)
+            log('任务 {} 下次运行: {}'.format(job.name, job.next_run.strftime('%Y-%m-%d %H:%M:%S')))
+        while not self.stopped.is_set():
+            now = datetime.datetime.now()
+            for job in self.jobs:
+                if job.next_run <= now:
+                    self.submit(job)
+                    # 休眠、挂起后错过的触发不再补跑
+                    job.plan(max(job.due, now))
+            wait = min(map(lambda x: (x.next_run - now).total_seconds(), self.jobs))
+            self.stopped.wait(min(max(wait, 0), POLL_SECONDS))
+        log('等待运行中的任务结束')
+        self.executor.shutdown(wait=True)
+
+    def stop(self, *args):
+        self.stopped.set()
+
+
+def load_jobs(config_file, client_ttl=CLIENT_TTL, cache_ttl=DAEMON_CACHE_TTL):
+    with open(config_file, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    return list(map(lambda x: Job(x['name'], x['tool'], x['schedule'], x.get('args', []), x.get('jitter', JITTER),
+                                  client_ttl, cache_ttl), config['jobs']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''报告小工具常驻调度进程
+Example：
+    python3 aliyun_report_scheduler.py --Config scheduler.json
+    python3 aliyun_report_scheduler.py --Config scheduler.json --RunOnce
+支持的小工具: {}
+'''.format(', '.join(TOOLS)), formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--Config", required=True, help='任务配置文件（json） 必要参数')
+    parser.add_argument("--MaxJobs", type=int, default=MAX_JOBS, help='同时运行的任务数 默认为{}'.format(MAX_JOBS))
+    parser.add_argument("--ClientTTL", type=int, default=CLIENT_TTL,
+                        help='复用客户端的最长时间（秒），超过后重建以更新 STS Token 默认为{}'.format(CLIENT_TTL))
+    parser.add_argument("--CacheTTL", type=int, default=DAEMON_CACHE_TTL,
+                        help='慢查询任务未指定 --CacheTTL 时的实例清单缓存有效期（秒） 默认为{}'.format(DAEMON_CACHE_TTL))
+    parser.add_argument("--TemplateCacheDir", help='所有任务共用的报告模板字节码缓存目录 非必要参数')
+    parser.add_argument("--RunOnce", action='store_true', help='立即运行所有任务一次后退出，用于检查配置')
+    args = parser.parse_args()
+
+    # 任务并发运行，共用的模板 Environment 只在启动时设置一次字节码缓存
+    set_bytecode_cache(args.TemplateCacheDir, fixed=True)
+    scheduler = Scheduler(load_jobs(args.Config, args.ClientTTL, args.CacheTTL), args.MaxJobs)
+    if args.RunOnce:
+        scheduler.run_once()
+    else:
+        # 收到退出信号后不再触发新的运行，等待运行中的任务结束
+        signal.signal(signal.SIGTERM, scheduler.stop)
+        signal.signal(signal.SIGINT, scheduler.stop)
+        scheduler.run()
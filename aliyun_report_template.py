@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+报告模板公共模块，供慢查询报告小工具（RDS / PolarDB）与健康检查小工具（MySQL / PostgreSQL）共用。
+所有报告共用一个 jinja2 Environment：模板源码按名称注册，首次使用时编译，之后直接复用已编译的模板，
+为每个实例生成报告时不再重复解析模板；指定字节码缓存目录后，编译结果写入磁盘，下次运行直接加载。
+==========================================================================================
+"""
+# Build-in Modules
+import os
+
+# 3rd-part Modules
+from jinja2 import Environment, FunctionLoader, FileSystemBytecodeCache
+
+# 已注册的模板源码 {name: source}
+TEMPLATE_SOURCES = {}
+
+
+def load_template_source(name):
+    source = TEMPLATE_SOURCES.get(name)
+    if source is None:
+        return None
+    # 模板源码随代码发布，运行期间不会变化
+    return source, None, lambda: True
+
+
+# 与 jinja2.Template(source) 的默认配置一致
+ENVIRONMENT = Environment(loader=FunctionLoader(load_template_source))
+# 字节码缓存是否已由常驻调度进程固定
+BYTECODE_CACHE_FIXED = False
+
+
+def set_bytecode_cache(cache_dir=None, fixed=False):
+    """
+    设置模板字节码缓存目录，None 表示不使用磁盘缓存
+    :param fixed: 常驻调度进程启动时设置一次并固定，之后各小工具运行时的设置不再生效，
+                  避免并发运行的任务互相替换共用 Environment 的缓存
+    """
+    global BYTECODE_CACHE_FIXED
+    if BYTECODE_CACHE_FIXED and not fixed:
+        return
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    ENVIRONMENT.bytecode_cache = FileSystemBytecodeCache(cache_dir) if cache_dir else None
+    BYTECODE_CACHE_FIXED = BYTECODE_CACHE_FIXED or fixed
+
+
+def get_template(name, source):
+    """
+    获取已编译的模板，首次调用时注册源码并编译
+    :param name: 模板名称，例如 rds_slowlog
+    :param source: 模板源码
+    :return: jinja2.Template
+    """
+    TEMPLATE_SOURCES.setdefault(name, source)
+    return ENVIRONMENT.get_template(name)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+运行计划（--Plan）估算，供慢查询报告小工具（RDS / PolarDB）共用。
+只执行获取实例的步骤（或读取实例清单缓存），不获取慢查询：
+1. 抽样少量实例，每个请求只取一页，读取 TotalRecordCount 得到慢查询统计、慢日志明细的条数与单次调用耗时；
+2. 按本次运行的参数（RecordsMode / ShardHours / TopK / PerNode）估算每个实例的请求数与串行请求链长度，
+   按抽样的平均值外推到全部实例；
+3. 按运行方式（顺序 / 流水线 / AsyncEngine）、并发数和限速估算运行耗时。
+估算不包含限流重试，结果为下限。
+==========================================================================================
+"""
+# Build-in Modules
+import math
+from collections import Counter
+
+# Project Modules
+from aliyun_api_helper import run_concurrently, ApiError, MAX_WORKERS, PAGE_SIZE, ASYNC_CONCURRENCY, \
+    DEFAULT_RATE_LIMIT
+from aliyun_slowlog_helper import TOP_K
+
+# 默认抽样的实例数
+PLAN_SAMPLE = 5
+# 抽样请求的 PageSize（接口允许的最小值），只为读取 TotalRecordCount
+PLAN_PAGE_SIZE = 30
+# 没有抽样时假设的单次调用耗时（秒）
+PLAN_LATENCY = 0.3
+
+
+def get_pages(rows, page_size=PAGE_SIZE):
+    """
+    分页读取 rows 条记录的请求数，没有记录时也需要一次请求
+    """
+    return max(1, int(math.ceil(rows / float(page_size))))
+
+
+def get_sample(items, n=PLAN_SAMPLE):
+    """
+    等间隔抽取 n 个元素
+    """
+    if n <= 0 or not items:
+        return []
+    if n >= len(items):
+        return list(items)
+    step = len(items) / float(n)
+    return list(map(lambda x: items[int(x * step)], range(n)))
+
+
+def get_profiles(get_profile, samples, max_workers=MAX_WORKERS):
+    """
+    并发获取抽样实例的 profile，限流重试耗尽或返回错误码的实例不计入估算
+    :param get_profile: get_profile(ins_params) -> profile
+    :return: list
+    """
+    def sample(ins_params):
+        try:
+            return get_profile(ins_params)
+        except ApiError as e:
+            print('抽样失败，不计入估算: {}'.format(e))
+            return None
+    return list(filter(None, run_concurrently(sample, samples, max_workers)))
+
+
+def get_default_profile(db_count=1, top_k=TOP_K):
+    """
+    没有抽样时的假设：每个库的慢查询统计只有一页且至少 top_k 条，慢日志明细只有一页
+    """
+    return {"slow_logs": [top_k] * db_count, "records": 0, "nodes": 0}
+
+
+def get_latency(actions, names=("DescribeSlowLogs", "DescribeSlowLogRecords")):
+    """
+    抽样请求的平均耗时
+    :param actions: Metrics.to_dict()["actions"]
+    :return: float 没有抽样请求时返回 None
+    """
+    calls = sum(map(lambda x: actions[x]["calls"], filter(lambda x: x in actions, names)))
+    if not calls:
+        return None
+    return sum(map(lambda x: actions[x]["latency_sum"], filter(lambda x: x in actions, names))) / calls
+
+
+def estimate_instance(profile, records_mode, top_k=TOP_K, windows=1, max_workers=MAX_WORKERS, page_size=PAGE_SIZE):
+    """
+    估算单个实例的请求数
+    :param profile: {"slow_logs": [每个 DescribeSlowLogs 请求序列的记录数], "records": 慢日志明细条数,
+                     "nodes": 按节点采集时的节点数，0为不按节点}
+    :param records_mode: per_sql / batch / stats
+    :param windows: 慢日志明细按 ShardHours 切分的子窗口数
+    :return: tuple ({Action: 请求数}, 串行请求链长度)
+    """
+    calls = Counter()
+    calls["DescribeSlowLogs"] = sum(map(lambda x: get_pages(x, page_size), profile["slow_logs"]))
+    chain = calls["DescribeSlowLogs"]
+    nodes = profile.get("nodes", 0)
+    if nodes:
+        calls["DescribeDBClusterAttribute"] = 1
+        chain = chain + 1
+    if records_mode in ('batch', 'stats'):
+        # 每个节点、每个子窗口各自分页，记录按均匀分布估算
+        streams = windows * max(nodes, 1)
+        pages = get_pages(profile["records"] / float(streams), page_size)
+        calls["DescribeSlowLogRecords"] = streams * pages
+        parallel = min(windows, max_workers) * min(max(nodes, 1), max_workers)
+        chain = chain + pages * int(math.ceil(streams / float(parallel)))
+    else:
+        # 每条TOP SQL一次请求
+        calls["DescribeSlowLogRecords"] = min(top_k, sum(profile["slow_logs"]))
+        chain = chain + calls["DescribeSlowLogRecords"]
+    return calls, chain
+
+
+def estimate_seconds(calls, chains, instances, latency, engine, parallel=1, concurrency=ASYNC_CONCURRENCY,
+                     rate_limits=None, default_rate=DEFAULT_RATE_LIMIT):
+    """
+    估算获取慢查询的耗时
+    :param calls: 全部实例的 {Action: 请求数}
+    :param chains: 抽样实例的串行请求链长度
+    :param engine: sync 逐个实例 / pipeline 流水线（parallel 个实例同时获取）/ async AsyncEngine
+    :return: float 秒
+    """
+    if not instances or not chains:
+        return 0.0
+    mean_chain = sum(chains) / float(len(chains))
+    if engine != 'async':
+        return mean_chain * instances * latency / max(parallel, 1)
+    # AsyncEngine：受在途请求数、按 Action 限速和最长的单实例请求链三者约束
+    rate_limits = rate_limits or {}
+    seconds = max(sum(calls.values()) * latency / max(concurrency, 1), max(chains) * latency)
+    for action, count in calls.items():
+        rate = rate_limits.get(action, default_rate)
+        if rate and rate > 0:
+            seconds = max(seconds, count / float(rate))
+    return seconds
+
+
+def build_plan(instances, profiles, records_mode, engine, latency=None, top_k=TOP_K, windows=1,
+               max_workers=MAX_WORKERS, parallel=1, concurrency=ASYNC_CONCURRENCY, rate_limits=None,
+               default_rate=DEFAULT_RATE_LIMIT, default_profile=None, discovery=None):
+    """
+    :param instances: 本次运行的实例数
+    :param profiles: 抽样实例的 profile，为空时使用 default_profile
+    :param latency: 抽样得到的单次调用耗时，None 时使用 PLAN_LATENCY
+    :param discovery: 获取实例步骤的 {"seconds": 秒, "calls": {Action: 请求数}}
+    :return: dict
+    """
+    sampled = len(profiles)
+    profiles = profiles or [default_profile or get_default_profile(top_k=top_k)]
+    estimates = list(map(lambda x: estimate_instance(x, records_mode, top_k, windows, max_workers), profiles))
+    # 抽样实例的平均请求数外推到全部实例
+    sample_calls = Counter()
+    for instance_calls, _ in estimates:
+        sample_calls.update(instance_calls)
+    calls = Counter(dict(map(lambda x: (x[0], int(math.ceil(x[1] * instances / float(len(estimates))))),
+                             sample_calls.items())))
+    chains = list(map(lambda x: x[1], estimates))
+    latency = PLAN_LATENCY if latency is None else latency
+    seconds = estimate_seconds(calls, chains, instances, latency, engine, parallel, concurrency, rate_limits,
+                               default_rate)
+    return {
+        "instances": instances,
+        "sampled": sampled,
+        "engine": engine,
+        "records_mode": records_mode,
+        "shard_windows": windows,
+        "latency": round(latency, 4),
+        "discovery": discovery or {},
+        "actions": dict(map(lambda x: (x[0], {
+            "calls": x[1],
+            "calls_per_instance": round(sample_calls[x[0]] / float(len(estimates)), 2),
+        }), sorted(calls.items()))),
+        "calls": sum(calls.values()),
+        "seconds": round(seconds, 1),
+        # batch 找到所有TOP SQL的执行地址后即停止翻页，明细请求数为上限
+        "records_upper_bound": records_mode == 'batch',
+    }
+
+
+def print_plan(plan):
+    print('实例数: {instances}  抽样: {sampled}  运行方式: {engine}  单次调用耗时: {latency}s'.format(**plan))
+    if plan["discovery"]:
+        print('获取实例: {:.1f}s  {}'.format(plan["discovery"].get("seconds", 0), ', '.join(
+            map(lambda x: '{}={}'.format(*x), sorted(plan["discovery"].get("calls", {}).items())))))
+    for action, item in plan["actions"].items():
+        print('{:<28} 请求数: {:<8} 每个实例: {}'.format(action, item["calls"], item["calls_per_instance"]))
+    if plan["records_upper_bound"]:
+        print('RecordsMode batch 找到所有TOP SQL的执行地址后即停止翻页，DescribeSlowLogRecords 请求数为上限')
+    print('预计请求数: {}  预计耗时: {}s（不含限流重试）'.format(plan["calls"], plan["seconds"]))
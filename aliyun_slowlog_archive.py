@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+慢查询按列存储的历史归档，供慢查询报告小工具（RDS / PolarDB）共用。
+每次运行的慢查询统计（FleetAggregator 的汇总列）写入当天的归档文件 slowlog-YYYYMMDD.npz：
+1. 数值列为定长数组（执行次数、执行时长、最大执行时长）；
+2. 指纹、实例列为字典编码（编号数组 + 编号对应的值），同一天多次运行时按实例覆盖；
+3. 对比任意两天（周环比、月环比）、标记近期没有出现过的慢SQL，只需读取对应日期的文件。
+使用方法: python3 aliyun_slowlog_archive.py --ArchiveDir ./archive --BaseDays 7
+==========================================================================================
+"""
+# Build-in Modules
+import os
+import json
+import tempfile
+import datetime
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，只保证写入的原子性，不做跨进程加锁
+    fcntl = None
+
+# 3rd-part Modules
+import argparse
+import numpy as np
+
+# 归档文件名中的日期格式
+ARCHIVE_DAY_FORMAT = "%Y%m%d"
+# 标记新增慢SQL时回溯的天数
+LOOKBACK_DAYS = 7
+# 对比输出的条数
+COMPARE_TOP_N = 20
+
+# 数值列
+VALUE_COLUMNS = ("counts", "times", "max_times")
+
+
+def get_day(days=0):
+    return (datetime.datetime.now() + datetime.timedelta(days=days)).strftime(ARCHIVE_DAY_FORMAT)
+
+
+def shift_archive_day(day, days):
+    return (datetime.datetime.strptime(day, ARCHIVE_DAY_FORMAT) + datetime.timedelta(days=days)).strftime(
+        ARCHIVE_DAY_FORMAT)
+
+
+def group_by_fingerprint(columns):
+    """
+    按指纹汇总一天的数据
+    :return: dict {指纹: (总执行次数, 总执行时长)}
+    """
+    groups = len(columns["fingerprints"])
+    total_counts = np.bincount(columns["fingerprint"], weights=columns["counts"], minlength=groups)
+    total_times = np.bincount(columns["fingerprint"], weights=columns["times"], minlength=groups)
+    return dict(zip(columns["fingerprints"], zip(total_counts.tolist(), total_times.tolist())))
+
+
+class SlowLogArchive:
+    """
+    :param archive_dir: 归档目录，每天一个 slowlog-YYYYMMDD.npz 文件
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        os.makedirs(archive_dir, exist_ok=True)
+
+    def get_path(self, day):
+        return os.path.join(self.archive_dir, 'slowlog-{}.npz'.format(day))
+
+    @contextlib.contextmanager
+    def lock_day(self, day):
+        """
+        当天归档的文件锁（slowlog-YYYYMMDD.lock），共用 --ArchiveDir 的多个定时任务依次读取、合并、写入，
+        不会互相覆盖对方的实例
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.archive_dir, 'slowlog-{}.lock'.format(day)), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load_day(self, day):
+        """
+        :return: dict 与 FleetAggregator.get_columns() 相同的结构，没有归档时返回 None
+        """
+        path = self.get_path(day)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            columns = json.loads(data["dictionary"].tobytes().decode('utf-8'))
+            for key in ("fingerprint", "instance") + VALUE_COLUMNS:
+                columns[key] = data[key]
+        return columns
+
+    def save_day(self, day, columns):
+        """
+        写入一天的归档：本次运行包含的实例覆盖已有数据，其他实例的数据保留
+        :param columns: FleetAggregator.get_columns()
+        """
+        with self.lock_day(day):
+            old = self.load_day(day)
+            if old is not None:
+                columns = self.merge(old, columns)
+            dictionary = json.dumps({
+                "fingerprints": columns["fingerprints"],
+                "sql_texts": columns["sql_texts"],
+                "instance_ids": columns["instance_ids"],
+            }, ensure_ascii=False).encode('utf-8')
+            path = self.get_path(day)
+            # 先写本进程独有的临时文件再替换，运行中断时不会留下不完整的归档
+            fd, tmp_path = tempfile.mkstemp(prefix='slowlog-{}-'.format(day), suffix='.tmp', dir=self.archive_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez_compressed(
+                        f,
+                        dictionary=np.frombuffer(dictionary, dtype=np.uint8),
+                        fingerprint=columns["fingerprint"].astype(np.int32),
+                        instance=columns["instance"].astype(np.int32),
+                        counts=columns["counts"],
+                        times=columns["times"],
+                        max_times=columns["max_times"].astype(np.float32),
+                    )
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return path
+
+    @staticmethod
+    def merge(old, new):
+        """
+        合并同一天的两次运行：删除旧数据中本次运行包含的实例，旧编号映射到新的字典后拼接
+        """
+        merged = {
+            "fingerprints": list(new["fingerprints"]),
+            "sql_texts": list(new["sql_texts"]),
+            "instance_ids": list(new["instance_ids"]),
+        }
+        fingerprint_index = {x: i for i, x in enumerate(merged["fingerprints"])}
+        for fingerprint, sql_text in zip(old["fingerprints"], old["sql_texts"]):
+            if fingerprint not in fingerprint_index:
+                fingerprint_index[fingerprint] = len(merged["fingerprints"])
+                merged["fingerprints"].append(fingerprint)
+                merged["sql_texts"].append(sql_text)
+        instance_index = {x: i for i, x in enumerate(merged["instance_ids"])}
+        replaced = set(instance_index)
+        for instance_id in old["instance_ids"]:
+            if instance_id not in instance_index:
+                instance_index[instance_id] = len(merged["instance_ids"])
+                merged["instance_ids"].append(instance_id)
+
+        fingerprint_map = np.array([fingerprint_index[x] for x in old["fingerprints"]], dtype=np.int64)
+        instance_map = np.array([instance_index[x] for x in old["instance_ids"]], dtype=np.int64)
+        keep = ~np.isin(old["instance"], [i for i, x in enumerate(old["instance_ids"]) if x in replaced])
+        merged["fingerprint"] = np.concatenate((new["fingerprint"], fingerprint_map[old["fingerprint"][keep]]))
+        merged["instance"] = np.concatenate((new["instance"], instance_map[old["instance"][keep]]))
+        for key in VALUE_COLUMNS:
+            merged[key] = np.concatenate((new[key], old[key][keep]))
+        return merged
+
+    def get_seen(self, day, days=LOOKBACK_DAYS):
+        """
+        day 之前 days 天内出现过的 (实例, 指纹)
+        :return: tuple (set, 是否有历史归档)
+        """
+        seen, has_history = set(), False
+        for offset in range(1, days + 1):
+            columns = self.load_day(shift_archive_day(day, -offset))
+            if columns is None:
+                continue
+            has_history = True
+            pairs = np.unique(columns["instance"].astype(np.int64) * len(columns["fingerprints"])
+                              + columns["fingerprint"])
+            for pair in pairs.tolist():
+                instance, fingerprint = divmod(pair, len(columns["fingerprints"]))
+                seen.add((columns["instance_ids"][instance], columns["fingerprints"][fingerprint]))
+        return seen, has_history
+
+    def compare(self, day, base_day, n=COMPARE_TOP_N):
+        """
+        对比两天的慢SQL，按总执行时长的增量倒序，基准日没有的SQL标记为新增
+        :return: list
+        """
+        current, base = self.load_day(day), self.load_day(base_day)
+        if current is None:
+            return []
+        base_groups = group_by_fingerprint(base) if base is not None else {}
+        sql_texts = dict(zip(current["fingerprints"], current["sql_texts"]))
+        result = []
+        for fingerprint, (counts, times) in group_by_fingerprint(current).items():
+            base_counts, base_times = base_groups.get(fingerprint, (0, 0))
+            result.append({
+                "Fingerprint": fingerprint,
+                "SQLText": sql_texts[fingerprint],
+                "TotalExecutionCounts": int(counts),
+                "TotalExecutionTimes": times,
+                "BaseExecutionCounts": int(base_counts),
+                "BaseExecutionTimes": base_times,
+                "New": fingerprint not in base_groups,
+                "Growth": round(times / base_times, 2) if base_times else None,
+            })
+        result.sort(key=lambda x: x["TotalExecutionTimes"] - x["BaseExecutionTimes"], reverse=True)
+        return result[:n]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''慢查询归档对比小工具
+例如：周环比 --BaseDays 7，月环比 --BaseDays 30
+''', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument("--ArchiveDir", required=True, help='归档目录，与报告小工具的 --ArchiveDir 相同')
+    parser.add_argument("--Day", default=get_day(), help='对比日期 YYYYMMDD 默认为今天')
+    parser.add_argument("--BaseDays", type=int, default=LOOKBACK_DAYS, help='基准日期为对比日期之前的天数 默认为7')
+    parser.add_argument("--TopN", type=int, default=COMPARE_TOP_N, help='输出条数 默认为{}'.format(COMPARE_TOP_N))
+    args = parser.parse_args()
+    archive = SlowLogArchive(args.ArchiveDir)
+    print(json.dumps(archive.compare(args.Day, shift_archive_day(args.Day, -args.BaseDays), args.TopN),
+                     ensure_ascii=False, indent=2))
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+慢查询数据处理公共模块，供慢查询报告小工具（RDS / PolarDB）共用。
+1. build_host_index: 单次扫描慢日志明细，建立 SQLHASH -> HostAddress 索引；
+2. top_k: 流式读取慢查询统计，使用有界小顶堆保留排序最靠前的K条，内存占用 O(K)；
+3. async_get_top_sql: 通过 AsyncAliyunClient 获取单个实例的TOP SQL并回填执行地址；
+4. RecordStats: 扫描慢日志明细时，按 SQLHASH 流式计算执行时长、锁等待时长、扫描行数的分位数，
+   并按来源账号和地址（HostAddress）统计执行次数与总执行时长；
+5. scan_records: 慢日志明细的时间窗口可以按小时切分为子窗口，并发分页后按时间顺序合并；
+6. NodeSummary: PolarDB 按节点（DBNodeId）汇总慢查询统计，以及每条SQL在各节点的执行次数与总执行时长。
+==========================================================================================
+"""
+# Build-in Modules
+import heapq
+import asyncio
+import datetime
+
+# Project Modules
+from aliyun_api_helper import run_concurrently, iter_pages, PAGE_SIZE, MAX_WORKERS
+from aliyun_quantile_sketch import QuantileSketch
+
+# 默认保留的TOP SQL条数
+TOP_K = 10
+# 按库分别请求时，不同库的读取顺序间隔，保证排序值相同时先请求的库优先
+DB_SEQ_OFFSET = 10 ** 12
+# 慢日志明细中计算分位数的字段：执行时长、锁等待时长、扫描行数
+RECORD_METRICS = ("QueryTimes", "LockTimes", "ParseRowCounts")
+# 输出的分位数 p50 / p95 / p99
+QUANTILES = (0.5, 0.95, 0.99)
+# 每条SQL报告中列出的来源账号和地址条数
+HOST_TOP_N = 5
+# 每条SQL最多单独统计的来源账号和地址数，超出的合并为 OTHER_HOSTS
+HOST_LIMIT = 1000
+OTHER_HOSTS = '其他'
+# DescribeSlowLogRecords 的时间参数格式
+RECORDS_TIME_FORMAT = "%Y-%m-%dT%H:%MZ"
+
+
+def get_sql_hash(record):
+    """
+    获取慢日志记录的SQLHASH，RDS 与 PolarDB 接口返回的key大小写不一致
+    """
+    return record.get("SQLHASH") or record.get("SQLHash") or ""
+
+
+def build_host_index(records, sql_list, host_index=None, record_stats=None):
+    """
+    单次扫描慢日志明细，为 sql_list 中的每条SQL找到第一条明细的 HostAddress
+    :param records: 慢日志明细（可迭代，通常为 iter_pages 生成器）
+    :param sql_list: DescribeSlowLogs 返回的SQL列表
+    :param host_index: 逐页调用时传入上一页得到的索引
+    :param record_stats: RecordStats，传入时在同一次扫描中统计分位数
+    :return: dict {SQLHASH: HostAddress}
+    所有SQL都找到执行地址后立即停止读取，不再请求后续页；统计分位数时读取全部明细。
+    """
+    wanted = set(filter(None, map(get_sql_hash, sql_list)))
+    host_index = {} if host_index is None else host_index
+    if not wanted or (record_stats is None and len(host_index) == len(wanted)):
+        return host_index
+
+    for record in records:
+        sql_hash = get_sql_hash(record)
+        if sql_hash not in wanted:
+            continue
+        if record_stats is not None:
+            record_stats.add(sql_hash, record)
+        if sql_hash not in host_index:
+            host_index[sql_hash] = record.get("HostAddress", "")
+            if record_stats is None and len(host_index) == len(wanted):
+                break
+    return host_index
+
+
+def format_quantiles(values):
+    return ' / '.join(map(lambda x: '{:.3g}'.format(x), values)) if values else ''
+
+
+class RecordStats:
+    """
+    按 SQLHASH 统计慢日志明细：每条SQL每个字段一个 QuantileSketch，每个来源账号和地址一个计数，
+    只统计TOP SQL，内存占用与明细条数无关
+    """
+
+    def __init__(self, metrics=RECORD_METRICS, quantiles=QUANTILES):
+        self.metrics = metrics
+        self.quantiles = quantiles
+        self.sketches = {}
+        # {SQLHASH: {HostAddress: [执行次数, 总执行时长]}}
+        self.hosts = {}
+
+    def add(self, sql_hash, record):
+        sketches = self.sketches.get(sql_hash)
+        if sketches is None:
+            sketches = self.sketches[sql_hash] = {metric: QuantileSketch() for metric in self.metrics}
+        for metric in self.metrics:
+            if record.get(metric) not in (None, ''):
+                sketches[metric].add(to_number(record[metric]))
+        hosts = self.hosts.setdefault(sql_hash, {})
+        host_address = record.get("HostAddress", "")
+        if host_address not in hosts and len(hosts) >= HOST_LIMIT:
+            host_address = OTHER_HOSTS
+        host = hosts.setdefault(host_address, [0, 0])
+        host[0] = host[0] + 1
+        host[1] = host[1] + to_number(record.get("QueryTimes"))
+
+    def get(self, sql_hash):
+        """
+        :return: dict {字段: [p50, p95, p99]}，没有明细的字段为 []
+        """
+        sketches = self.sketches.get(sql_hash, {})
+        return {metric: [sketches[metric].quantile(q) for q in self.quantiles]
+                if metric in sketches and sketches[metric].count else [] for metric in self.metrics}
+
+    def get_totals(self, sql_hash):
+        """
+        :return: tuple (明细条数, 总执行时长)
+        """
+        hosts = self.hosts.get(sql_hash, {}).values()
+        return sum(map(lambda x: x[0], hosts)), round(sum(map(lambda x: x[1], hosts)), 3)
+
+    def get_hosts(self, sql_hash, n=HOST_TOP_N):
+        """
+        按总执行时长、执行次数倒序的来源账号和地址
+        :return: list [{'HostAddress': '', 'Count': 0, 'QueryTimes': 0}, ...]
+        """
+        hosts = sorted(self.hosts.get(sql_hash, {}).items(), key=lambda x: (x[1][1], x[1][0]), reverse=True)
+        return list(map(lambda x: {"HostAddress": x[0], "Count": x[1][0], "QueryTimes": round(x[1][1], 3)},
+                        hosts[:n]))
+
+    def merge(self, other):
+        """
+        合并另一个子窗口的统计
+        """
+        for sql_hash, other_sketches in other.sketches.items():
+            sketches = self.sketches.setdefault(sql_hash, {metric: QuantileSketch() for metric in self.metrics})
+            for metric, sketch in other_sketches.items():
+                sketches[metric].merge(sketch)
+        for sql_hash, other_hosts in other.hosts.items():
+            hosts = self.hosts.setdefault(sql_hash, {})
+            for host_address, (count, query_times) in other_hosts.items():
+                if host_address not in hosts and len(hosts) >= HOST_LIMIT:
+                    host_address = OTHER_HOSTS
+                host = hosts.setdefault(host_address, [0, 0])
+                host[0] = host[0] + count
+                host[1] = host[1] + query_times
+
+    def apply(self, sql_list):
+        """
+        统计结果回填到每条SQL，例如 sql['QueryTimesQuantiles'] = '1 / 5 / 9'，
+        sql['HostHistogram'] 为来源账号和地址的分布，HostAddress 改为总执行时长最多的来源
+        """
+        for _sql in sql_list:
+            sql_hash = get_sql_hash(_sql)
+            for metric, values in self.get(sql_hash).items():
+                _sql['{}Quantiles'.format(metric)] = format_quantiles(values)
+            _sql['HostHistogram'] = self.get_hosts(sql_hash)
+            if _sql['HostHistogram']:
+                _sql['HostAddress'] = _sql['HostHistogram'][0]['HostAddress']
+
+
+def to_number(value):
+    """
+    排序字段转为数值，缺失或无法转换时按0处理
+    """
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class TopK:
+    """
+    有界小顶堆，按 sort_keys 保留排序值最大的K条记录
+    """
+
+    def __init__(self, k=TOP_K, sort_keys=()):
+        self.k = k
+        self.sort_keys = tuple(sort_keys)
+        self.heap = []
+        self.seq = 0
+
+    def push(self, item, seq=None):
+        """
+        :param seq: 记录的读取顺序，排序值相同时顺序靠前的优先；并发翻页时按页码传入
+        """
+        if seq is None:
+            seq = self.seq
+            self.seq = self.seq + 1
+        if self.k <= 0:
+            return
+        entry = (tuple(to_number(item.get(key)) for key in self.sort_keys), -seq, item)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif entry[:2] > self.heap[0][:2]:
+            heapq.heapreplace(self.heap, entry)
+
+    def result(self):
+        return [entry[2] for entry in sorted(self.heap, key=lambda x: x[:2], reverse=True)]
+
+
+def top_k(items, k=TOP_K, sort_keys=()):
+    """
+    按 sort_keys 倒序获取前K条记录
+    :param items: 可迭代对象，通常为逐页读取的生成器
+    :param k: 保留条数
+    :param sort_keys: 排序字段，例如 ('MySQLTotalExecutionCounts', 'MaxExecutionTime')
+    :return: list 排序后的前K条，排序值相同时保持读取顺序
+    """
+    heap = TopK(k, sort_keys)
+    for item in items:
+        heap.push(item)
+    return heap.result()
+
+
+def split_window(start_time, end_time, hours, time_format=RECORDS_TIME_FORMAT):
+    """
+    把时间窗口按 hours 小时切分为首尾相接的子窗口
+    :return: list [(StartTime, EndTime), ...] 按时间顺序，hours 小于等于0时为原窗口
+    """
+    start = datetime.datetime.strptime(start_time, time_format)
+    end = datetime.datetime.strptime(end_time, time_format)
+    if hours <= 0 or start >= end:
+        return [(start_time, end_time)]
+    windows = []
+    while start < end:
+        stop = min(start + datetime.timedelta(hours=hours), end)
+        windows.append((start.strftime(time_format), stop.strftime(time_format)))
+        start = stop
+    return windows
+
+
+def new_shard_stats(record_stats):
+    return None if record_stats is None else RecordStats(record_stats.metrics, record_stats.quantiles)
+
+
+def merge_record_scans(scans, record_stats=None):
+    """
+    按时间顺序合并各子窗口的结果：执行地址取最早的子窗口，统计值累加到 record_stats
+    :param scans: [(host_index, shard_stats), ...]
+    :return: dict {SQLHASH: HostAddress}
+    """
+    host_index = {}
+    for shard_index, shard_stats in scans:
+        for sql_hash, host_address in shard_index.items():
+            host_index.setdefault(sql_hash, host_address)
+        if record_stats is not None:
+            record_stats.merge(shard_stats)
+    return host_index
+
+
+def scan_records(fetch_page, params, sql_list, record_stats=None, shard_hours=0, max_workers=MAX_WORKERS):
+    """
+    分页扫描慢日志明细，建立 SQLHASH -> HostAddress 索引，传入 record_stats 时同时统计
+    :param fetch_page: fetch_page(page_num, **params) 返回一页 DescribeSlowLogRecords 的结果
+    :param params: 实例ID与时间窗口（StartTime / EndTime）参数
+    :param shard_hours: 大于0时时间窗口按小时切分，各子窗口并发分页（max_workers 个同时进行），
+                        繁忙实例不再受限于一条很长的翻页链
+    :return: dict {SQLHASH: HostAddress}
+    """
+    def scan(window_params, shard_stats):
+        return build_host_index(iter_pages(lambda page_num: fetch_page(page_num, **window_params),
+                                           ("Items", "SQLSlowRecord")), sql_list, record_stats=shard_stats)
+
+    def scan_window(window):
+        shard_stats = new_shard_stats(record_stats)
+        return scan(dict(params, StartTime=window[0], EndTime=window[1]), shard_stats), shard_stats
+
+    if shard_hours <= 0:
+        return scan(params, record_stats)
+    windows = split_window(params["StartTime"], params["EndTime"], shard_hours)
+    return merge_record_scans(run_concurrently(scan_window, windows, max_workers), record_stats)
+
+
+def get_node_breakdown(node_ids, node_stats_list, sql_hash):
+    """
+    每个节点的明细中该SQL的执行次数与总执行时长，按总执行时长倒序
+    :param node_ids: 节点ID列表
+    :param node_stats_list: 与 node_ids 顺序一致的 RecordStats
+    :return: list [{'DBNodeId': '', 'Count': 0, 'QueryTimes': 0}, ...] 不包含没有执行过的节点
+    """
+    breakdown = []
+    for node_id, node_stats in zip(node_ids, node_stats_list):
+        count, query_times = node_stats.get_totals(sql_hash)
+        if count:
+            breakdown.append({"DBNodeId": node_id, "Count": count, "QueryTimes": query_times})
+    return sorted(breakdown, key=lambda x: (x["QueryTimes"], x["Count"]), reverse=True)
+
+
+def parse_db_nodes(cluster_attribute):
+    """
+    DescribeDBClusterAttribute 返回的集群节点
+    :return: dict {DBNodeId: DBNodeRole}，主节点在前
+    """
+    db_nodes = cluster_attribute.get("DBNodes") or []
+    if isinstance(db_nodes, dict):
+        db_nodes = db_nodes.get("DBNode") or []
+    db_nodes = sorted(db_nodes, key=lambda x: x.get("DBNodeRole") != "Writer")
+    return dict(map(lambda x: (x["DBNodeId"], x.get("DBNodeRole", "")), filter(lambda x: x.get("DBNodeId"),
+                                                                                db_nodes)))
+
+
+class NodeSummary:
+    """
+    PolarDB 按节点汇总 DescribeSlowLogs 的统计：透传读取（生成器），每行按 DBNodeId 累加，不增加请求；
+    DescribeSlowLogs 每个节点各返回一行，同一 SQLHASH 的各行即该SQL在各节点的执行次数与总执行时长
+    """
+
+    def __init__(self, count_keys=("TotalExecutionCounts",), time_keys=("TotalExecutionTimes",)):
+        self.count_keys = count_keys
+        self.time_keys = time_keys
+        # {DBNodeId: [SQL条数, 总执行次数, 总执行时长]}
+        self.nodes = {}
+        # {SQLHASH: {DBNodeId: [总执行次数, 总执行时长]}}
+        self.sql_nodes = {}
+
+    def add(self, row):
+        node_id = row.get("DBNodeId") or ''
+        counts = sum(map(lambda x: to_number(row.get(x)), self.count_keys))
+        times = sum(map(lambda x: to_number(row.get(x)), self.time_keys))
+        node = self.nodes.setdefault(node_id, [0, 0, 0])
+        node[0] = node[0] + 1
+        node[1] = node[1] + counts
+        node[2] = node[2] + times
+        sql_hash = get_sql_hash(row)
+        if sql_hash:
+            sql_node = self.sql_nodes.setdefault(sql_hash, {}).setdefault(node_id, [0, 0])
+            sql_node[0] = sql_node[0] + counts
+            sql_node[1] = sql_node[1] + times
+
+    def tap(self, rows):
+        for row in rows:
+            self.add(row)
+            yield row
+
+    def get_breakdown(self, sql_hash):
+        """
+        :return: list 与 get_node_breakdown 相同，按总执行时长倒序
+        """
+        return sorted(map(lambda x: {"DBNodeId": x[0], "Count": x[1][0], "QueryTimes": round(x[1][1], 3)},
+                          self.sql_nodes.get(sql_hash, {}).items()),
+                      key=lambda x: (x["QueryTimes"], x["Count"]), reverse=True)
+
+    def apply(self, sql_list):
+        """
+        没有按明细统计节点分布（NodeBreakdown）的SQL，使用 DescribeSlowLogs 各节点的行回填
+        """
+        for _sql in sql_list:
+            if not _sql.get('NodeBreakdown'):
+                _sql['NodeBreakdown'] = self.get_breakdown(get_sql_hash(_sql))
+
+    def result(self, roles=None):
+        """
+        :param roles: {DBNodeId: DBNodeRole}，没有慢查询的节点也会列出
+        :return: list 按总执行时长倒序
+        """
+        roles = roles or {}
+        nodes = dict(map(lambda x: (x, [0, 0, 0]), roles))
+        nodes.update(self.nodes)
+        return sorted(map(lambda x: {
+            "DBNodeId": x[0],
+            "DBNodeRole": roles.get(x[0], ''),
+            "SQLCount": x[1][0],
+            "TotalExecutionCounts": x[1][1],
+            "TotalExecutionTimes": x[1][2],
+        }, nodes.items()), key=lambda x: (x["TotalExecutionTimes"], x["TotalExecutionCounts"]), reverse=True)
+
+
+async def async_get_top_sql(engine, product, slow_log_params, records_params, k=TOP_K, sort_keys=(),
+                            records_mode='per_sql', db_names=None, shard_hours=0, node_ids=None, node_summary=None):
+    """
+    asyncio 获取单个实例的TOP SQL，并回填每条SQL的 HostAddress
+    :param engine: AsyncAliyunClient
+    :param product: rds / polardb
+    :param slow_log_params: DescribeSlowLogs 参数
+    :param records_params: DescribeSlowLogRecords 的实例ID与时间窗口参数（不含SQLHASH）
+    :param records_mode: per_sql 每条SQL并发请求一次明细；batch 逐页扫描一次明细建立索引；
+                         stats 扫描全部明细，建立索引的同时计算分位数
+    :param db_names: 指定时按库分别请求 DescribeSlowLogs（DBName 参数只支持单个库）
+    :param shard_hours: 大于0时慢日志明细按小时切分子窗口并发分页
+    :param node_ids: PolarDB 按节点采集时的节点ID列表，慢日志明细按节点（NodeId 参数）并发分页
+    :param node_summary: NodeSummary，读取 DescribeSlowLogs 时按节点汇总，并回填每条SQL的 NodeBreakdown
+    :return: list
+    """
+    heap = TopK(k, sort_keys)
+
+    def push_page(offset):
+        def push(page_num, page_items):
+            for index, item in enumerate(page_items):
+                if node_summary is not None:
+                    node_summary.add(item)
+                heap.push(item, offset + (page_num - 1) * PAGE_SIZE + index)
+        return push
+
+    db_params = list(map(lambda x: {"DBName": x}, db_names)) if db_names else [{}]
+    await asyncio.gather(*map(
+        lambda x: engine.for_each_page(product, ("Items", "SQLSlowLog"), push_page(x[0] * DB_SEQ_OFFSET), PAGE_SIZE,
+                                       Action="DescribeSlowLogs", **dict(slow_log_params, **x[1])),
+        enumerate(db_params)))
+    sql_list = heap.result()
+
+    if records_mode in ('batch', 'stats'):
+        record_stats = RecordStats() if records_mode == 'stats' else None
+
+        async def scan(window_params, shard_stats):
+            shard_index = {}
+            async for page_items in engine.iter_pages(product, ("Items", "SQLSlowRecord"), PAGE_SIZE,
+                                                      Action="DescribeSlowLogRecords", **window_params):
+                build_host_index(page_items, sql_list, shard_index, shard_stats)
+                if shard_stats is None and len(shard_index) >= len(set(filter(None, map(get_sql_hash, sql_list)))):
+                    break
+            return shard_index, shard_stats
+
+        async def scan_node(node_params):
+            # 各子窗口并发分页，按时间顺序合并
+            node_stats = new_shard_stats(record_stats)
+            return merge_record_scans(await asyncio.gather(*map(
+                lambda x: scan(dict(records_params, StartTime=x[0], EndTime=x[1], **node_params),
+                               new_shard_stats(node_stats)), windows)), node_stats), node_stats
+
+        if node_ids:
+            windows = split_window(records_params["StartTime"], records_params["EndTime"], shard_hours)
+            scans = await asyncio.gather(*map(lambda x: scan_node({"NodeId": x}), node_ids))
+            host_index = merge_record_scans(scans, record_stats)
+            if record_stats is not None:
+                for _sql in sql_list:
+                    _sql['NodeBreakdown'] = get_node_breakdown(node_ids, map(lambda x: x[1], scans),
+                                                               get_sql_hash(_sql))
+        elif shard_hours > 0:
+            windows = split_window(records_params["StartTime"], records_params["EndTime"], shard_hours)
+            host_index = merge_record_scans(await asyncio.gather(*map(
+                lambda x: scan(dict(records_params, StartTime=x[0], EndTime=x[1]), new_shard_stats(record_stats)),
+                windows)), record_stats)
+        else:
+            host_index, _ = await scan(records_params, record_stats)
+        for _sql in sql_list:
+            _sql['HostAddress'] = host_index.get(get_sql_hash(_sql), '')
+        if record_stats is not None:
+            record_stats.apply(sql_list)
+    else:
+        hash_responses = await asyncio.gather(*map(
+            lambda x: engine.call(product, Action="DescribeSlowLogRecords", SQLHASH=get_sql_hash(x),
+                                  **records_params), sql_list))
+        for _sql, hash_response in zip(sql_list, hash_responses):
+            records = hash_response.get('Items', {}).get('SQLSlowRecord', [])
+            _sql['HostAddress'] = records[0]["HostAddress"] if records else ''
+    if node_summary is not None:
+        node_summary.apply(sql_list)
+    return sql_list
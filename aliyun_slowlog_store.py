@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+慢查询增量采集的本地 SQLite 状态库，供慢查询报告小工具（RDS / PolarDB）共用。
+DescribeSlowLogs 返回按天（CreateTime）汇总的统计数据，因此：
+1. 每个实例（及库过滤条件）记录一个水位：最后一个已完整采集的日期；
+2. 每次运行只请求水位之后的日期（当天的数据尚未完整，每次运行都会重新请求并覆盖）；
+3. 报告窗口内的数据从本地库读取，--FromStore 时完全不请求慢查询接口。
+==========================================================================================
+"""
+# Build-in Modules
+import json
+import sqlite3
+import hashlib
+import datetime
+import threading
+
+# 日期格式，与 DescribeSlowLogs 的 StartTime / EndTime 一致
+DAY_FORMAT = "%Y-%m-%dZ"
+
+
+def get_sql_key(row):
+    """
+    慢查询的唯一标识：优先使用SQLHASH，没有时使用SQLText的摘要
+    """
+    sql_hash = row.get("SQLHASH") or row.get("SQLHash")
+    if sql_hash:
+        return sql_hash
+    return hashlib.sha1((row.get("SQLText") or "").encode('utf-8')).hexdigest()
+
+
+def get_create_day(row, default_day):
+    """
+    慢查询统计所属日期，例如 2020-10-24Z
+    """
+    create_time = row.get("CreateTime")
+    return '{}Z'.format(create_time[:10]) if create_time else default_day
+
+
+def shift_day(day, days):
+    return (datetime.datetime.strptime(day, DAY_FORMAT) + datetime.timedelta(days=days)).strftime(DAY_FORMAT)
+
+
+class SlowLogStore:
+    """
+    慢查询状态库
+    watermark: 每个实例（及库过滤条件）最后一个已完整采集的日期
+    slow_log: 按 实例 + 日期 + 库 + SQL 保存的每日统计
+    sql_host: 已解析的 SQL 执行地址，--FromStore 时使用
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS watermark (
+                scope TEXT PRIMARY KEY,
+                last_day TEXT NOT NULL)""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS slow_log (
+                instance_id TEXT NOT NULL,
+                create_day TEXT NOT NULL,
+                db_name TEXT NOT NULL,
+                sql_key TEXT NOT NULL,
+                row TEXT NOT NULL,
+                PRIMARY KEY (instance_id, create_day, db_name, sql_key))""")
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS sql_host (
+                instance_id TEXT NOT NULL,
+                sql_key TEXT NOT NULL,
+                host_address TEXT NOT NULL,
+                PRIMARY KEY (instance_id, sql_key))""")
+
+    @staticmethod
+    def get_scope(instance_id, db_names=None):
+        return '{}|{}'.format(instance_id, ','.join(sorted(db_names or [])))
+
+    def get_fetch_start(self, instance_id, start_day, db_names=None):
+        """
+        :return: 本次需要请求的开始日期，不早于 start_day，已完整采集的日期不再请求
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT last_day FROM watermark WHERE scope = ?",
+                                    (self.get_scope(instance_id, db_names),)).fetchone()
+        if not row:
+            return start_day
+        return max(start_day, shift_day(row[0], 1))
+
+    def save_slow_logs(self, instance_id, rows, start_day, end_day, db_names=None, progress=None):
+        """
+        用 [start_day, end_day] 的最新数据覆盖本地库中同一范围的数据，并推进水位到昨天
+        :param rows: DescribeSlowLogs 返回的慢查询统计（可迭代）
+        :param progress: iter_pages 的 progress，rows 读取结束后 complete 不为 True 时不写入
+        :return: bool 是否已写入
+        """
+        records = []
+        for row in rows:
+            records.append((instance_id, get_create_day(row, end_day), row.get("DBName") or "", get_sql_key(row),
+                            json.dumps(row, ensure_ascii=False)))
+        if progress is not None and not progress.get("complete"):
+            # 翻页中途失败，只取到部分数据，保留本地数据与水位，下次运行重新请求
+            return False
+        if progress is None and not records:
+            # 没有数据时可能是接口调用失败，保留本地数据与水位，下次运行重新请求
+            return False
+        yesterday = shift_day(datetime.datetime.now().strftime(DAY_FORMAT), -1)
+        scope = self.get_scope(instance_id, db_names)
+        with self.lock, self.conn:
+            delete_sql = "DELETE FROM slow_log WHERE instance_id = ? AND create_day >= ? AND create_day <= ?"
+            delete_params = [instance_id, start_day, end_day]
+            if db_names:
+                delete_sql = delete_sql + " AND db_name IN ({})".format(','.join('?' * len(db_names)))
+                delete_params = delete_params + list(db_names)
+            self.conn.execute(delete_sql, delete_params)
+            self.conn.executemany("INSERT OR REPLACE INTO slow_log VALUES (?, ?, ?, ?, ?)", records)
+            last_day = min(end_day, yesterday)
+            if last_day >= start_day:
+                self.conn.execute("""INSERT INTO watermark VALUES (?, ?)
+                    ON CONFLICT(scope) DO UPDATE SET last_day = MAX(last_day, excluded.last_day)""",
+                                  (scope, last_day))
+        return True
+
+    def iter_slow_logs(self, instance_id, start_day, end_day, db_names=None):
+        """
+        读取报告窗口内的每日慢查询统计，与直接请求 DescribeSlowLogs 的返回一致
+        :return: generator
+        """
+        query = "SELECT row FROM slow_log WHERE instance_id = ? AND create_day >= ? AND create_day <= ?"
+        params = [instance_id, start_day, end_day]
+        if db_names:
+            query = query + " AND db_name IN ({})".format(','.join('?' * len(db_names)))
+            params = params + list(db_names)
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY create_day, rowid", params).fetchall()
+        for row in rows:
+            yield json.loads(row[0])
+
+    def save_hosts(self, instance_id, sql_list):
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO sql_host VALUES (?, ?, ?)", [
+                (instance_id, get_sql_key(x), x['HostAddress']) for x in sql_list if x.get('HostAddress')])
+
+    def get_hosts(self, instance_id):
+        """
+        :return: dict {sql_key: HostAddress}
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT sql_key, host_address FROM sql_host WHERE instance_id = ?",
+                                     (instance_id,)).fetchall()
+        return dict(rows)
+
+    def close(self):
+        self.conn.close()
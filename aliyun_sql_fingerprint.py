@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+SQL 归一化与指纹，供慢查询报告小工具（RDS / PolarDB）共用。
+只有常量不同的 SQLText 归一化后相同，跨实例、跨日期可以按指纹合并：
+1. 字符串、数字常量替换为 ?，注释去除，连续空白合并，关键字转为大写；
+2. IN (?, ?, ...) 合并为 IN (?)，VALUES (...), (...) 合并为一组；
+3. FingerprintCache: 按原始文本的摘要做 LRU 缓存，同一条语句不重复解析。
+==========================================================================================
+"""
+# Build-in Modules
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 3rd-part Modules
+from sqlparse import lexer, tokens
+
+# 默认缓存的语句条数
+CACHE_SIZE = 100000
+
+# 记号之间统一使用一个空格，再去掉 , ) . 之前和 ( . 之后的空格
+SPACE_BEFORE_RE = re.compile(r' ([,).])')
+SPACE_AFTER_RE = re.compile(r'([(.]) ')
+IN_LIST_RE = re.compile(r'\bIN \(\?(?:, \?)*\)')
+VALUES_RE = re.compile(r'\bVALUES (\([^()]*\))(?:, \([^()]*\))+')
+
+
+def normalize_sql(sql_text):
+    """
+    归一化SQL文本，不使用缓存
+    :return: str
+    """
+    parts = []
+    for ttype, value in lexer.tokenize(sql_text or ''):
+        if ttype in tokens.Comment or ttype in tokens.Whitespace or ttype in tokens.Newline:
+            continue
+        if ttype in tokens.String.Single or ttype in tokens.Number:
+            value = '?'
+        elif ttype in tokens.Keyword or (ttype in tokens.Operator and value.isalpha()):
+            value = value.upper()
+        parts.append(value)
+    while parts and parts[-1] == ';':
+        parts.pop()
+    text = SPACE_AFTER_RE.sub(r'\1', SPACE_BEFORE_RE.sub(r'\1', ' '.join(parts)))
+    text = IN_LIST_RE.sub('IN (?)', text)
+    return VALUES_RE.sub(r'VALUES \1', text)
+
+
+def fingerprint_sql(normalized):
+    return hashlib.md5(normalized.encode('utf-8')).hexdigest()
+
+
+class FingerprintCache:
+    """
+    SQL 指纹的 LRU 缓存，键为原始文本的摘要（不保存长SQL原文作为键）
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sql_text):
+        """
+        :return: tuple (指纹, 归一化后的SQL)
+        """
+        key = hashlib.md5((sql_text or '').encode('utf-8')).digest()
+        with self.lock:
+            value = self.cache.get(key)
+            if value is not None:
+                self.cache.move_to_end(key)
+                self.hits = self.hits + 1
+                return value
+        normalized = normalize_sql(sql_text)
+        value = (fingerprint_sql(normalized), normalized)
+        with self.lock:
+            self.misses = self.misses + 1
+            self.cache[key] = value
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return value
+
+
+# 进程内共用的缓存
+DEFAULT_CACHE = FingerprintCache()
+
+
+def get_fingerprint(sql_text, cache=DEFAULT_CACHE):
+    """
+    :return: str SQL 指纹
+    """
+    return cache.get(sql_text)[0]
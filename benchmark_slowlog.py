@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+慢查询报告小工具（RDS / PolarDB）端到端基准测试，不需要阿里云访问凭证。
+使用 FakeAliyunClient 模拟 10 / 100 / 1000 个实例，完整执行 Custom.start_up
+（实例发现 -> 慢查询统计 -> 执行地址 -> 生成HTML报告），输出每种运行方式的耗时与各接口调用次数。
+例如：
+python3 benchmark_slowlog.py --Product rds --Sizes 10,100,1000 --Latency 0.005
+python3 benchmark_slowlog.py --Product polardb --Modes sync_batch,async_batch --ThrottleRate 0.05
+python3 benchmark_slowlog.py --ReplayFile recorded.jsonl --Sizes 10
+==========================================================================================
+"""
+# Build-in Modules
+import io
+import os
+import time
+import shutil
+import tempfile
+import contextlib
+
+# 3rd-part Modules
+import argparse
+
+# Project Modules
+from aliyun_api_helper import AliyunApiCaller, AIMDLimiter, MAX_IN_FLIGHT, RETRY_TRIES
+from aliyun_fake_client import FakeAliyunClient, REGIONS, SQL_PER_INSTANCE, RECORDS_PER_INSTANCE
+import aliyun_get_rds_slowlog
+import aliyun_get_polardb_slowlog
+
+# 运行方式：是否使用 asyncio 调用层，执行地址的获取方式
+MODES = {
+    'sync': {'async_engine': False, 'records_mode': 'per_sql'},
+    'sync_batch': {'async_engine': False, 'records_mode': 'batch'},
+    'async': {'async_engine': True, 'records_mode': 'per_sql'},
+    'async_batch': {'async_engine': True, 'records_mode': 'batch'},
+}
+
+
+def get_start_up_kwargs(product, out_dir):
+    """
+    与命令行 --Region all --DBInstanceId/--DBClusterId all 一致的 start_up 参数
+    """
+    kwargs = {
+        'common_region_ids': None,
+        'db_engines': ['MySQL'],
+        'filter_instance': False,
+        'out_dir': out_dir,
+        'region': 'all',
+        'cache_ttl': 0,
+    }
+    if product == 'polardb':
+        kwargs.update({'DBClusterIds': ['all'], 'DBName': None})
+    else:
+        kwargs.update({'DBInstanceIds': ['all'], 'DBNames': []})
+    return kwargs
+
+
+def run_once(product, size, mode, **kwargs):
+    """
+    :return: dict 耗时、报告数量、接口调用次数
+    """
+    module = aliyun_get_polardb_slowlog if product == 'polardb' else aliyun_get_rds_slowlog
+    fake = FakeAliyunClient(size, latency=kwargs['latency'], throttle_rate=kwargs['throttle_rate'],
+                            sql_per_instance=kwargs['sql_per_instance'],
+                            records_per_instance=kwargs['records_per_instance'], replay_file=kwargs['replay_file'])
+    api = module.Custom()
+    # 与 get_config 一致，只是把 AliyunClient 替换为模拟客户端
+    api.out = {}
+    api.aliyun = AliyunApiCaller(fake, kwargs['retry_tries'], delay=kwargs['retry_delay'],
+                                 limiter=AIMDLimiter(max_limit=kwargs['max_in_flight']))
+
+    out_dir = tempfile.mkdtemp(prefix='dbreport_benchmark_')
+    try:
+        start_up_kwargs = get_start_up_kwargs(product, out_dir)
+        start_up_kwargs.update(MODES[mode])
+        start_up_kwargs['default_rate'] = kwargs['default_rate']
+        begin = time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            api.start_up(**start_up_kwargs)
+        elapsed = time.time() - begin
+        reports = len(os.listdir(out_dir))
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    return {
+        'elapsed': elapsed,
+        'reports': reports,
+        'calls': sum(fake.calls.values()),
+        'throttled': sum(fake.throttled.values()),
+        'slow_logs': fake.calls['DescribeSlowLogs'],
+        'records': fake.calls['DescribeSlowLogRecords'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='慢查询报告小工具端到端基准测试（模拟阿里云API）')
+    parser.add_argument("--Product", default='rds', choices=['rds', 'polardb'], help='默认为 rds')
+    parser.add_argument("--Sizes", default='10,100,1000', help='模拟的实例数量，多个用逗号分隔 默认为 10,100,1000')
+    parser.add_argument("--Modes", default=','.join(MODES),
+                        help='运行方式，多个用逗号分隔 默认为 {}'.format(','.join(MODES)))
+    parser.add_argument("--Latency", type=float, default=0.005, help='每次API调用的模拟延迟（秒） 默认为0.005')
+    parser.add_argument("--ThrottleRate", type=float, default=0.0, help='返回限流错误码的比例 0~1 默认为0')
+    parser.add_argument("--SqlPerInstance", type=int, default=SQL_PER_INSTANCE,
+                        help='每个实例的慢SQL条数 默认为{}'.format(SQL_PER_INSTANCE))
+    parser.add_argument("--RecordsPerInstance", type=int, default=RECORDS_PER_INSTANCE,
+                        help='每个实例的慢日志明细条数 默认为{}'.format(RECORDS_PER_INSTANCE))
+    parser.add_argument("--ReplayFile", help='RecordingAliyunClient 录制的 jsonl 文件，命中时优先回放')
+    parser.add_argument("--RetryTries", type=int, default=RETRY_TRIES,
+                        help='限流与临时错误的最大尝试次数 默认为{}'.format(RETRY_TRIES))
+    parser.add_argument("--RetryDelay", type=float, default=0.01,
+                        help='首次退避秒数 默认为0.01，模拟环境下缩短等待')
+    parser.add_argument("--MaxInFlight", type=int, default=MAX_IN_FLIGHT,
+                        help='同时在途的API请求上限 默认为{}'.format(MAX_IN_FLIGHT))
+    parser.add_argument("--DefaultRateLimit", type=float, default=0,
+                        help='AsyncEngine 每个 Action 每秒请求数 默认为0 即不限速')
+    args = parser.parse_args()
+
+    print('product={} regions={} latency={}s throttle_rate={}'.format(args.Product, len(REGIONS), args.Latency,
+                                                                      args.ThrottleRate))
+    print('{:>6} {:<12} {:>10} {:>8} {:>8} {:>10} {:>10} {:>10}'.format(
+        'size', 'mode', 'seconds', 'reports', 'calls', 'throttled', 'slow_logs', 'records'))
+    for size in map(int, args.Sizes.split(',')):
+        for mode in args.Modes.split(','):
+            result = run_once(args.Product, size, mode, latency=args.Latency, throttle_rate=args.ThrottleRate,
+                              sql_per_instance=args.SqlPerInstance, records_per_instance=args.RecordsPerInstance,
+                              replay_file=args.ReplayFile, retry_tries=args.RetryTries, retry_delay=args.RetryDelay,
+                              max_in_flight=args.MaxInFlight, default_rate=args.DefaultRateLimit)
+            print('{:>6} {:<12} {:>10.3f} {:>8} {:>8} {:>10} {:>10} {:>10}'.format(
+                size, mode, result['elapsed'], result['reports'], result['calls'], result['throttled'],
+                result['slow_logs'], result['records']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+==========================================================================================
+SQL 指纹基准测试：测量 normalize_sql（每条都解析）与 FingerprintCache（按原始文本缓存）的吞吐。
+模拟慢日志中的 SQLText：少量语句模板，常量不同的原始文本在各实例、各日期重复出现。
+例如：
+python3 benchmark_sql_fingerprint.py --Statements 200000 --Distinct 5000
+==========================================================================================
+"""
+# Build-in Modules
+import time
+import random
+
+# 3rd-part Modules
+import argparse
+
+# Project Modules
+from aliyun_sql_fingerprint import normalize_sql, FingerprintCache, CACHE_SIZE
+
+# 慢SQL模板，{n} 为数字常量，{s} 为字符串常量，{in_list} 为 IN 列表
+SQL_TEMPLATES = [
+    "select * from t_order where user_id = {n} and status = '{s}' order by id desc limit {n}",
+    "SELECT o.id, o.amount FROM t_order o JOIN t_user u ON o.user_id = u.id WHERE u.id IN ({in_list})",
+    "update t_account set balance = balance - {n} where id = {n} and version = {n}",
+    "insert into t_log (uid, action, created) values ({n}, '{s}', now()), ({n}, '{s}', now())",
+    "select count(*) from t_event where created > '2020-10-{n}' and type = '{s}' /* report */",
+    "delete from t_session where expired < {n}",
+]
+
+
+def make_statement(rng):
+    template = rng.choice(SQL_TEMPLATES)
+    return template.format(n=rng.randint(1, 100000), s='v{}'.format(rng.randint(1, 1000)),
+                           in_list=', '.join(map(str, rng.sample(range(100000), rng.randint(1, 50)))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQL 指纹基准测试')
+    parser.add_argument("--Statements", type=int, default=100000, help='处理的SQLText条数 默认为100000')
+    parser.add_argument("--Distinct", type=int, default=5000, help='不同原始文本的条数 默认为5000')
+    parser.add_argument("--CacheSize", type=int, default=CACHE_SIZE,
+                        help='FingerprintCache 缓存条数 默认为{}'.format(CACHE_SIZE))
+    parser.add_argument("--Seed", type=int, default=0, help='随机数种子 默认为0')
+    args = parser.parse_args()
+
+    rng = random.Random(args.Seed)
+    pool = [make_statement(rng) for _ in range(args.Distinct)]
+    statements = [rng.choice(pool) for _ in range(args.Statements)]
+
+    begin = time.time()
+    for sql_text in pool:
+        normalize_sql(sql_text)
+    elapsed = time.time() - begin
+    print('normalize_sql     {:>10} statements {:>8.3f}s {:>10.0f}/s'.format(len(pool), elapsed,
+                                                                              len(pool) / elapsed))
+
+    cache = FingerprintCache(args.CacheSize)
+    begin = time.time()
+    fingerprints = set(cache.get(sql_text)[0] for sql_text in statements)
+    elapsed = time.time() - begin
+    print('FingerprintCache  {:>10} statements {:>8.3f}s {:>10.0f}/s hits={} misses={}'.format(
+        len(statements), elapsed, len(statements) / elapsed, cache.hits, cache.misses))
+    print('distinct raw texts={} fingerprints={}'.format(len(set(pool)), len(fingerprints)))
+
+
+if __name__ == '__main__':
+    main()
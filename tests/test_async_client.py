@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+AsyncAliyunClient：限流重试的每次尝试都获取令牌，重试耗尽后抛出 RetryableApiError
+"""
+# Build-in Modules
+import os
+import sys
+import asyncio
+import unittest
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project Modules
+from aliyun_api_helper import AsyncAliyunClient, AliyunApiCaller, RetryableApiError, TokenBucket
+from aliyun_fake_client import FakeAliyunClient
+from aliyun_metrics import Metrics
+
+
+class CountingBucket(TokenBucket):
+    """
+    记录每个 Action 获取令牌的次数
+    """
+
+    def __init__(self, action, counter, rate):
+        super(CountingBucket, self).__init__(rate)
+        self.action = action
+        self.counter = counter
+
+    async def acquire(self):
+        self.counter[self.action] = self.counter[self.action] + 1
+        await super(CountingBucket, self).acquire()
+
+
+class CountingClient(AsyncAliyunClient):
+    def __init__(self, *args, **kwargs):
+        super(CountingClient, self).__init__(*args, **kwargs)
+        self.tokens = Counter()
+
+    def get_bucket(self, action):
+        if action not in self.buckets:
+            self.buckets[action] = CountingBucket(action, self.tokens, self.default_rate)
+        return self.buckets[action]
+
+
+def run(fake, tries, calls, metrics=None):
+    """
+    :return: tuple (令牌获取次数 Counter, 每次调用的结果或异常)
+    """
+    async def main():
+        engine = CountingClient(AliyunApiCaller(fake, tries, delay=0, metrics=metrics), default_rate=0)
+        try:
+            results = await asyncio.gather(*map(
+                lambda x: engine.call('rds', Action="DescribeDBInstanceAttribute", DBInstanceId='rm-fake-00000'),
+                range(calls)), return_exceptions=True)
+        finally:
+            engine.close()
+        return engine.tokens, results
+
+    return asyncio.run(main())
+
+
+class AsyncAliyunClientTest(unittest.TestCase):
+
+    def test_token_per_attempt(self):
+        fake = FakeAliyunClient(1, throttle_rate=0.5, seed=3)
+        tokens, results = run(fake, 50, 40)
+        self.assertTrue(all(map(lambda x: isinstance(x, dict), results)))
+        self.assertGreater(fake.throttled["DescribeDBInstanceAttribute"], 0)
+        # 每次尝试（包括被限流的）都获取一次令牌
+        self.assertEqual(tokens["DescribeDBInstanceAttribute"], fake.calls["DescribeDBInstanceAttribute"])
+        self.assertEqual(tokens["DescribeDBInstanceAttribute"],
+                         40 + fake.throttled["DescribeDBInstanceAttribute"])
+
+    def test_exhausted(self):
+        fake = FakeAliyunClient(1, throttle_rate=1)
+        metrics = Metrics('test')
+        tokens, results = run(fake, 3, 2, metrics)
+        self.assertTrue(all(map(lambda x: isinstance(x, RetryableApiError) and x.throttled, results)))
+        self.assertEqual(tokens["DescribeDBInstanceAttribute"], 6)
+        self.assertEqual(fake.calls["DescribeDBInstanceAttribute"], 6)
+        self.assertEqual(metrics.exhausted["DescribeDBInstanceAttribute"], 2)
+
+    def test_rate_limit_covers_retries(self):
+        # 每秒10个令牌、容量10：10次调用各重试一次共20次尝试，多出的10次按令牌补充速度等待
+        fake = FakeAliyunClient(1, throttle_rate=1)
+
+        async def main():
+            engine = AsyncAliyunClient(AliyunApiCaller(fake, 2, delay=0), default_rate=10)
+            started = asyncio.get_event_loop().time()
+            try:
+                await asyncio.gather(*map(
+                    lambda x: engine.call('rds', Action="DescribeDBInstanceAttribute", DBInstanceId='rm-fake-00000'),
+                    range(10)), return_exceptions=True)
+            finally:
+                engine.close()
+            return asyncio.get_event_loop().time() - started
+
+        self.assertGreaterEqual(asyncio.run(main()), 0.8)
+        self.assertEqual(fake.calls["DescribeDBInstanceAttribute"], 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+慢查询报告小工具（RDS / PolarDB）：通过 main() 使用模拟的阿里云API完整运行，检查报告中的慢SQL
+"""
+# Build-in Modules
+import io
+import os
+import sys
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project Modules
+import aliyun_get_rds_slowlog
+import aliyun_get_polardb_slowlog
+from aliyun_api_helper import AliyunApiCaller
+from aliyun_fake_client import FakeAliyunClient
+from aliyun_slowlog_helper import TOP_K
+
+INSTANCES = 3
+# (模块, 实例参数, 产品, 实例ID前缀)
+TOOLS = (
+    (aliyun_get_rds_slowlog, '--DBInstanceId', 'rds', 'rm'),
+    (aliyun_get_polardb_slowlog, '--DBClusterId', 'polardb', 'pc'),
+)
+
+
+class ForbiddenClient(FakeAliyunClient):
+    """
+    第一个实例的 DescribeSlowLogs 返回不可重试的错误码（没有权限）
+    """
+
+    def common(self, product, timeout=10, **params):
+        if params.get("Action") == "DescribeSlowLogs" and \
+                (params.get("DBInstanceId") or params.get("DBClusterId")) in ('rm-fake-00000', 'pc-fake-00000'):
+            return 403, {"Code": "Forbidden.RAM", "Message": "User not authorized to operate on the specified resource.",
+                         "RequestId": "fake"}
+        return super(ForbiddenClient, self).common(product, timeout, **params)
+
+
+def get_expected_rows(fake, module, product, instance_id, stats=False):
+    """
+    不经过报告小工具，直接按模拟数据计算的TOP SQL与执行地址：
+    第一条慢日志明细的地址，stats 时为总执行时长最多的地址
+    :return: list [(SQLHASH, HostAddress), ...]
+    """
+    sort_keys = module.SORT_KEYS
+    sql_list = sorted(fake.get_sql_list(product, instance_id),
+                      key=lambda x: tuple(x.get(key) or 0 for key in sort_keys), reverse=True)[:TOP_K]
+    # {SQLHASH: {HostAddress: [总执行时长, 执行次数]}}，按明细顺序插入
+    hosts = {}
+    for _, record in fake.get_records(product, instance_id):
+        host = hosts.setdefault(record["SQLHASH"], {}).setdefault(record["HostAddress"], [0, 0])
+        host[0] = host[0] + record["QueryTimes"]
+        host[1] = host[1] + 1
+
+    def get_host(sql_hash):
+        items = list(hosts.get(sql_hash, {}).items())
+        if not items:
+            return ''
+        if stats:
+            return sorted(items, key=lambda x: tuple(x[1]), reverse=True)[0][0]
+        return items[0][0]
+    return list(map(lambda x: (x["SQLHASH"], get_host(x["SQLHASH"])), sql_list))
+
+
+class FakeClientPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_main(self, module, id_flag, fake, extra_args=(), tries=1):
+        """
+        :return: tuple ({实例ID: [(SQLHASH, HostAddress), ...]}, 标准输出)
+        """
+        api = module.Custom()
+        api.out = {}
+        api.aliyun = AliyunApiCaller(fake, tries, delay=0, metrics=api.metrics)
+        argv = [id_flag, 'all', '--OutDir', self.tmpdir.name, '--CacheDir', self.tmpdir.name] + list(extra_args)
+        reports = {}
+        # 完整的报告数据 {实例ID: render_data}
+        self.render_data = {}
+
+        def maker(report, out_dir):
+            reports[report.render_data[id_flag[2:]]] = list(map(
+                lambda x: (x["SQLHASH"], x["HostAddress"]), report.render_data["sql_list"]))
+            self.render_data[report.render_data[id_flag[2:]]] = report.render_data
+
+        out = io.StringIO()
+        with mock.patch.object(module.GetReport, 'maker', maker), contextlib.redirect_stdout(out):
+            module.main(argv, api)
+        return reports, out.getvalue()
+
+    def assert_rows(self, fake, module, product, prefix, reports, instances=range(INSTANCES), stats=False):
+        self.assertEqual(sorted(reports), list(map(lambda x: '{}-fake-{:05d}'.format(prefix, x), instances)))
+        for instance_id, rows in reports.items():
+            self.assertEqual(len(rows), TOP_K)
+            self.assertEqual(rows, get_expected_rows(fake, module, product, instance_id, stats))
+
+    def test_records_modes(self):
+        for module, id_flag, product, prefix in TOOLS:
+            for extra_args in ([], ['--RecordsMode', 'batch'], ['--RecordsMode', 'stats'], ['--AsyncEngine']):
+                with self.subTest(product=product, args=extra_args):
+                    fake = FakeAliyunClient(INSTANCES)
+                    reports, _ = self.run_main(module, id_flag, fake, extra_args)
+                    self.assert_rows(fake, module, product, prefix, reports, stats='stats' in extra_args)
+
+    def test_throttling_is_retried(self):
+        for module, id_flag, product, prefix in TOOLS:
+            with self.subTest(product=product):
+                fake = FakeAliyunClient(INSTANCES, throttle_rate=0.3, seed=1)
+                reports, _ = self.run_main(module, id_flag, fake, tries=20)
+                self.assertGreater(sum(fake.throttled.values()), 0)
+                self.assert_rows(fake, module, product, prefix, reports)
+
+    def test_non_retryable_error(self):
+        for module, id_flag, product, prefix in TOOLS:
+            for extra_args in ([], ['--AsyncEngine']):
+                with self.subTest(product=product, args=extra_args):
+                    fake = ForbiddenClient(INSTANCES)
+                    reports, output = self.run_main(module, id_flag, fake, extra_args)
+                    self.assertIn('{}-fake-00000 获取慢查询失败: DescribeSlowLogs Forbidden.RAM'.format(prefix), output)
+                    # 出错的实例不生成报告，其余实例不受影响
+                    self.assert_rows(fake, module, product, prefix, reports, range(1, INSTANCES))
+
+    def test_per_node(self):
+        # 按节点采集：同步与 AsyncEngine 的结果一致；per_sql 的节点分布来自 DescribeSlowLogs 各节点的行
+        for records_mode in ('per_sql', 'batch', 'stats'):
+            render_data = []
+            for extra_args in ([], ['--AsyncEngine']):
+                with self.subTest(records_mode=records_mode, args=extra_args):
+                    fake = FakeAliyunClient(INSTANCES)
+                    reports, output = self.run_main(aliyun_get_polardb_slowlog, '--DBClusterId', fake,
+                                                    ['--PerNode', '--RecordsMode', records_mode] + extra_args)
+                    self.assertNotIn('失败', output)
+                    self.assert_rows(fake, aliyun_get_polardb_slowlog, 'polardb', 'pc', reports,
+                                     stats=records_mode == 'stats')
+                    # 每个节点各扫描一次明细
+                    if records_mode != 'per_sql':
+                        self.assertGreaterEqual(fake.calls["DescribeSlowLogRecords"], INSTANCES * 2)
+                    for instance_id, data in self.render_data.items():
+                        self.assertEqual(sorted(map(lambda x: x["DBNodeId"], data["nodes"])),
+                                         list(map(lambda x: 'pi-{}-{}'.format(instance_id, x), (0, 1))))
+                        for _sql in data["sql_list"]:
+                            self.assertTrue(_sql["NodeBreakdown"])
+                            if records_mode != 'stats':
+                                self.assertEqual(_sql["NodeBreakdown"], [{
+                                    "DBNodeId": _sql["DBNodeId"], "Count": _sql["TotalExecutionCounts"],
+                                    "QueryTimes": _sql["TotalExecutionTimes"]}])
+                    render_data.append(self.render_data)
+            self.assertEqual(render_data[0], render_data[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
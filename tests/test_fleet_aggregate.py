@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+全局慢SQL汇总：FleetAggregator.top_n 与逐行用 dict 汇总的结果一致
+"""
+# Build-in Modules
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project Modules
+from aliyun_fleet_aggregate import FleetAggregator, get_number
+from aliyun_sql_fingerprint import FingerprintCache, normalize_sql
+
+COUNT_KEYS = ('MySQLTotalExecutionCounts',)
+TIME_KEYS = ('MySQLTotalExecutionTimes',)
+
+
+def get_rows(instances, rows_per_instance, seed=0):
+    """
+    {实例ID: [慢查询统计, ...]}，只有常量不同的SQL归一化后相同；执行次数取值范围小，排序值相同的较多
+    """
+    rng = random.Random(seed)
+    data = {}
+    for instance in range(instances):
+        rows = []
+        for _ in range(rows_per_instance):
+            table = rng.randint(0, 7)
+            rows.append({
+                "SQLText": "select * from t_{} where id = {}".format(table, rng.randint(1, 1000)),
+                "MySQLTotalExecutionCounts": rng.choice([1, 2, 3, '4', None]),
+                "MySQLTotalExecutionTimes": rng.randint(0, 5),
+                "MaxExecutionTime": rng.randint(0, 60),
+            })
+        data['rm-{}'.format(instance)] = rows
+    return data
+
+
+def get_expected(data, n):
+    """
+    逐行用 dict 按归一化后的SQL汇总，排序值相同时按首次出现的顺序
+    """
+    groups = {}
+    for instance_id, rows in data.items():
+        for row in rows:
+            group = groups.setdefault(normalize_sql(row["SQLText"]), {
+                "TotalExecutionCounts": 0, "TotalExecutionTimes": 0.0, "MaxExecutionTime": 0.0, "instances": set()})
+            group["TotalExecutionCounts"] = group["TotalExecutionCounts"] + get_number(row, COUNT_KEYS)
+            group["TotalExecutionTimes"] = group["TotalExecutionTimes"] + get_number(row, TIME_KEYS)
+            group["MaxExecutionTime"] = max(group["MaxExecutionTime"], get_number(row, ("MaxExecutionTime",)))
+            group["instances"].add(instance_id)
+    top = sorted(groups.items(), key=lambda x: (x[1]["TotalExecutionCounts"], x[1]["TotalExecutionTimes"]),
+                 reverse=True)[:n]
+    return list(map(lambda x: {
+        "SQLText": x[0],
+        "TotalExecutionCounts": int(x[1]["TotalExecutionCounts"]),
+        "TotalExecutionTimes": x[1]["TotalExecutionTimes"],
+        "MaxExecutionTime": x[1]["MaxExecutionTime"],
+        "InstanceCount": len(x[1]["instances"]),
+    }, top))
+
+
+def aggregate(data):
+    aggregator = FleetAggregator(COUNT_KEYS, TIME_KEYS, cache=FingerprintCache())
+    for instance_id, rows in data.items():
+        # tap 是透传的生成器，需要读完
+        list(aggregator.tap(instance_id, rows))
+    return aggregator
+
+
+class FleetAggregatorTest(unittest.TestCase):
+
+    def test_top_n_matches_dict(self):
+        for seed in range(5):
+            data = get_rows(6, 40, seed)
+            aggregator = aggregate(data)
+            for n in (1, 3, 8, 50):
+                with self.subTest(seed=seed, n=n):
+                    self.assertEqual(aggregator.top_n(n), get_expected(data, n))
+
+    def test_empty(self):
+        self.assertEqual(aggregate({}).top_n(), [])
+        # 实例没有慢查询
+        self.assertEqual(aggregate({'rm-0': []}).top_n(), [])
+
+    def test_single_instance(self):
+        data = get_rows(1, 30)
+        top = aggregate(data).top_n()
+        self.assertEqual(top, get_expected(data, 50))
+        self.assertTrue(all(map(lambda x: x["InstanceCount"] == 1, top)))
+
+    def test_single_row(self):
+        data = {'rm-0': [{"SQLText": "select 1", "MySQLTotalExecutionCounts": '7',
+                          "MySQLTotalExecutionTimes": 2.5, "MaxExecutionTime": 3}]}
+        self.assertEqual(aggregate(data).top_n(), [{
+            "SQLText": "SELECT ?", "TotalExecutionCounts": 7, "TotalExecutionTimes": 2.5,
+            "MaxExecutionTime": 3.0, "InstanceCount": 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
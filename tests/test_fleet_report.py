@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+慢查询汇总报告：明细中的来源地址分布、分位数、节点分布与新增慢SQL标记
+"""
+# Build-in Modules
+import io
+import os
+import re
+import sys
+import json
+import tempfile
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project Modules
+import aliyun_get_rds_slowlog
+import aliyun_get_polardb_slowlog
+from aliyun_api_helper import AliyunApiCaller
+from aliyun_fake_client import FakeAliyunClient
+from aliyun_fleet_report import FleetReport
+
+COLUMNS = [
+    ('节点ID', ('NodeBreakdown', 'DBNodeId')),
+    ('执行用户和地址', ('HostHistogram', 'HostAddress')),
+    ('执行时长 p50/p95/p99', ('QueryTimesQuantiles',)),
+    ('新增', ('NewSlowSQL',)),
+    ('慢查询', ('SQLText',)),
+]
+
+
+def load_payload(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    return json.loads(re.search(r'<script type="application/json" id="fleet-data">(.*?)</script>', text,
+                                re.S).group(1).replace('<\\/', '</'))
+
+
+class FleetReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make(self, result, columns=COLUMNS):
+        report = FleetReport('汇总报告', 'DBClusterId', columns, ('TotalExecutionCounts',))
+        return load_payload(os.path.join(self.tmpdir.name, report.maker(result, self.tmpdir.name)))
+
+    def test_stats_columns(self):
+        payload = self.make([{"DBClusterId": 'pc-1', "sql_list": [{
+            "DBNodeId": 'pi-1',
+            "NodeBreakdown": [{"DBNodeId": 'pi-1', "Count": 3, "QueryTimes": 4.5},
+                              {"DBNodeId": 'pi-2', "Count": 1, "QueryTimes": 1}],
+            "HostAddress": 'app[app] @  [10.0.0.1]',
+            "HostHistogram": [{"HostAddress": 'app[app] @  [10.0.0.1]', "Count": 4, "QueryTimes": 5.5}],
+            "QueryTimesQuantiles": '1 / 2 / 3',
+            "NewSlowSQL": True,
+            "SQLText": 'select 1',
+        }, {
+            "DBNodeId": 'pi-2', "NodeBreakdown": [], "HostAddress": 'b', "HostHistogram": [],
+            "QueryTimesQuantiles": '', "NewSlowSQL": False, "SQLText": 'select 2',
+        }]}, {}])
+        self.assertEqual(payload["columns"], list(map(lambda x: x[0], COLUMNS)))
+        self.assertEqual(payload["rows"], [[
+            ['pi-1 3次 4.5秒\npi-2 1次 1秒', 'app[app] @  [10.0.0.1] 4次 5.5秒', '1 / 2 / 3', '新增', 'select 1'],
+            # 没有分布时显示节点、执行地址
+            ['pi-2', 'b', None, '', 'select 2'],
+        ]])
+
+    def test_missing_columns_dropped(self):
+        # 未使用 stats、未写入归档时没有分位数与新增标记，不输出这些列
+        payload = self.make([{"DBClusterId": 'pc-1', "sql_list": [
+            {"DBNodeId": 'pi-1', "HostAddress": 'a', "SQLText": 'select 1'}]}])
+        self.assertEqual(payload["columns"], ['节点ID', '执行用户和地址', '慢查询'])
+        self.assertEqual(payload["rows"], [[['pi-1', 'a', 'select 1']]])
+
+    def test_consolidated_main(self):
+        for module, id_flag, extra_args in ((aliyun_get_rds_slowlog, '--DBInstanceId', []),
+                                            (aliyun_get_polardb_slowlog, '--DBClusterId', ['--PerNode'])):
+            with self.subTest(module=module.__name__):
+                out_dir = tempfile.mkdtemp(dir=self.tmpdir.name)
+                api = module.Custom()
+                api.out = {}
+                api.aliyun = AliyunApiCaller(FakeAliyunClient(2), 1, metrics=api.metrics)
+                argv = [id_flag, 'all', '--OutDir', out_dir, '--CacheDir', out_dir, '--RecordsMode', 'stats',
+                        '--Consolidated', '--ArchiveDir', os.path.join(out_dir, 'archive')] + extra_args
+                with contextlib.redirect_stdout(io.StringIO()):
+                    module.main(argv, api)
+                file_name = list(filter(lambda x: x.startswith('report-fleet-'), os.listdir(out_dir)))[0]
+                payload = load_payload(os.path.join(out_dir, file_name))
+                self.assertIn('执行时长 p50/p95/p99', payload["columns"])
+                # 第一次归档没有历史数据，不标记新增
+                self.assertNotIn('新增', payload["columns"])
+                host_column = payload["columns"].index('执行用户和地址')
+                self.assertEqual(len(payload["rows"]), 2)
+                for rows in payload["rows"]:
+                    self.assertTrue(all(map(lambda x: re.search(r'\d+次 [\d.]+秒', x[host_column]), rows)))
+                if module is aliyun_get_polardb_slowlog:
+                    node_column = payload["columns"].index('节点ID')
+                    self.assertTrue(all(map(lambda x: re.search(r'pi-\S+ \d+次', x[node_column]),
+                                            payload["rows"][0])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+流式分位数估计：与 numpy.quantile 的相对误差不超过 relative_accuracy，桶数有上限，可以合并
+"""
+# Build-in Modules
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 3rd-part Modules
+import numpy as np
+
+# Project Modules
+from aliyun_quantile_sketch import QuantileSketch, RELATIVE_ACCURACY
+
+QUANTILES = (0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 0.999, 1)
+
+
+def get_samples(seed=0, size=20000):
+    rng = np.random.default_rng(seed)
+    return {
+        "lognormal": rng.lognormal(0, 2, size),
+        "uniform": rng.uniform(0.001, 1000, size),
+        "exponential": rng.exponential(5, size),
+        # 锁等待时长等字段大部分为0
+        "zeros": np.where(rng.random(size) < 0.6, 0, rng.integers(1, 100, size)).astype(float),
+        "integers": rng.integers(1, 60, size).astype(float),
+    }
+
+
+def build(values, **kwargs):
+    sketch = QuantileSketch(**kwargs)
+    for value in values.tolist():
+        sketch.add(value)
+    return sketch
+
+
+class QuantileSketchTest(unittest.TestCase):
+
+    def assert_accurate(self, sketch, values, quantiles=QUANTILES, alpha=RELATIVE_ACCURACY):
+        for q in quantiles:
+            # quantile 取排序后第 floor(q * (n - 1)) 个值的估计
+            expected = float(np.quantile(values, q, method='lower'))
+            self.assertLessEqual(abs(sketch.quantile(q) - expected), alpha * abs(expected) + 1e-9,
+                                 'q={} expected={}'.format(q, expected))
+
+    def test_accuracy(self):
+        for name, values in get_samples().items():
+            with self.subTest(distribution=name):
+                sketch = build(values)
+                self.assertEqual(sketch.count, len(values))
+                self.assert_accurate(sketch, values)
+
+    def test_relative_accuracy(self):
+        values = get_samples(1)["lognormal"]
+        for alpha in (0.05, 0.001):
+            with self.subTest(alpha=alpha):
+                # 相对误差越小桶越多，不限制桶数
+                self.assert_accurate(build(values, relative_accuracy=alpha, max_buckets=100000), values,
+                                     alpha=alpha)
+
+    def test_merge(self):
+        for name, values in get_samples(2).items():
+            with self.subTest(distribution=name):
+                sketch = QuantileSketch()
+                for part in np.array_split(values, 7):
+                    sketch.merge(build(part))
+                self.assertEqual(sketch.count, len(values))
+                self.assert_accurate(sketch, values)
+
+    def test_collapse(self):
+        # 跨越很多个数量级，桶数超过上限：最低的桶被合并，较高的分位数不受影响
+        values = np.random.default_rng(3).lognormal(0, 6, 20000)
+        sketch = build(values, max_buckets=1000)
+        self.assertEqual(len(sketch.buckets), 1000)
+        self.assertEqual(sketch.indexes, sorted(sketch.buckets))
+        self.assertEqual(sum(sketch.buckets.values()) + sketch.zero_count, len(values))
+        self.assert_accurate(sketch, values, (0.9, 0.95, 0.99, 1))
+
+    def test_collapse_merge(self):
+        values = np.random.default_rng(4).lognormal(0, 6, 20000)
+        sketch = QuantileSketch(max_buckets=1000)
+        for part in np.array_split(values, 5):
+            sketch.merge(build(part, max_buckets=1000))
+        self.assertEqual(len(sketch.buckets), 1000)
+        self.assertEqual(sketch.indexes, sorted(sketch.buckets))
+        self.assertEqual(sum(sketch.buckets.values()), len(values))
+        self.assert_accurate(sketch, values, (0.9, 0.95, 0.99, 1))
+
+    def test_empty(self):
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+报告调度进程：cron 字段解析与下一次触发时间
+"""
+# Build-in Modules
+import os
+import sys
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project Modules
+from aliyun_report_scheduler import CronSchedule, parse_cron_field
+
+
+def t(text):
+    return datetime.datetime.strptime(text, '%Y-%m-%d %H:%M:%S' if text.count(':') == 2 else '%Y-%m-%d %H:%M')
+
+
+# (字段, 最小值, 最大值, 取值)
+FIELD_CASES = (
+    ('*', 0, 5, {0, 1, 2, 3, 4, 5}),
+    ('3', 0, 59, {3}),
+    ('1-4', 0, 59, {1, 2, 3, 4}),
+    ('1,5,9', 0, 59, {1, 5, 9}),
+    ('*/15', 0, 59, {0, 15, 30, 45}),
+    ('5/20', 0, 59, {5, 25, 45}),
+    ('9-17/4', 0, 23, {9, 13, 17}),
+    ('1-3,10-20/5,30', 1, 31, {1, 2, 3, 10, 15, 20, 30}),
+    ('*/2', 1, 12, {1, 3, 5, 7, 9, 11}),
+)
+
+INVALID_FIELDS = (
+    ('60', 0, 59), ('0', 1, 31), ('5-1', 0, 59), ('*/0', 0, 59), ('1-40', 1, 31), ('a', 0, 59), ('', 0, 59),
+)
+
+# (表达式, 当前时间, 下一次触发时间)；2026-03-13 为周五
+NEXT_TIME_CASES = (
+    # 分、时
+    ('0 8 * * *', '2026-03-10 07:59:30', '2026-03-10 08:00'),
+    ('0 8 * * *', '2026-03-10 08:00:00', '2026-03-11 08:00'),
+    ('0 8 * * *', '2026-03-10 08:00:59', '2026-03-11 08:00'),
+    ('*/15 * * * *', '2026-03-10 10:07', '2026-03-10 10:15'),
+    ('*/15 * * * *', '2026-03-10 10:45', '2026-03-10 11:00'),
+    ('5/20 * * * *', '2026-03-10 10:46', '2026-03-10 11:05'),
+    ('0 9-17/4 * * *', '2026-03-10 13:00', '2026-03-10 17:00'),
+    ('0 9-17/4 * * *', '2026-03-10 17:00', '2026-03-11 09:00'),
+    ('0,30 8,20 * * *', '2026-03-10 08:30', '2026-03-10 20:00'),
+    ('59 23 * * *', '2026-03-10 23:59', '2026-03-11 23:59'),
+    # 周
+    ('0 8 * * 1-5', '2026-03-13 09:00', '2026-03-16 08:00'),
+    ('0 8 * * 0', '2026-03-13 09:00', '2026-03-15 08:00'),
+    ('0 8 * * 7', '2026-03-13 09:00', '2026-03-15 08:00'),
+    ('0 8 * * 6,0', '2026-03-13 09:00', '2026-03-14 08:00'),
+    # 日和周都有限制时满足其一即可
+    ('0 8 18 * 5', '2026-03-13 09:00', '2026-03-18 08:00'),
+    ('0 8 18 * 5', '2026-03-18 09:00', '2026-03-20 08:00'),
+    ('0 8 1-7 * 1', '2026-03-10 09:00', '2026-03-16 08:00'),
+    # 以 * 开头的字段不算限制：单日的周一
+    ('0 8 */2 * 1', '2026-03-10 09:00', '2026-03-23 08:00'),
+    # */7 为周日：13日且为周日
+    ('0 8 13 * */7', '2026-03-13 09:00', '2026-09-13 08:00'),
+    # 跨月、跨年
+    ('0 0 1 * *', '2026-01-31 23:59', '2026-02-01 00:00'),
+    ('0 0 1 * *', '2026-12-31 23:59:59', '2027-01-01 00:00'),
+    ('0 0 31 * *', '2026-01-31 00:00', '2026-03-31 00:00'),
+    ('0 0 31 * *', '2026-03-31 00:00', '2026-05-31 00:00'),
+    ('0 12 * 2,6 *', '2026-02-28 12:00', '2026-06-01 12:00'),
+    ('30 6 1 1 *', '2026-01-01 06:30', '2027-01-01 06:30'),
+    ('0 0 29 2 *', '2026-03-01 00:00', '2028-02-29 00:00'),
+)
+
+
+class CronTest(unittest.TestCase):
+
+    def test_parse_field(self):
+        for field, low, high, expected in FIELD_CASES:
+            with self.subTest(field=field):
+                self.assertEqual(parse_cron_field(field, low, high), expected)
+
+    def test_invalid_field(self):
+        for field, low, high in INVALID_FIELDS:
+            with self.subTest(field=field):
+                with self.assertRaises(ValueError):
+                    parse_cron_field(field, low, high)
+
+    def test_invalid_expression(self):
+        for expression in ('* * * *', '* * * * * *', '0 24 * * *', '0 0 * 13 *', '0 0 * * 8'):
+            with self.subTest(expression=expression):
+                with self.assertRaises(ValueError):
+                    CronSchedule(expression)
+
+    def test_next_time(self):
+        for expression, after, expected in NEXT_TIME_CASES:
+            with self.subTest(expression=expression, after=after):
+                self.assertEqual(CronSchedule(expression).next_time(t(after)), t(expected))
+
+    def test_never(self):
+        with self.assertRaises(ValueError):
+            CronSchedule('0 0 31 2 *').next_time(t('2026-01-01 00:00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+慢查询报告小工具：翻页中途限流重试耗尽时，实例标记为获取失败并打印实例ID，不生成截断的报告
+"""
+# Build-in Modules
+import io
+import os
+import sys
+import tempfile
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project Modules
+import aliyun_get_rds_slowlog
+import aliyun_get_polardb_slowlog
+from aliyun_api_helper import AliyunApiCaller
+from aliyun_fake_client import FakeAliyunClient
+
+
+class PageThrottlingClient(FakeAliyunClient):
+    """
+    第一个实例的 DescribeSlowLogs 第2页一直返回限流错误码
+    """
+
+    def common(self, product, timeout=10, **params):
+        if params.get("Action") == "DescribeSlowLogs" and int(params.get("PageNumber") or 1) == 2 and \
+                (params.get("DBInstanceId") or params.get("DBClusterId")) in ('rm-fake-00000', 'pc-fake-00000'):
+            return 400, {"Code": "Throttling.User", "Message": "Request was denied due to user flow control.",
+                         "RequestId": "fake"}
+        return super(PageThrottlingClient, self).common(product, timeout, **params)
+
+
+class RegionThrottlingClient(FakeAliyunClient):
+    """
+    cn-shanghai 的 DescribeDBInstances / DescribeDBClusters 与第一个实例的详情接口一直返回限流错误码
+    """
+
+    def common(self, product, timeout=10, **params):
+        if (params.get("Action") in ("DescribeDBInstances", "DescribeDBClusters") and
+                params.get("RegionId") == 'cn-shanghai') or \
+                (params.get("Action") in ("DescribeDBInstanceAttribute", "DescribeDBClusterAttribute") and
+                 (params.get("DBInstanceId") or params.get("DBClusterId")) in ('rm-fake-00000', 'pc-fake-00000')):
+            return 400, {"Code": "Throttling.User", "Message": "Request was denied due to user flow control.",
+                         "RequestId": "fake"}
+        return super(RegionThrottlingClient, self).common(product, timeout, **params)
+
+
+class RetryExhaustedTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_main(self, module, id_flag, extra_args=(), fake=None, ids='all'):
+        api = module.Custom()
+        api.out = {}
+        # 每个实例150条慢查询，DescribeSlowLogs 需要翻2页
+        api.aliyun = AliyunApiCaller(fake or PageThrottlingClient(2, sql_per_instance=150), tries=1,
+                                     metrics=api.metrics)
+        argv = [id_flag, ids, '--OutDir', self.tmpdir.name, '--CacheDir', self.tmpdir.name] + list(extra_args)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            module.main(argv, api)
+        reports = sorted(filter(lambda x: x.startswith('report-'), os.listdir(self.tmpdir.name)))
+        return out.getvalue(), reports
+
+    def assert_failed(self, output, reports, failed, ok):
+        self.assertIn('{} 获取慢查询失败'.format(failed), output)
+        self.assertEqual(len(reports), 1)
+        self.assertTrue(reports[0].startswith('report-{}-'.format(ok)))
+
+    def test_rds(self):
+        self.assert_failed(*self.run_main(aliyun_get_rds_slowlog, '--DBInstanceId'),
+                           failed='rm-fake-00000', ok='rm-fake-00001')
+
+    def test_rds_async(self):
+        self.assert_failed(*self.run_main(aliyun_get_rds_slowlog, '--DBInstanceId', ['--AsyncEngine']),
+                           failed='rm-fake-00000', ok='rm-fake-00001')
+
+    def test_polardb(self):
+        self.assert_failed(*self.run_main(aliyun_get_polardb_slowlog, '--DBClusterId'),
+                           failed='pc-fake-00000', ok='pc-fake-00001')
+
+    def test_polardb_async(self):
+        self.assert_failed(*self.run_main(aliyun_get_polardb_slowlog, '--DBClusterId', ['--AsyncEngine']),
+                           failed='pc-fake-00000', ok='pc-fake-00001')
+
+    def test_region_discovery_failure(self):
+        # 4个实例分布在4个地域，cn-shanghai 获取失败，其余3个实例照常生成报告
+        for module, id_flag in ((aliyun_get_rds_slowlog, '--DBInstanceId'),
+                                (aliyun_get_polardb_slowlog, '--DBClusterId')):
+            output, reports = self.run_main(module, id_flag, ['--CacheTTL', '3600'], RegionThrottlingClient(4))
+            self.assertIn('地域 cn-shanghai 获取实例失败', output)
+            self.assertIn('获取实例失败的地域，本次运行不包含这些地域的实例: cn-shanghai', output)
+            self.assertEqual(len(reports), 3)
+            list(map(lambda x: os.remove(os.path.join(self.tmpdir.name, x)), reports))
+            # 不完整的实例清单不写入缓存，恢复后的下一次运行获取全部实例
+            output, reports = self.run_main(module, id_flag, ['--CacheTTL', '3600'], FakeAliyunClient(4))
+            self.assertEqual(len(reports), 4)
+            list(map(lambda x: os.remove(os.path.join(self.tmpdir.name, x)), reports))
+
+    def test_instance_ids_failure(self):
+        for module, id_flag, prefix in ((aliyun_get_rds_slowlog, '--DBInstanceId', 'rm'),
+                                        (aliyun_get_polardb_slowlog, '--DBClusterId', 'pc')):
+            output, reports = self.run_main(module, id_flag, fake=RegionThrottlingClient(4),
+                                            ids='{0}-fake-00000,{0}-fake-00002'.format(prefix))
+            self.assertIn('{}-fake-00000 获取'.format(prefix), output)
+            self.assertEqual(reports, list(filter(lambda x: x.startswith('report-{}-fake-00002-'.format(prefix)),
+                                                  reports)))
+            self.assertEqual(len(reports), 1)
+            os.remove(os.path.join(self.tmpdir.name, reports[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
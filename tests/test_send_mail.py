@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+慢查询报告邮件小工具：通过 main() 使用模拟的阿里云API与SMTP发送邮件
+"""
+# Build-in Modules
+import os
+import sys
+import email
+import tempfile
+import unittest
+from email.header import decode_header
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project Modules
+import aliyun_get_rds_slowlog_send_mail
+import aliyun_get_polardb_slowlog_send_mail
+from aliyun_api_helper import AliyunApiCaller
+from aliyun_fake_client import FakeAliyunClient
+
+
+class FakeSMTP:
+    """
+    模拟的 SMTP_SSL，记录发送的邮件
+    """
+    sent = []
+
+    def __init__(self, host=None, port=None):
+        pass
+
+    def set_debuglevel(self, level):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, from_user, to_users, msg):
+        FakeSMTP.sent.append((from_user, to_users, msg))
+        return {}
+
+    def quit(self):
+        pass
+
+
+def get_subject(msg):
+    return ''.join(map(lambda x: x[0].decode(x[1] or 'utf-8') if isinstance(x[0], bytes) else x[0],
+                       decode_header(email.message_from_string(msg)['Subject'])))
+
+
+class SendMailTest(unittest.TestCase):
+    def setUp(self):
+        FakeSMTP.sent = []
+        self.cache_dir = tempfile.mkdtemp()
+
+    def run_main(self, module, id_flag, extra_args=()):
+        api = module.Custom()
+        api.out = {}
+        api.aliyun = AliyunApiCaller(FakeAliyunClient(1), metrics=api.metrics)
+        argv = [id_flag, 'all', '--ToUsers', 'dba@example.com', '--Client', '测试公司', '--Tag', 'T',
+                '--CacheDir', self.cache_dir] + list(extra_args)
+        with mock.patch('aliyun_mail_helper.smtplib.SMTP_SSL', FakeSMTP):
+            return module.main(argv, api)
+
+    def test_rds_send_one_mail(self):
+        self.assertIsNotNone(self.run_main(aliyun_get_rds_slowlog_send_mail, '--DBInstanceId'))
+        self.assertEqual(len(FakeSMTP.sent), 1)
+        self.assertEqual(FakeSMTP.sent[0][1], ['dba@example.com'])
+        self.assertTrue(get_subject(FakeSMTP.sent[0][2]).startswith('测试公司T'))
+
+    def test_polardb_digest(self):
+        self.run_main(aliyun_get_polardb_slowlog_send_mail, '--DBClusterId', ['--Digest'])
+        self.assertEqual(len(FakeSMTP.sent), 1)
+        self.assertTrue(get_subject(FakeSMTP.sent[0][2]).startswith('测试公司T'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+慢查询历史归档：同一天多次运行按实例合并、共用归档目录的并发写入、NewSlowSQL 标记
+"""
+# Build-in Modules
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project Modules
+import aliyun_get_rds_slowlog
+from aliyun_fleet_aggregate import FleetAggregator
+from aliyun_slowlog_archive import SlowLogArchive, get_day, shift_archive_day
+from aliyun_sql_fingerprint import FingerprintCache
+
+COUNT_KEYS = ('MySQLTotalExecutionCounts',)
+TIME_KEYS = ('MySQLTotalExecutionTimes',)
+
+
+def get_columns(data):
+    """
+    :param data: {实例ID: [(SQLText, 执行次数), ...]}
+    :return: FleetAggregator.get_columns()
+    """
+    aggregator = FleetAggregator(COUNT_KEYS, TIME_KEYS, cache=FingerprintCache())
+    for instance_id, rows in data.items():
+        list(aggregator.tap(instance_id, map(lambda x: {
+            "SQLText": x[0], "MySQLTotalExecutionCounts": x[1], "MySQLTotalExecutionTimes": x[1] * 2,
+            "MaxExecutionTime": x[1]}, rows)))
+    return aggregator.get_columns()
+
+
+def get_rows(columns):
+    """
+    :return: set {(实例ID, 归一化后的SQL, 执行次数), ...}
+    """
+    return set(map(lambda x: (columns["instance_ids"][x[0]], columns["sql_texts"][x[1]], x[2]), zip(
+        columns["instance"].tolist(), columns["fingerprint"].tolist(), columns["counts"].tolist())))
+
+
+class SlowLogArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.archive = SlowLogArchive(self.tmpdir.name)
+        self.day = get_day()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_merge(self):
+        old = get_columns({'rm-a': [("select 1", 1), ("select * from t", 2)],
+                           'rm-b': [("select * from t", 3)]})
+        new = get_columns({'rm-b': [("select * from u", 4)],
+                           'rm-c': [("select * from t", 5)]})
+        # rm-b 以本次运行为准，rm-a 保留旧数据
+        self.assertEqual(get_rows(SlowLogArchive.merge(old, new)), {
+            ('rm-a', 'SELECT ?', 1), ('rm-a', 'SELECT * FROM t', 2),
+            ('rm-b', 'SELECT * FROM u', 4), ('rm-c', 'SELECT * FROM t', 5)})
+
+    def test_save_day_merges_runs(self):
+        self.archive.save_day(self.day, get_columns({'rm-a': [("select 1", 1)], 'rm-b': [("select 2", 2)]}))
+        self.archive.save_day(self.day, get_columns({'rm-b': [("select * from t", 3)]}))
+        self.assertEqual(get_rows(self.archive.load_day(self.day)),
+                         {('rm-a', 'SELECT ?', 1), ('rm-b', 'SELECT * FROM t', 3)})
+
+    def test_concurrent_save_day(self):
+        # 多个定时任务共用 --ArchiveDir，各自的实例都保留，不留下临时文件
+        jobs = list(map(lambda x: get_columns({'rm-{}'.format(x): [("select * from t_{}".format(x), x)]}),
+                        range(8)))
+        threads = list(map(lambda x: threading.Thread(target=self.archive.save_day, args=(self.day, x)), jobs))
+        list(map(lambda x: x.start(), threads))
+        list(map(lambda x: x.join(), threads))
+        self.assertEqual(get_rows(self.archive.load_day(self.day)),
+                         set(map(lambda x: ('rm-{}'.format(x), 'SELECT * FROM t_{}'.format(x), x), range(8))))
+        self.assertEqual(list(filter(lambda x: x.endswith('.tmp'), os.listdir(self.tmpdir.name))), [])
+
+    def test_new_slow_sql(self):
+        api = aliyun_get_rds_slowlog.Custom()
+
+        def get_result():
+            return [{"DBInstanceId": 'rm-a', "sql_list": [{"SQLText": "select * from t where id = 1"},
+                                                         {"SQLText": "select * from u"}]},
+                    {"DBInstanceId": 'rm-b', "sql_list": [{"SQLText": "select * from t where id = 2"}]}]
+
+        aggregator = FleetAggregator(COUNT_KEYS, TIME_KEYS)
+        # 第一次归档时没有历史数据，不标记
+        result = get_result()
+        api.archive_slow_logs(result, aggregator, self.tmpdir.name)
+        self.assertNotIn('NewSlowSQL', result[0]["sql_list"][0])
+
+        self.archive.save_day(shift_archive_day(self.day, -1),
+                              get_columns({'rm-a': [("select * from t where id = 9", 1)]}))
+        result = get_result()
+        api.archive_slow_logs(result, aggregator, self.tmpdir.name)
+        # 只有常量不同的SQL不是新增；同一条SQL出现在新的实例上是新增
+        self.assertEqual(list(map(lambda x: list(map(lambda y: y['NewSlowSQL'], x["sql_list"])), result)),
+                         [[False, True], [True]])
+
+
+if __name__ == '__main__':
+    unittest.main()
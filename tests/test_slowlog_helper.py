@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+慢查询数据处理公共模块：TopK / top_k 与排序后截取前K条一致（包括排序值相同时的顺序），
+scan_records 切分子窗口与不切分的结果一致
+"""
+# Build-in Modules
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project Modules
+from aliyun_api_helper import PAGE_SIZE
+from aliyun_fake_client import FakeAliyunClient, RECORDS_TIME_FORMAT
+from aliyun_slowlog_helper import TopK, top_k, scan_records, to_number, RecordStats
+
+SORT_KEYS = ('MySQLTotalExecutionCounts', 'MaxExecutionTime')
+
+
+def get_items(n, seed=0):
+    """
+    排序值取值范围很小，大量记录排序值相同；包含字符串、空值与缺失的字段
+    """
+    rng = random.Random(seed)
+    items = []
+    for index in range(n):
+        item = {"n": index, "MySQLTotalExecutionCounts": rng.choice([0, 1, 2, 3, '2', '3.0', '', None])}
+        if rng.random() < 0.8:
+            item["MaxExecutionTime"] = rng.randint(0, 2)
+        items.append(item)
+    return items
+
+
+def get_expected(items, k, sort_keys=SORT_KEYS):
+    return sorted(items, key=lambda x: tuple(to_number(x.get(key)) for key in sort_keys), reverse=True)[:k]
+
+
+def get_numbers(items):
+    return list(map(lambda x: x["n"], items))
+
+
+class TopKTest(unittest.TestCase):
+
+    def test_top_k_matches_sorted(self):
+        for seed in range(20):
+            items = get_items(200, seed)
+            for k in (0, 1, 3, 10, 199, 200, 500):
+                with self.subTest(seed=seed, k=k):
+                    self.assertEqual(get_numbers(top_k(iter(items), k, SORT_KEYS)),
+                                     get_numbers(get_expected(items, k)))
+
+    def test_single_sort_key(self):
+        items = get_items(100)
+        self.assertEqual(get_numbers(top_k(items, 10, SORT_KEYS[:1])),
+                         get_numbers(get_expected(items, 10, SORT_KEYS[:1])))
+
+    def test_out_of_order_push_with_seq(self):
+        # 并发翻页时各页的到达顺序不确定，按读取顺序传入 seq 后结果与顺序读取一致
+        for seed in range(10):
+            items = get_items(150, seed)
+            pushes = list(enumerate(items))
+            random.Random(seed).shuffle(pushes)
+            heap = TopK(10, SORT_KEYS)
+            for seq, item in pushes:
+                heap.push(item, seq)
+            with self.subTest(seed=seed):
+                self.assertEqual(get_numbers(heap.result()), get_numbers(get_expected(items, 10)))
+
+
+class ScanRecordsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeAliyunClient(1, records_per_instance=700)
+        self.instance_id = 'rm-fake-00000'
+        self.records = list(map(lambda x: x[1], self.fake.get_records('rds', self.instance_id)))
+        self.sql_list = self.fake.get_sql_list('rds', self.instance_id)[:10]
+        self.params = {
+            "DBInstanceId": self.instance_id,
+            "StartTime": self.fake.records_start.strftime(RECORDS_TIME_FORMAT),
+            "EndTime": (self.fake.records_start + self.fake.records_span).strftime(RECORDS_TIME_FORMAT),
+        }
+
+    def fetch_page(self, page_num, **params):
+        return self.fake.common('rds', Action="DescribeSlowLogRecords", PageSize=PAGE_SIZE, PageNumber=page_num,
+                                **params)[1]
+
+    def get_expected_index(self):
+        wanted = set(map(lambda x: x["SQLHASH"], self.sql_list))
+        host_index = {}
+        for record in self.records:
+            if record["SQLHASH"] in wanted:
+                host_index.setdefault(record["SQLHASH"], record["HostAddress"])
+        return host_index
+
+    def test_host_index(self):
+        expected = self.get_expected_index()
+        for shard_hours in (0, 1, 5, 24, 100):
+            with self.subTest(shard_hours=shard_hours):
+                self.assertEqual(scan_records(self.fetch_page, self.params, self.sql_list,
+                                              shard_hours=shard_hours), expected)
+
+    def test_record_stats(self):
+        expected_stats = RecordStats()
+        expected_index = scan_records(self.fetch_page, self.params, self.sql_list, expected_stats)
+        self.assertEqual(expected_index, self.get_expected_index())
+        for shard_hours in (1, 5, 24):
+            with self.subTest(shard_hours=shard_hours):
+                record_stats = RecordStats()
+                host_index = scan_records(self.fetch_page, self.params, self.sql_list, record_stats,
+                                          shard_hours=shard_hours)
+                self.assertEqual(host_index, expected_index)
+                for _sql in self.sql_list:
+                    sql_hash = _sql["SQLHASH"]
+                    self.assertEqual(record_stats.get_totals(sql_hash), expected_stats.get_totals(sql_hash))
+                    self.assertEqual(record_stats.get_hosts(sql_hash), expected_stats.get_hosts(sql_hash))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+慢查询状态库：翻页中途失败时不覆盖本地数据、不推进水位
+"""
+# Build-in Modules
+import os
+import sys
+import datetime
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project Modules
+from aliyun_api_helper import iter_pages
+from aliyun_slowlog_store import SlowLogStore, shift_day, DAY_FORMAT
+
+PAGE_SIZE = 2
+ITEMS_PATH = ("Items", "SQLSlowLog")
+
+
+def get_row(day, n):
+    return {"CreateTime": day, "DBName": "db", "SQLText": "select {}".format(n), "MySQLTotalExecutionCounts": n}
+
+
+def get_fetch_page(rows, fail_page=None, error=None):
+    """
+    模拟 DescribeSlowLogs 的分页返回，fail_page 页返回 error，默认为 {}（重试耗尽时的旧行为）
+    """
+    def fetch_page(page_num):
+        if page_num == fail_page:
+            return error or {}
+        page_rows = rows[(page_num - 1) * PAGE_SIZE:page_num * PAGE_SIZE]
+        return {"TotalRecordCount": len(rows), "Items": {"SQLSlowLog": page_rows}}
+    return fetch_page
+
+
+class SlowLogStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = SlowLogStore(os.path.join(self.tmpdir.name, 'slowlog.db'))
+        self.day = shift_day(datetime.datetime.now().strftime(DAY_FORMAT), -2)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def save(self, rows, fail_page=None, error=None):
+        progress = {}
+        saved = self.store.save_slow_logs(
+            'rm-1', iter_pages(get_fetch_page(rows, fail_page, error), ITEMS_PATH, PAGE_SIZE, progress),
+            self.day, self.day, progress=progress)
+        return saved, list(self.store.iter_slow_logs('rm-1', self.day, self.day))
+
+    def test_complete_fetch_advances_watermark(self):
+        saved, stored = self.save(list(map(lambda x: get_row(self.day, x), range(5))))
+        self.assertTrue(saved)
+        self.assertEqual(len(stored), 5)
+        self.assertEqual(self.store.get_fetch_start('rm-1', self.day), shift_day(self.day, 1))
+
+    def test_short_fetch_keeps_data_and_watermark(self):
+        self.save(list(map(lambda x: get_row(self.day, x), range(5))))
+        # 水位回退后重新请求，第2页失败
+        with self.store.conn:
+            self.store.conn.execute("DELETE FROM watermark")
+        saved, stored = self.save(list(map(lambda x: get_row(self.day, x), range(10, 16))), fail_page=2)
+        self.assertFalse(saved)
+        self.assertEqual(sorted(map(lambda x: x["SQLText"], stored)),
+                         list(map(lambda x: "select {}".format(x), range(5))))
+        self.assertEqual(self.store.get_fetch_start('rm-1', self.day), self.day)
+
+    def test_error_response_keeps_data_and_watermark(self):
+        self.save(list(map(lambda x: get_row(self.day, x), range(3))))
+        with self.store.conn:
+            self.store.conn.execute("DELETE FROM watermark")
+        # 没有权限等不可重试的错误：没有列表和 TotalRecordCount，不是空结果
+        saved, stored = self.save([], fail_page=1, error={"Code": "Forbidden.RAM", "Message": "denied",
+                                                          "RequestId": "fake"})
+        self.assertFalse(saved)
+        self.assertEqual(len(stored), 3)
+        self.assertEqual(self.store.get_fetch_start('rm-1', self.day), self.day)
+
+    def test_empty_complete_fetch_clears_range(self):
+        self.save(list(map(lambda x: get_row(self.day, x), range(3))))
+        with self.store.conn:
+            self.store.conn.execute("DELETE FROM watermark")
+        saved, stored = self.save([])
+        self.assertTrue(saved)
+        self.assertEqual(stored, [])
+        self.assertEqual(self.store.get_fetch_start('rm-1', self.day), shift_day(self.day, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
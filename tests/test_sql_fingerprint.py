@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+SQL 归一化与指纹：常量、IN 列表、VALUES、注释与空白的归一化，FingerprintCache 的 LRU 淘汰
+"""
+# Build-in Modules
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Project Modules
+from aliyun_sql_fingerprint import normalize_sql, fingerprint_sql, get_fingerprint, FingerprintCache
+
+# (原始SQL, 归一化后的SQL)
+NORMALIZE_CASES = (
+    # 字符串、数字常量
+    ("select * from t where a = 'x' and b=12", "SELECT * FROM t WHERE a = ? AND b = ?"),
+    ("select * from t where x = 1.5e3 and y = -1 and z = 0x1F", "SELECT * FROM t WHERE x = ? AND y = ? AND z = ?"),
+    ("update t set name = 'it''s' where id = 3", "UPDATE t SET name = ? WHERE id = ?"),
+    # IN 列表
+    ("select * from t where id in (1, 2,3)", "SELECT * FROM t WHERE id IN (?)"),
+    ("select * from t where id IN(1)", "SELECT * FROM t WHERE id IN (?)"),
+    ("select * from t where name in ('a','b') and id in (4,5,6,7)",
+     "SELECT * FROM t WHERE name IN (?) AND id IN (?)"),
+    # VALUES 多组合并为一组
+    ("insert into t (a,b) values (1,'a'),(2,'b'),(3,'c')", "INSERT INTO t (a, b) VALUES (?, ?)"),
+    # 注释、空白、结尾的分号
+    ("select /* hint */ a from t -- tail\n", "SELECT a FROM t"),
+    ("select a from t # tail", "SELECT a FROM t"),
+    ("Select  \n a\tfrom   t where x=1;;", "SELECT a FROM t WHERE x = ?"),
+    # 表名、列名保持原样
+    ("select t1.Col from Db.T1 t1", "SELECT t1.Col FROM Db.T1 t1"),
+    ("", ""),
+)
+
+
+class NormalizeSqlTest(unittest.TestCase):
+
+    def test_normalize(self):
+        for sql_text, expected in NORMALIZE_CASES:
+            with self.subTest(sql_text=sql_text):
+                self.assertEqual(normalize_sql(sql_text), expected)
+
+    def test_none(self):
+        self.assertEqual(normalize_sql(None), '')
+
+    def test_same_fingerprint(self):
+        self.assertEqual(get_fingerprint("select * from t where id in (1,2) -- a", FingerprintCache()),
+                         get_fingerprint("SELECT *\nFROM t WHERE id IN (7)", FingerprintCache()))
+        self.assertNotEqual(get_fingerprint("select a from t", FingerprintCache()),
+                            get_fingerprint("select b from t", FingerprintCache()))
+
+
+class FingerprintCacheTest(unittest.TestCase):
+
+    def test_value(self):
+        cache = FingerprintCache()
+        normalized = normalize_sql("select 1")
+        self.assertEqual(cache.get("select 1"), (fingerprint_sql(normalized), normalized))
+
+    def test_hits_and_misses(self):
+        cache = FingerprintCache()
+        cache.get("select 1")
+        cache.get("select 1")
+        cache.get("select 2")
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_lru_eviction(self):
+        cache = FingerprintCache(maxsize=2)
+        cache.get("select a from t")
+        cache.get("select b from t")
+        # 访问 a 后 b 成为最久未使用的条目，加入 c 时淘汰 b
+        cache.get("select a from t")
+        cache.get("select c from t")
+        self.assertEqual(len(cache.cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        cache.get("select a from t")
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+        cache.get("select b from t")
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+        self.assertEqual(len(cache.cache), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()